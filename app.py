@@ -8,7 +8,9 @@ import logging
 import atexit
 
 from features.ai_parser import parse_natural_language 
-from linebot import LineBotApi, WebhookHandler
+from features.time_parser import parse_time_expression, is_confident
+from features.intent_classifier import classify_intent, record_parse, intent_stats
+from linebot import WebhookHandler
 from linebot.exceptions import InvalidSignatureError, LineBotApiError
 from linebot.models import (
     MessageEvent, TextMessage, TextSendMessage, PostbackEvent,
@@ -17,14 +19,26 @@ from linebot.models import (
     PostbackAction, ButtonsTemplate, DatetimePickerTemplateAction
 )
 from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.jobstores.memory import MemoryJobStore
 from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.schedulers.base import STATE_STOPPED, STATE_RUNNING, STATE_PAUSED
 import pytz
 
 from db import *
-from db import DATABASE_URL
 # 移除 scraper 匯入
 from features import reminder, location, recurring_reminder, memory, credit_card
+from features.dispatcher import is_dispatcher_mode, is_claim_current, start_dispatcher, stop_dispatcher, dispatcher_stats, DISPATCH_JOBSTORE
+from features.job_reconciler import reconcile_jobs
+from features.event_jobstore import EventJobStore
+from features.webhook_inbox import WebhookInbox, is_inbox_enabled
+from features.state_store import create_state_store
+from features.catch_up import catch_up_missed, start_heartbeat
+from features.recurrence import compile_rule, normalize_rule, rule_of
+from features.recurring_slots import slots_for_rule
+from features.line_client import LineClient, AfterCommitReplies
+from features.outbox import enqueue_push, deliver_all, is_coalescing, start_outbox_worker
+from features.profile_cache import get_display_name, profile_cache_stats
+from features.leader import is_leader_election_enabled, start_leader_election, is_leader
 
 # =========== 🔎 抓鬼大隊：開機檢查 (插入在最上面) ===========
 print("="*50)
@@ -59,7 +73,8 @@ print("="*50)
 
 
 app = Flask(__name__)
-user_states = {}
+# 使用者進行中的多步驟操作 (STATE_STORE=db 時存在資料庫，多個 worker 共用)
+state_store = create_state_store()
 logging.basicConfig(level=logging.INFO)
 logging.getLogger('apscheduler').setLevel(logging.DEBUG) 
 logger = logging.getLogger(__name__)
@@ -72,134 +87,136 @@ LINE_CHANNEL_SECRET = '74df866d9f3f4c47f3d5e86d67fcb673'
 TAIPEI_TZ = pytz.timezone('Asia/Taipei')
 UTC_TZ = pytz.UTC
 
+SCHEDULER_THREADS = int(os.environ.get('SCHEDULER_THREADS', 5))
+executors = {'default': ThreadPoolExecutor(max_workers=SCHEDULER_THREADS)}
+job_defaults = {'coalesce': True, 'max_instances': 1, 'misfire_grace_time': 30}
+# 提醒的 job 直接由 events 推導 (不再另存 pickle 過的 apscheduler_jobs)；
+# 派送器模式直接輪詢 events.next_run_time，不需要逐筆 job
+event_jobstore = None if is_dispatcher_mode() else EventJobStore(TAIPEI_TZ, job_defaults)
 jobstores = {
-    'default': SQLAlchemyJobStore(
-        url=DATABASE_URL,
-        engine_options={
-            "pool_pre_ping": True,
-            "pool_recycle": 300
-        }
-    )
+    'default': event_jobstore or MemoryJobStore(),
+    DISPATCH_JOBSTORE: MemoryJobStore()
 }
-executors = {'default': ThreadPoolExecutor(max_workers=5)}
-job_defaults = {'coalesce': True, 'max_instances': 1, 'misfire_grace_time': 30}
 scheduler_lock = threading.Lock()
 scheduler = BackgroundScheduler(jobstores=jobstores, executors=executors, job_defaults=job_defaults, timezone=TAIPEI_TZ)
+def prepare_jobs():
+    """
+    jobs 模式啟動排程器之前的準備：補齊週期規則、next_run_time 與時段索引，並補發停機期間錯過的提醒。
+    必須在 scheduler.start() 之前同步執行：EventJobStore 會把已過期的提醒交給排程器，
+    超過 misfire_grace_time 的會被當成 misfire 略過並清掉 next_run_time，之後補發就再也找不到。
+    """
+    with app.app_context():
+        try:
+            logger.info(f"♻️ 週期規則正規化: {backfill_recurrence_specs(normalize_rule)}")
+            backfill_next_run_times(compute_recurring_next)
+            logger.info(f"♻️ 週期提醒時段索引: {backfill_recurring_slots(slots_for_rule)}")
+            # 排程器不會補發已過期的 job，所有已到期的提醒都交給補發處理
+            catch_up_missed(line_bot_api, TAIPEI_TZ, grace_seconds=0)
+        except Exception as e:
+            logger.error(f"❌ 排程啟動前的補發過程發生錯誤: {e}")
+
 def restore_jobs():
     """
-    從資料庫讀取所有「週期性提醒」與「未發送的一次性提醒」，
-    並將它們重新加入排程器。
+    以資料庫為準對帳排程器：補上缺少的任務、移除已刪除事件的任務，
+    並重新註冊觸發時間不一致的任務。
     """
     with app.app_context():
-        # 為了避免循環引用，這裡才 import db
-        from db import get_db, Event
-        
-        db = next(get_db())
         try:
             logger.info("♻️ 正在檢查並修復排程任務...")
-            
-            # 1. 找出所有【週期性提醒】(這些永遠需要被排程)
-            recurring_events = db.query(Event).filter(Event.is_recurring == 1).all()
-            
-            # 2. 找出所有【未發送】且【時間在未來】的一次性提醒
-            now = datetime.now(TAIPEI_TZ)
-            future_events = db.query(Event).filter(
-                Event.reminder_sent == 0,
-                Event.is_recurring == 0,
-                Event.reminder_time > now # 注意：這裡是檢查 reminder_time
-            ).all()
-
-            all_events = recurring_events + future_events
-            restored_count = 0
-
-            for event in all_events:
-                # 根據事件類型決定 Job ID
-                job_id = f"recurring_{event.id}" if event.is_recurring else f"reminder_{event.id}"
-                
-                # 如果排程器裡還沒有這個任務，就加進去
-                if not scheduler.get_job(job_id):
-                    try:
-                        if event.is_recurring:
-                            # 解析週期規則 (例如: "MON,WED|23:00")
-                            rule_parts = event.recurrence_rule.split('|')
-                            days_code = rule_parts[0].lower() # mon,wed
-                            time_parts = rule_parts[1].split(':')
-                            hour = int(time_parts[0])
-                            minute = int(time_parts[1])
-                            
-                            scheduler.add_job(
-                                send_reminder,
-                                trigger='cron',
-                                args=[event.id],
-                                id=job_id,
-                                day_of_week=days_code,
-                                hour=hour,
-                                minute=minute,
-                                timezone=TAIPEI_TZ,
-                                replace_existing=True
-                            )
-                        else:
-                            # 一次性提醒
-                            run_date = event.reminder_time.astimezone(TAIPEI_TZ)
-                            scheduler.add_job(
-                                send_reminder, 
-                                'date', 
-                                run_date=run_date, 
-                                args=[event.id], 
-                                id=job_id,
-                                replace_existing=True
-                            )
-                        
-                        restored_count += 1
-                        logger.info(f"  + 成功修復排程: ID {event.id} ({event.event_content})")
-                    except Exception as e:
-                        logger.error(f"  ! 修復 ID {event.id} 失敗: {e}")
-            
-            logger.info(f"✅ 排程修復完成！共重新註冊 {restored_count} 個任務。")
-
+            reconcile_jobs(scheduler, send_reminder, TAIPEI_TZ, send_recurring_slot)
         except Exception as e:
             logger.error(f"❌ 排程修復過程發生錯誤: {e}")
-        finally:
-            db.close()
+    start_heartbeat(scheduler, TAIPEI_TZ, DISPATCH_JOBSTORE)
+
+def compute_recurring_next(rule_str, after=None):
+    """週期規則在 after (預設現在) 之後的下一次觸發時間，規則已結束時為 None"""
+    return compile_rule(rule_str).next_after(after or datetime.now(TAIPEI_TZ), TAIPEI_TZ)
+
+def bootstrap_dispatcher():
+    """派送器模式的啟動流程：補齊 next_run_time、補發停機期間錯過的提醒，再開始輪詢"""
+    try:
+        backfill_recurrence_specs(normalize_rule)
+        counts = backfill_next_run_times(compute_recurring_next)
+        logger.info(f"♻️ 已補齊 next_run_time: {counts}")
+
+        # 派送器會認領所有已到期的提醒，先在上限內補發停機期間錯過的，其餘推進或略過
+        catch_up_missed(line_bot_api, TAIPEI_TZ)
+    except Exception as e:
+        logger.error(f"❌ 派送器初始化過程發生錯誤: {e}")
+    start_heartbeat(scheduler, TAIPEI_TZ, DISPATCH_JOBSTORE)
+    start_dispatcher(scheduler, send_reminder, TAIPEI_TZ, compute_recurring_next, send_reminders)
 
 def safe_start_scheduler():
     with scheduler_lock:
         try:
-            if not scheduler.running:
+            if scheduler.state == STATE_STOPPED:
+                if not is_dispatcher_mode():
+                    # 錯過的提醒要在排程器開始取出到期 job 之前補發 (派送器模式則由 bootstrap_dispatcher 在開始輪詢前處理)
+                    prepare_jobs()
                 scheduler.start()
                 logger.info("Scheduler started successfully.")
+                start_outbox_worker(scheduler, line_bot_api, DISPATCH_JOBSTORE)
                 
                 # 【關鍵修改】啟動後，立刻執行一次修復任務
                 # 使用 Thread 避免卡住 Web Server 啟動
-                threading.Thread(target=restore_jobs).start()
+                if is_dispatcher_mode():
+                    threading.Thread(target=bootstrap_dispatcher).start()
+                else:
+                    threading.Thread(target=restore_jobs).start()
+            elif scheduler.state == STATE_PAUSED:
+                # 重新成為 leader：先補發卸任期間錯過的提醒，再恢復原本的排程器 (shutdown 後的執行緒池無法再啟動)
+                if is_dispatcher_mode():
+                    bootstrap_dispatcher()
+                    scheduler.resume()
+                else:
+                    prepare_jobs()
+                    scheduler.resume()
+                    threading.Thread(target=restore_jobs).start()
+                logger.info("Scheduler resumed.")
                 
         except Exception as e:
             logger.error(f"Failed to start scheduler: {e}")
 
-try:
-    init_db()
-    safe_start_scheduler()
-    logger.info("Application initialized successfully")
-except Exception as e:
-    logger.error(f"Initialization failed: {e}")
-    exit(1)
+def stop_scheduler():
+    """失去 leader 身分時暫停排程器並丟棄尚未送出的提醒，避免與新的 leader 重複發送 (被丟棄的提醒租約過期後由 leader 重新認領)"""
+    with scheduler_lock:
+        try:
+            if scheduler.state == STATE_RUNNING:
+                scheduler.pause()
+                logger.info(f"Scheduler paused (丟棄發送佇列中的 {stop_dispatcher()} 筆提醒).")
+        except Exception as e:
+            logger.error(f"Failed to stop scheduler: {e}")
 
-line_bot_api = LineBotApi(LINE_CHANNEL_ACCESS_TOKEN)
+# 對外的 LINE 呼叫統一走連線池化、有時限的用戶端 (介面與 LineBotApi 相同)
+line_bot_api = LineClient(LINE_CHANNEL_ACCESS_TOKEN)
+atexit.register(line_bot_api.close)
 handler = WebhookHandler(LINE_CHANNEL_SECRET)
+webhook_inbox = WebhookInbox(handler, LINE_CHANNEL_SECRET)
 
-def send_reminder(event_id):
+def _prepare_reminder(event_id, fire_time=None):
+    """
+    產生提醒訊息並寫入 outbox，同時完成後續的狀態更新 (一個 Unit of Work)。
+    fire_time 為派送器認領時的觸發時間，已被延後、改期時略過這次觸發。
+    回傳 outbox 資料列，不需要發送時回傳 None。
+    """
     try:
-        with app.app_context():
-            event = get_event(event_id)
+        with app.app_context(), unit_of_work():
+            event = get_event(event_id, use_cache=False)
             if not event:
                 logger.warning(f"send_reminder: 找不到 event_id {event_id}，嘗試從排程器中移除。")
                 if scheduler.get_job(f"reminder_{event_id}"): scheduler.remove_job(f"reminder_{event_id}")
                 if scheduler.get_job(f"recurring_{event_id}"): scheduler.remove_job(f"recurring_{event_id}")
-                return
+                return None
 
             if not event.is_recurring and event.reminder_sent:
                 logger.warning(f"send_reminder: event_id {event_id} 已發送，跳過。")
-                return
+                return None
+
+            if fire_time is not None and not is_claim_current(event, fire_time, TAIPEI_TZ):
+                # 認領之後被延後或改了時間：這次觸發作廢，由新的時間重新認領
+                logger.info(f"send_reminder: event_id {event_id} 已改期 (原定 {fire_time:%Y/%m/%d %H:%M})，跳過。")
+                release_event_claim(event_id)
+                return None
 
             destination_id = event.target_id
             display_name = event.target_display_name
@@ -228,21 +245,35 @@ def send_reminder(event_id):
                     ]
                 )
             else:
-                # 週期性
-                time_info = ""
+                # 週期性：個人聊天不需要 @名稱，按鈕也不帶 event_id，
+                # 讓內容相同的週期提醒產生一模一樣的訊息，可以用 multicast 一起送
+                mention = "" if event.target_type == 'user' else f"@{display_name}\n"
                 template = ButtonsTemplate(
-                    text=f"⏰ 提醒！\n\n@{display_name}\n記得{time_info}要「{event_content}」喔！",
+                    text=f"⏰ 提醒！\n\n{mention}記得要「{event_content}」喔！",
                     actions=[
-                        PostbackTemplateAction(label="OK", data=f"action=confirm_reminder&id={event_id}")
+                        PostbackTemplateAction(label="OK", data="action=confirm_recurring")
                     ]
                 )
 
             template_message = TemplateSendMessage(alt_text=f"提醒：{event_content}", template=template)
-            line_bot_api.push_message(destination_id, template_message)
-            logger.info(f"成功發送提醒 for event_id: {event_id}")
+            # 先寫入 outbox，與後續的狀態更新一起 commit；送不出去時由 outbox 重試
+            outbox_row = enqueue_push(destination_id, template_message, event_id=event_id)
+            # 已交給 outbox，派送器的認領租約可以釋放 (與 outbox 寫入一起 commit)
+            release_event_claim(event_id)
 
             # --- 處理後續動作 ---
-            if not event.is_recurring:
+            if event.is_recurring:
+                # 週期提醒：推進到下一次觸發時間；有次數或結束日的規則用完後標記完成
+                rule = rule_of(event)
+                next_time = rule.next_after(datetime.now(TAIPEI_TZ), TAIPEI_TZ)
+                if next_time is None:
+                    mark_reminder_sent(event_id)
+                elif rule.is_slot_based:
+                    set_next_run_time(event_id, next_time)
+                else:
+                    # 不適用時段排程的規則 (每 N 天、每月...) 逐次註冊下一次的 job
+                    safe_add_job(send_reminder, next_time, [event_id], f'reminder_{event_id}')
+            else:
                 if event.priority_level > 0 and event.remaining_repeats > 0:
                     # 重要提醒：重試
                     from features.reminder import PRIORITY_RULES
@@ -260,20 +291,70 @@ def send_reminder(event_id):
                          from db import delete_event_by_id
                          delete_event_by_id(event_id, event.creator_user_id)
 
+            return outbox_row
+
     except Exception as e:
         logger.error(f"Error in send_reminder for event_id {event_id}: {e}", exc_info=True)
+        return None
+
+def send_reminder(event_id, fire_time=None):
+    send_reminders([event_id], fire_time)
+
+def send_reminders(event_ids, fire_time=None):
+    """
+    發送一批同時到期的提醒：逐筆寫入 outbox 並 commit 之後才真正送出。
+    內容相同的個人提醒會以 multicast 一起送；開啟合併時則整批交給 outbox。
+    fire_time 由派送器傳入 (認領時的觸發時間)，APScheduler 的 job 直接依目前的 next_run_time 觸發，不需要。
+    """
+    rows = [row for row in (_prepare_reminder(event_id, fire_time) for event_id in event_ids) if row]
+    if not rows or is_coalescing():
+        return
+    try:
+        sent, calls = deliver_all(line_bot_api, rows)
+        logger.info(f"成功發送提醒 {sent}/{len(rows)} 筆 (API 呼叫 {calls} 次) for event_id: {list(event_ids)}")
+    except Exception as e:
+        logger.error(f"Error delivering reminders {list(event_ids)}: {e}", exc_info=True)
+
+def send_recurring_slot(slot):
+    """週期提醒時段的 cron job：查出該時段的所有提醒一起發送"""
+    event_ids = get_slot_event_ids(slot)
+    if event_ids:
+        send_reminders(event_ids)
+
+if event_jobstore:
+    event_jobstore.bind(send_reminder, send_recurring_slot)
 
 def safe_add_job(func, run_date, args, job_id):
     try:
-        with scheduler_lock:
-            if not scheduler.running: safe_start_scheduler()
-            run_date_utc = run_date.astimezone(UTC_TZ)
-            scheduler.add_job(func, 'date', run_date=run_date_utc, args=args, id=job_id, replace_existing=True)
+        # 不論哪種模式都讓 events.next_run_time 保持最新
+        set_next_run_time(args[0], run_date)
+        if is_dispatcher_mode():
+            # 派送器會從 next_run_time 撈出到期的提醒，不需逐筆註冊 job
             return True
+        # 寫入 next_run_time 就等於註冊了 job (見 EventJobStore)，只需喚醒排程器重新計算下一次觸發
+        # (在 Unit of Work 中要等 commit 之後，排程器才讀得到新的時間)
+        if scheduler.running:
+            after_commit(scheduler.wakeup)
+        return True
     except Exception as e:
         logger.error(f"Error scheduling job {job_id}: {e}", exc_info=True)
         return False
 
+try:
+    init_db()
+    if is_inbox_enabled():
+        # 每個 worker 行程都處理 inbox (排程器則只在 leader 執行)
+        webhook_inbox.start()
+    if is_leader_election_enabled():
+        # 多個 worker 時只有 leader 啟動排程器，其餘 worker 只處理 webhook
+        start_leader_election(safe_start_scheduler, stop_scheduler)
+    else:
+        safe_start_scheduler()
+    logger.info("Application initialized successfully")
+except Exception as e:
+    logger.error(f"Initialization failed: {e}")
+    exit(1)
+
 def send_help_message(reply_token):
     help_text = """--- 提醒功能 ---
 提醒 [誰] [日期] [時間] [事件]
@@ -307,13 +388,155 @@ def callback():
     signature = request.headers['X-Line-Signature']
     body = request.get_data(as_text=True)
     try:
-        handler.handle(body, signature)
+        if is_inbox_enabled():
+            # 只驗證簽章並寫入 inbox，立即回應；事件由背景 worker 處理
+            webhook_inbox.ingest(body, signature)
+        else:
+            # 依使用者分派：不同使用者的事件平行處理，同一位使用者依序處理
+            webhook_inbox.handle_inline(body, signature)
     except InvalidSignatureError:
         abort(400)
     except Exception as e:
         logger.error(f"Error in callback handler: {e}", exc_info=True)
+        if is_inbox_enabled():
+            # inbox 寫入失敗 (例如資料庫暫時無法連線) 時退回同步處理，避免遺失事件
+            try:
+                webhook_inbox.handle_inline(body, signature)
+            except Exception as e:
+                logger.error(f"Error in fallback callback handler: {e}", exc_info=True)
     return 'OK'
 
+def _handle_text_command(event, text, state, replies, now_in_taipei):
+    """
+    對話流程、卡片與固定指令：只有資料庫操作與回覆，由呼叫端包在一個 Unit of Work 中，
+    回覆 (replies) 在 commit 之後才送出。已處理回傳 True；刷卡查詢、說明與 AI 解析回傳 False 交給呼叫端。
+    """
+    user_id = event.source.user_id
+
+    # 1. 優先處理【取消】指令
+    if text == '取消':
+        if state_store.pop(user_id) is not None:
+            replies.reply_message(event.reply_token, TextSendMessage(text="好的，已取消目前操作。"))
+        else:
+            replies.reply_message(event.reply_token, TextSendMessage(text="目前沒有進行中的操作喔！"))
+        return True
+
+    # 2. 處理【使用者狀態】(進行中的流程)
+    if state is not None:
+        state_action = state.action
+        if state_action == 'awaiting_loc_name':
+            location.handle_save_location_command(event, replies, state_store)
+            return True
+        elif state_action == 'awaiting_recurring_content':
+            recurring_reminder.handle_content_input(event, replies, state_store, scheduler, send_recurring_slot, TAIPEI_TZ, send_reminder)
+            return True
+        elif state_action == 'setting_priority':
+            replies.reply_message(event.reply_token, TextSendMessage(text="請點擊上方按鈕選擇重要程度。"))
+            return True
+        elif state_action == 'setting_priority_time':
+             replies.reply_message(event.reply_token, TextSendMessage(text="請點擊上方按鈕選擇時間。"))
+             return True
+         # --- 【新增】編輯內容的狀態處理 ---
+        elif state_action == 'awaiting_edit_content':
+            event_id = state.event_id
+            original_content = state.original_content
+        
+            # 判斷是「補充」還是「覆蓋」
+            if text.startswith('+') or text.startswith('＋'):
+                # 補充模式：去掉加號，接在後面
+                append_text = text[1:].strip()
+                new_content = f"{original_content} ({append_text})"
+                mode_msg = "補充"
+            else:
+                # 覆蓋模式
+                new_content = text
+                mode_msg = "修改"
+        
+            # 執行更新 (確保 update_event_content 有從 db 匯入，或是直接在這裡 import)
+            from db import update_event_content 
+            if update_event_content(event_id, new_content):
+                replies.reply_message(event.reply_token, TextSendMessage(text=f"✅ 已{mode_msg}內容為：\n{new_content}"))
+            else:
+                replies.reply_message(event.reply_token, TextSendMessage(text="❌ 更新失敗，找不到該提醒。"))
+        
+            # 清除狀態
+            state_store.pop(user_id)
+            return True
+        
+    if text.startswith('新增卡片'):
+        card_name = text.replace('新增卡片', '').strip()
+        if not card_name:
+            replies.reply_message(event.reply_token, TextSendMessage(text="❌ 請輸入卡片名稱。\n範例：新增卡片 國泰CUBE"))
+            return True
+    
+        result = add_user_card(user_id, card_name)
+        if result == "成功":
+            replies.reply_message(event.reply_token, TextSendMessage(text=f"✅ 已新增卡片：{card_name}"))
+        else:
+            replies.reply_message(event.reply_token, TextSendMessage(text=f"⚠️ 新增失敗：{result} (可能已存在)"))
+        return True
+
+    elif text.startswith('刪除卡片'):
+        card_name = text.replace('刪除卡片', '').strip()
+        if delete_user_card(user_id, card_name):
+            replies.reply_message(event.reply_token, TextSendMessage(text=f"🗑️ 已刪除卡片：{card_name}"))
+        else:
+            replies.reply_message(event.reply_token, TextSendMessage(text=f"❌ 找不到卡片：{card_name}"))
+        return True
+
+    elif text == '我的卡包':
+        cards = get_user_cards(user_id)
+        if cards:
+            cards_str = "\n".join([f"💳 {c}" for c in cards])
+            replies.reply_message(event.reply_token, TextSendMessage(text=f"您的信用卡：\n{cards_str}"))
+        else:
+            replies.reply_message(event.reply_token, TextSendMessage(text="您還沒有設定任何信用卡喔！\n請輸入：新增卡片 [名稱]"))
+        return True
+
+    # 刷卡回饋查詢會呼叫 Gemini，交給呼叫端在 Unit of Work 之外處理
+    elif text.startswith('刷 '):
+        return False
+
+    # 3. 處理【固定指令】
+    if text == '提醒清單':
+        reminder.handle_list_reminders(event, replies)
+        return True
+    elif text.startswith('重要提醒'):
+        reminder.handle_priority_reminder_command(event, replies, state_store, TAIPEI_TZ)
+        return True
+    elif text.startswith('提醒'):
+        reminder.handle_reminder_command(event, replies, TAIPEI_TZ, now_in_taipei)
+        return True
+    elif text == '週期提醒':
+        recurring_reminder.start_flow(event, replies, state_store)
+        return True
+    elif text.startswith("刪除提醒ID:"):
+        reminder.handle_delete_reminder_command(event, replies, scheduler)
+        return True
+    elif text.startswith('刪除地點：'):
+        location.handle_delete_location_command(event, replies)
+        return True
+    elif text.startswith('找地點'):
+        location.handle_find_location_command(event, replies)
+        return True
+    elif text == '地點清單' or text.lower() == '地點':
+        location.handle_list_locations_command(event, replies)
+        return True
+    elif text.startswith('記住') or text.startswith('查詢') or text.startswith('忘記') or text == '記憶清單':
+        memory.handle_memory_command(event, replies)
+        return True
+    return False
+
+def _warm_display_name(event, text, state):
+    """會用到顯示名稱的流程 (提醒指令、週期提醒的內容) 先在 Unit of Work 之外查好，交易中直接命中快取"""
+    if state is not None:
+        needed = state.action == 'awaiting_recurring_content'
+    else:
+        needed = text.startswith('提醒') and text != '提醒清單'
+    if needed:
+        source = event.source
+        get_display_name(line_bot_api, source.type, getattr(source, f'{source.type}_id', source.user_id), source.user_id)
+
 @handler.add(MessageEvent, message=TextMessage)
 def handle_message(event):
     text = event.message.text.strip()
@@ -321,260 +544,159 @@ def handle_message(event):
     # 取得來源類型: 'user', 'group', or 'room'
     source_type = event.source.type
 
-    # 【重點】這裡開始 try，對應最後面的 except
-    try:
-        now_in_taipei = datetime.now(TAIPEI_TZ)
+    # 同一位使用者的事件依序處理 (每位使用者各自一把鎖)。
+    # 每個操作的資料庫寫入包在一個 Unit of Work 中一次 commit，回覆在 commit 之後才送出；
+    # Gemini 與查詢顯示名稱等對外呼叫都在 Unit of Work 之外，不佔用交易與連線
+    with state_store.lock(user_id):
+        # 【重點】這裡開始 try，對應最後面的 except
+        try:
+            now_in_taipei = datetime.now(TAIPEI_TZ)
 
-        # 1. 優先處理【取消】指令
-        if text == '取消':
-            if user_id in user_states:
-                del user_states[user_id]
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text="好的，已取消目前操作。"))
-            else:
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text="目前沒有進行中的操作喔！"))
-            return
-
-        # 2. 處理【使用者狀態】(進行中的流程)
-        if user_id in user_states:
-            state_action = user_states[user_id].get('action')
-            if state_action == 'awaiting_loc_name':
-                location.handle_save_location_command(event, line_bot_api, user_states)
-                return
-            elif state_action == 'awaiting_recurring_content':
-                recurring_reminder.handle_content_input(event, line_bot_api, user_states, scheduler, send_reminder, TAIPEI_TZ)
-                return
-            elif state_action == 'setting_priority':
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text="請點擊上方按鈕選擇重要程度。"))
-                return
-            elif state_action == 'setting_priority_time':
-                 line_bot_api.reply_message(event.reply_token, TextSendMessage(text="請點擊上方按鈕選擇時間。"))
-                 return
-             # --- 【新增】編輯內容的狀態處理 ---
-            elif state_action == 'awaiting_edit_content':
-                event_id = user_states[user_id].get('event_id')
-                original_content = user_states[user_id].get('original_content')
-                
-                # 判斷是「補充」還是「覆蓋」
-                if text.startswith('+') or text.startswith('＋'):
-                    # 補充模式：去掉加號，接在後面
-                    append_text = text[1:].strip()
-                    new_content = f"{original_content} ({append_text})"
-                    mode_msg = "補充"
-                else:
-                    # 覆蓋模式
-                    new_content = text
-                    mode_msg = "修改"
-                
-                # 執行更新 (確保 update_event_content 有從 db 匯入，或是直接在這裡 import)
-                from db import update_event_content 
-                if update_event_content(event_id, new_content):
-                    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"✅ 已{mode_msg}內容為：\n{new_content}"))
-                else:
-                    line_bot_api.reply_message(event.reply_token, TextSendMessage(text="❌ 更新失敗，找不到該提醒。"))
-                
-                # 清除狀態
-                del user_states[user_id]
+            state = state_store.get(user_id) if text != '取消' else None
+            _warm_display_name(event, text, state)
+            with unit_of_work():
+                handled = _handle_text_command(event, text, state, AfterCommitReplies(line_bot_api), now_in_taipei)
+            if handled:
                 return
-                
-        if text.startswith('新增卡片'):
-            card_name = text.replace('新增卡片', '').strip()
-            if not card_name:
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text="❌ 請輸入卡片名稱。\n範例：新增卡片 國泰CUBE"))
-                return
-            
-            result = add_user_card(user_id, card_name)
-            if result == "成功":
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"✅ 已新增卡片：{card_name}"))
-            else:
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"⚠️ 新增失敗：{result} (可能已存在)"))
-            return
 
-        elif text.startswith('刪除卡片'):
-            card_name = text.replace('刪除卡片', '').strip()
-            if delete_user_card(user_id, card_name):
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"🗑️ 已刪除卡片：{card_name}"))
-            else:
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"❌ 找不到卡片：{card_name}"))
-            return
-
-        elif text == '我的卡包':
-            cards = get_user_cards(user_id)
-            if cards:
-                cards_str = "\n".join([f"💳 {c}" for c in cards])
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"您的信用卡：\n{cards_str}"))
-            else:
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text="您還沒有設定任何信用卡喔！\n請輸入：新增卡片 [名稱]"))
-            return
-
-        # --- 【新增】刷卡回饋查詢 ---
-        elif text.startswith('刷 '):
-            merchant = text[2:].strip() # 去掉前面的 "刷 "
-            if not merchant: return
+            # --- 【新增】刷卡回饋查詢 ---
+            if text.startswith('刷 '):
+                merchant = text[2:].strip() # 去掉前面的 "刷 "
+                if not merchant: return
             
-            # 為了避免使用者等待太久以為當機，可以先回傳一個 Loading 動畫或是文字
-            # 但 LINE Reply Token 只能用一次，所以我們直接讓它轉圈圈等待 AI 回覆
-            # 若要優化體驗，建議未來可以用 Push Message 做「查詢中...」的效果
+                # 為了避免使用者等待太久以為當機，可以先回傳一個 Loading 動畫或是文字
+                # 但 LINE Reply Token 只能用一次，所以我們直接讓它轉圈圈等待 AI 回覆
+                # 若要優化體驗，建議未來可以用 Push Message 做「查詢中...」的效果
             
-            try:
-                # 呼叫 features/credit_card.py 裡的分析函式
-                analysis_result = credit_card.analyze_best_card(user_id, merchant)
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text=analysis_result))
-            except Exception as e:
-                logger.error(f"Credit Card Analysis Error: {e}")
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text="❌ 分析失敗，請稍後再試。"))
-            return
-
-        # 3. 處理【固定指令】
-        if text == '提醒清單':
-            reminder.handle_list_reminders(event, line_bot_api)
-            return
-        elif text.startswith('重要提醒'):
-            reminder.handle_priority_reminder_command(event, line_bot_api, user_states, TAIPEI_TZ)
-            return
-        elif text.startswith('提醒'):
-            reminder.handle_reminder_command(event, line_bot_api, TAIPEI_TZ, now_in_taipei)
-            return
-        elif text == '週期提醒':
-            recurring_reminder.start_flow(event, line_bot_api, user_states)
-            return
-        elif text.startswith("刪除提醒ID:"):
-            reminder.handle_delete_reminder_command(event, line_bot_api, scheduler)
-            return
-        elif text.startswith('刪除地點：'):
-            location.handle_delete_location_command(event, line_bot_api)
-            return
-        elif text.startswith('找地點'):
-            location.handle_find_location_command(event, line_bot_api)
-            return
-        elif text == '地點清單' or text.lower() == '地點':
-            location.handle_list_locations_command(event, line_bot_api)
-            return
-        elif text.startswith('記住') or text.startswith('查詢') or text.startswith('忘記') or text == '記憶清單':
-            memory.handle_memory_command(event, line_bot_api)
-            return
-        elif text.lower() in ['help', '說明', '幫助']:
-            send_help_message(event.reply_token)
-            return
-
-        # --- 4. AI 智慧解析區塊 ---
-        # 條件：訊息長度 > 1 且不是上面那些指令
-        time_keywords = [
-            '明天', '後天', '今天', '下週', '下周', '禮拜', '星期', 
-            '點', '分', '早上', '下午', '晚上', '中午', '半', 
-            '提醒', '幫我', '記得', '後'
-        ]
-        
-        # 判斷邏輯：
-        # 1. 長度要大於 1
-        # 2. 必須包含至少一個時間關鍵字 (或者包含數字)
-        is_potential_reminder = any(k in text for k in time_keywords) or any(char.isdigit() for char in text)
+                try:
+                    # 呼叫 features/credit_card.py 裡的分析函式
+                    analysis_result = credit_card.analyze_best_card(user_id, merchant)
+                    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=analysis_result))
+                except Exception as e:
+                    logger.error(f"Credit Card Analysis Error: {e}")
+                    line_bot_api.reply_message(event.reply_token, TextSendMessage(text="❌ 分析失敗，請稍後再試。"))
+                return
 
-        # 【修改】加上 is_potential_reminder 判斷，沒關鍵字就不問 AI
-        if len(text) > 1 and is_potential_reminder: 
-            try:
-                current_time_str = now_in_taipei.strftime('%Y-%m-%d %H:%M:%S')
-                ai_result = parse_natural_language(text, current_time_str)
+            if text.lower() in ['help', '說明', '幫助']:
+                send_help_message(event.reply_token)
+                return
 
-                if ai_result:
-                    parsed_dt_str = ai_result['event_datetime']
-                    parsed_content = ai_result['event_content']
-                    
-                    naive_dt = datetime.strptime(parsed_dt_str, "%Y-%m-%d %H:%M")
-                    event_dt = TAIPEI_TZ.localize(naive_dt)
-
-                    if event_dt <= now_in_taipei:
-                        line_bot_api.reply_message(event.reply_token, TextSendMessage(text="😅 AI 幫你算出來的時間已經過了，請再說一次。"))
-                        return
-
-                    # 顯示名稱
-                    try:
-                        profile = line_bot_api.get_profile(user_id)
-                        display_name = profile.display_name
-                    except:
-                        display_name = "您"
+            # --- 4. AI 智慧解析區塊 ---
+            # 條件：訊息長度 > 1 且不是上面那些指令
+            # 常見句型先以本地規則解析，再由本地分類器判斷是不是提醒 (「我買了3個蘋果」、群組閒聊不問 AI)
+            local_result = parse_time_expression(text, now_in_taipei) if len(text) > 1 else None
+            if len(text) > 1 and classify_intent(text, source_type, local_result).is_reminder:
+                try:
+                    if is_confident(local_result):
+                        ai_result = local_result
+                        record_parse(used_ai=False)
+                    else:
+                        current_time_str = now_in_taipei.strftime('%Y-%m-%d %H:%M:%S')
+                        ai_result = parse_natural_language(text, current_time_str)
+                        record_parse(used_ai=True)
+
+                    if ai_result:
+                        parsed_dt_str = ai_result['event_datetime']
+                        parsed_content = ai_result['event_content']
                     
-                    target_id = user_id # 預設為個人
-                    if source_type == 'group':
-                        target_id = event.source.group_id
-                    elif source_type == 'room':
-                        target_id = event.source.room_id
+                        naive_dt = datetime.strptime(parsed_dt_str, "%Y-%m-%d %H:%M")
+                        event_dt = TAIPEI_TZ.localize(naive_dt)
+
+                        if event_dt <= now_in_taipei:
+                            line_bot_api.reply_message(event.reply_token, TextSendMessage(text="😅 AI 幫你算出來的時間已經過了，請再說一次。"))
+                            return
+
+                        target_id = user_id # 預設為個人
+                        if source_type == 'group':
+                            target_id = event.source.group_id
+                        elif source_type == 'room':
+                            target_id = event.source.room_id
+
+                        # 顯示名稱 (快取)
+                        display_name = get_display_name(line_bot_api, source_type, target_id, user_id)
                     
-                    # 寫入資料庫
-                    event_id = add_event(
-                        creator_user_id=user_id,
-                        target_id=target_id,      # <--- 改用判斷後的 ID
-                        target_type=source_type,  # <--- 改用來源類型 (group/user)
-                        display_name=display_name,
-                        content=parsed_content,
-                        event_datetime=event_dt,
-                        is_recurring=0
-                    )
-
-                    if event_id:
-                        # 跳出確認按鈕 (已更新為完整選項)
-                        from features.reminder import QuickReply, QuickReplyButton, PostbackAction
-                        quick_reply = QuickReply(items=[
-                            QuickReplyButton(action=PostbackAction(label="10分鐘前", data=f"action=set_reminder&id={event_id}&type=minute&val=10")),
-                            QuickReplyButton(action=PostbackAction(label="30分鐘前", data=f"action=set_reminder&id={event_id}&type=minute&val=30")),
-                            QuickReplyButton(action=PostbackAction(label="1天前", data=f"action=set_reminder&id={event_id}&type=day&val=1")),
-                            QuickReplyButton(action=PostbackAction(label="不提醒", data=f"action=set_reminder&id={event_id}&type=none")),
-                        ])
+                        # 寫入資料庫
+                        event_id = add_event(
+                            creator_user_id=user_id,
+                            target_id=target_id,      # <--- 改用判斷後的 ID
+                            target_type=source_type,  # <--- 改用來源類型 (group/user)
+                            display_name=display_name,
+                            content=parsed_content,
+                            event_datetime=event_dt,
+                            is_recurring=0
+                        )
+
+                        if event_id:
+                            # 跳出確認按鈕 (已更新為完整選項)
+                            from features.reminder import QuickReply, QuickReplyButton, PostbackAction
+                            quick_reply = QuickReply(items=[
+                                QuickReplyButton(action=PostbackAction(label="10分鐘前", data=f"action=set_reminder&id={event_id}&type=minute&val=10")),
+                                QuickReplyButton(action=PostbackAction(label="30分鐘前", data=f"action=set_reminder&id={event_id}&type=minute&val=30")),
+                                QuickReplyButton(action=PostbackAction(label="1天前", data=f"action=set_reminder&id={event_id}&type=day&val=1")),
+                                QuickReplyButton(action=PostbackAction(label="不提醒", data=f"action=set_reminder&id={event_id}&type=none")),
+                            ])
                         
-                        reply_text = f"🤖 AI 設定提醒成功！\n\n時間：{event_dt.strftime('%Y/%m/%d %H:%M')}\n事項：{parsed_content}\n\n要提早提醒嗎？"
-                        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text, quick_reply=quick_reply))
-                        return
-            except Exception as e:
-                logger.error(f"AI Logic Error: {e}")
-                # AI 失敗就繼續往下走
+                            reply_text = f"🤖 AI 設定提醒成功！\n\n時間：{event_dt.strftime('%Y/%m/%d %H:%M')}\n事項：{parsed_content}\n\n要提早提醒嗎？"
+                            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text, quick_reply=quick_reply))
+                            return
+                except Exception as e:
+                    logger.error(f"AI Logic Error: {e}")
+                    # AI 失敗就繼續往下走
         
-        # --- 5. 最終防線 (解決群組太吵) ---
-        if source_type == 'user':
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text="🤔 我聽不太懂，您可以試著說：「明天早上九點提醒我開會」或是輸入「說明」查看指令。"))
-        else:
-            # 群組裡聽不懂就安靜
-            return
-
-    # 【重點】這裡的 except 必須跟最上面的 try 對齊
-    except Exception as e:
-        logger.error(f"Error in handle_message: {e}", exc_info=True)
-        try:
-            # 只有私訊才回報錯誤，避免群組洗頻
+            # --- 5. 最終防線 (解決群組太吵) ---
             if source_type == 'user':
-                line_bot_api.reply_message(event.reply_token, TextSendMessage(text="❌ 處理訊息時發生錯誤，請聯繫開發者。"))
-        except:
-            pass
+                line_bot_api.reply_message(event.reply_token, TextSendMessage(text="🤔 我聽不太懂，您可以試著說：「明天早上九點提醒我開會」或是輸入「說明」查看指令。"))
+            else:
+                # 群組裡聽不懂就安靜
+                return
+
+        # 【重點】這裡的 except 必須跟最上面的 try 對齊
+        except Exception as e:
+            logger.error(f"Error in handle_message: {e}", exc_info=True)
+            try:
+                # 只有私訊才回報錯誤，避免群組洗頻
+                if source_type == 'user':
+                    line_bot_api.reply_message(event.reply_token, TextSendMessage(text="❌ 處理訊息時發生錯誤，請聯繫開發者。"))
+            except:
+                pass
 
 @handler.add(MessageEvent, message=LocationMessage)
 def handle_location_message(event):
     try:
-        location.handle_location_message(event, line_bot_api, user_states)
+        with state_store.lock(event.source.user_id), unit_of_work():
+            location.handle_location_message(event, AfterCommitReplies(line_bot_api), state_store)
     except Exception as e:
         logger.error(f"Error in handle_location_message: {e}", exc_info=True)
 
 @handler.add(PostbackEvent)
 def handle_postback(event):
-    try:
-        data = dict(x.split('=', 1) for x in event.postback.data.split('&'))
-        action = data.get('action', '')
-        user_id = event.source.user_id
+    user_id = event.source.user_id
+    # 與 handle_message 相同：一個按鈕動作的寫入 (例如延後提醒的重設狀態、觸發時間與內容) 在同一個 Unit of Work 中
+    # 一次 commit，中途失敗則整批 rollback；回覆在 commit 之後才送出
+    replies = AfterCommitReplies(line_bot_api)
+    with state_store.lock(user_id):
+        try:
+            data = dict(x.split('=', 1) for x in event.postback.data.split('&'))
+            action = data.get('action', '')
         
-        if action == 'cancel':
-            if user_id in user_states: del user_states[user_id]
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text="操作已取消。"))
-        elif action.startswith('loc_'):
-            location.handle_location_postback(event, line_bot_api, user_states)
-        elif action in ['set_reminder', 'confirm_reminder', 'snooze_reminder', 'snooze_custom', 'set_priority', 'set_priority_time', 'delete_reminder_prompt', 'delete_single', 'refresh_manage_panel', 'edit_prompt', 'edit_content_start', 'edit_time_confirm']:
-            reminder.handle_reminder_postback(event, line_bot_api, scheduler, send_reminder, safe_add_job, TAIPEI_TZ, user_states)
-        elif action in ['toggle_weekday', 'set_recurring_time']:
-            recurring_reminder.handle_postback(event, line_bot_api, user_states)
-        elif action == 'view_memory':
-            memory.handle_memory_postback(event, line_bot_api)
-    except Exception as e:
-        logger.error(f"Error in handle_postback: {e}", exc_info=True)
+            with unit_of_work():
+                if action == 'cancel':
+                    state_store.pop(user_id)
+                    replies.reply_message(event.reply_token, TextSendMessage(text="操作已取消。"))
+                elif action.startswith('loc_'):
+                    location.handle_location_postback(event, replies, state_store)
+                elif action in ['set_reminder', 'confirm_reminder', 'confirm_recurring', 'snooze_reminder', 'snooze_custom', 'set_priority', 'set_priority_time', 'delete_reminder_prompt', 'delete_single', 'refresh_manage_panel', 'edit_prompt', 'edit_content_start', 'edit_time_confirm']:
+                    reminder.handle_reminder_postback(event, replies, scheduler, send_reminder, safe_add_job, TAIPEI_TZ, state_store)
+                elif action in ['toggle_weekday', 'set_recurring_time']:
+                    recurring_reminder.handle_postback(event, replies, state_store)
+                elif action == 'view_memory':
+                    memory.handle_memory_postback(event, replies)
+        except Exception as e:
+            logger.error(f"Error in handle_postback: {e}", exc_info=True)
         
 @app.route("/health")
 def health_check():
-    return {"status": "healthy", "scheduler_running": scheduler.running}
+    return {"status": "healthy", "scheduler_running": scheduler.state == STATE_RUNNING, "is_leader": is_leader(), "dispatcher": dispatcher_stats(), "line_api": line_bot_api.stats(), "profile_cache": profile_cache_stats(), "db_cache": cache_stats(), "webhook_inbox": webhook_inbox.stats(), "state_store": state_store.stats(), "intent": intent_stats()}
 
 @app.route("/")
 def index():
@@ -0,0 +1,104 @@
+# benchmarks/bench_event_updates.py (事件更新函式的往返次數微基準)
+#
+# 比較「先 SELECT 整筆 ORM 物件再 flush」的舊寫法與
+# 單一 UPDATE ... RETURNING 的新寫法，統計 SQL 往返次數與耗時。
+#
+# 執行：python benchmarks/bench_event_updates.py [次數]
+# 預設使用暫存的 SQLite 檔；若要測 Postgres，請先設定 BENCH_DATABASE_URL。
+
+import os
+import sys
+import time
+import tempfile
+
+_tmp_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = os.environ.get('BENCH_DATABASE_URL', f"sqlite:///{_tmp_dir}/bench.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event as sa_event
+import db
+from db import Event, get_db, safe_db_operation
+
+# ---------------------------------
+# 舊版實作 (讀取整筆後修改)
+# ---------------------------------
+
+def legacy_mark_reminder_sent(event_id):
+    def _mark():
+        session = next(get_db())
+        try:
+            event = session.query(Event).filter(Event.id == event_id).first()
+            if event:
+                event.reminder_sent = 1
+                session.commit()
+                return True
+            return False
+        finally:
+            session.close()
+    return safe_db_operation(_mark)
+
+def legacy_decrease_remaining_repeats(event_id):
+    def _decrease():
+        session = next(get_db())
+        try:
+            event = session.query(Event).filter(Event.id == event_id).first()
+            if event and event.remaining_repeats > 0:
+                event.remaining_repeats -= 1
+                session.commit()
+                return event.remaining_repeats
+            return 0
+        finally:
+            session.close()
+    return safe_db_operation(_decrease)
+
+def legacy_update_event_content(event_id, new_content):
+    def _update():
+        session = next(get_db())
+        try:
+            event = session.query(Event).filter(Event.id == event_id).first()
+            if event:
+                event.event_content = new_content
+                session.commit()
+                return True
+            return False
+        finally:
+            session.close()
+    return safe_db_operation(_update)
+
+# ---------------------------------
+# 量測工具
+# ---------------------------------
+
+_statements = [0]
+
+@sa_event.listens_for(db.engine, "before_cursor_execute")
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    _statements[0] += 1
+
+def measure(label, func, ids, *args):
+    _statements[0] = 0
+    start = time.perf_counter()
+    for event_id in ids:
+        func(event_id, *args)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {_statements[0] / len(ids):>6.2f} 次 SQL/呼叫   {elapsed * 1000 / len(ids):>8.3f} ms/呼叫")
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    db.init_db()
+    ids = [
+        db.add_event('bench_user', 'bench_user', 'user', 'bench', f'事件 {i}', None,
+                     priority_level=3, remaining_repeats=rounds)
+        for i in range(rounds)
+    ]
+
+    print(f"資料庫: {db.engine.dialect.name} (RETURNING: {db.engine.dialect.update_returning})，每組 {rounds} 次\n")
+    measure("舊版 mark_reminder_sent", legacy_mark_reminder_sent, ids)
+    measure("新版 mark_reminder_sent", db.mark_reminder_sent, ids)
+    measure("舊版 decrease_remaining_repeats", legacy_decrease_remaining_repeats, ids)
+    measure("新版 decrease_remaining_repeats", db.decrease_remaining_repeats, ids)
+    measure("舊版 update_event_content", legacy_update_event_content, ids, "更新後內容")
+    measure("新版 update_event_content", db.update_event_content, ids, "更新後內容")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# benchmarks/bench_intent_classifier.py (提醒意圖分類器的回歸測試與 AI 呼叫次數比較)
+#
+# 樣本：benchmarks/intent_samples.jsonl，每行 {"text", "source": "user" / "group", "label": 1 (提醒) / 0}。
+# 比較三種做法會送出幾次 Gemini 請求：
+#   舊規則 : 含時間關鍵字或數字就問 AI (原本 handle_message 的判斷)
+#   新流程 : 分類器判斷為提醒、且本地時間解析信心不足時才問 AI
+# 準確率低於門檻 (預設 0.95) 時以非 0 結束，可在調整權重後執行確認沒有退步。
+#
+# 執行：python benchmarks/bench_intent_classifier.py [最低準確率] [-v]
+
+import os
+import sys
+import json
+import time
+from datetime import datetime
+
+import pytz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from features.intent_classifier import classify_intent
+from features.time_parser import parse_time_expression, is_confident
+
+SAMPLES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'intent_samples.jsonl')
+REFERENCE_NOW = pytz.timezone('Asia/Taipei').localize(datetime(2026, 10, 17, 10, 0))
+LATENCY_ROUNDS = 200
+
+# 原本 handle_message 的判斷
+LEGACY_TIME_KEYWORDS = [
+    '明天', '後天', '今天', '下週', '下周', '禮拜', '星期',
+    '點', '分', '早上', '下午', '晚上', '中午', '半',
+    '提醒', '幫我', '記得', '後'
+]
+
+def legacy_is_potential_reminder(text):
+    return len(text) > 1 and (any(k in text for k in LEGACY_TIME_KEYWORDS) or any(ch.isdigit() for ch in text))
+
+def load_samples():
+    with open(SAMPLES_PATH, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def evaluate(samples, verbose):
+    tp = fp = tn = fn = 0
+    legacy_ai_calls = new_ai_calls = 0
+    for sample in samples:
+        text = sample['text']
+        parsed = parse_time_expression(text, REFERENCE_NOW)
+        intent = classify_intent(text, sample['source'], parsed)
+        if legacy_is_potential_reminder(text):
+            legacy_ai_calls += 1
+        if intent.is_reminder and not is_confident(parsed):
+            new_ai_calls += 1
+
+        if intent.is_reminder and sample['label']:
+            tp += 1
+        elif intent.is_reminder:
+            fp += 1
+            print(f"  ❌ 誤判為提醒 [{sample['source']}] {text}  ({intent.score}) {intent.features}")
+        elif sample['label']:
+            fn += 1
+            print(f"  ❌ 漏掉提醒   [{sample['source']}] {text}  ({intent.score}) {intent.features}")
+        else:
+            tn += 1
+        if verbose and intent.is_reminder == bool(sample['label']):
+            print(f"  ✅ [{sample['source']}] {text}  ({intent.score})")
+
+    total = len(samples)
+    accuracy = (tp + tn) / total
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    print(f"\n樣本 {total} 則 (提醒 {tp + fn} 則)")
+    print(f"準確率 {accuracy:.1%}   精確率 {precision:.1%}   召回率 {recall:.1%}   (誤判 {fp}，漏掉 {fn})")
+    print(f"Gemini 請求：舊規則 {legacy_ai_calls} 次 -> 新流程 {new_ai_calls} 次 "
+          f"(省下 {legacy_ai_calls - new_ai_calls} 次)")
+    return accuracy
+
+def measure_latency(samples):
+    timings = []
+    for _ in range(LATENCY_ROUNDS):
+        for sample in samples:
+            start = time.perf_counter()
+            classify_intent(sample['text'], sample['source'])
+            timings.append((time.perf_counter() - start) * 1_000_000)
+    timings.sort()
+    print(f"分類耗時 ({len(timings)} 次)：平均 {sum(timings) / len(timings):.1f} µs，"
+          f"p95 {timings[int(len(timings) * 0.95)]:.1f} µs")
+
+def main():
+    args = [arg for arg in sys.argv[1:] if arg != '-v']
+    min_accuracy = float(args[0]) if args else 0.95
+    samples = load_samples()
+    accuracy = evaluate(samples, verbose='-v' in sys.argv)
+    measure_latency(samples)
+    sys.exit(0 if accuracy >= min_accuracy else 1)
+
+if __name__ == "__main__":
+    main()
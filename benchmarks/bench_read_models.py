@@ -0,0 +1,73 @@
+# benchmarks/bench_read_models.py (ORM 物件 vs. 唯讀資料列的記憶體與耗時比較)
+#
+# 模擬清單類的查詢 (記憶清單、地點清單、提醒清單)，比較：
+#   舊版：查出完整的 ORM 物件
+#   新版：db.py 回傳的 namedtuple 資料列 (只投影需要的欄位)
+#
+# 執行：python benchmarks/bench_read_models.py [每位使用者的筆數]
+
+import os
+import sys
+import time
+import tracemalloc
+import tempfile
+from datetime import datetime, timedelta
+
+_tmp_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = os.environ.get('BENCH_DATABASE_URL', f"sqlite:///{_tmp_dir}/bench.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+from db import Event, Memory, Location, get_db
+
+USER_ID = 'bench_user'
+
+def legacy_query(model, *criteria):
+    session = next(get_db())
+    try:
+        return session.query(model).filter(*criteria).all()
+    finally:
+        session.close()
+
+def measure(label, func, rounds):
+    # 耗時：重複查詢 (每次先清快取，量的是資料庫 + 物件建立的成本)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        db._collection_cache.clear()
+        func()
+    elapsed = (time.perf_counter() - start) * 1000 / rounds
+
+    # 記憶體：保留一次查詢結果所佔用的空間
+    db._collection_cache.clear()
+    tracemalloc.start()
+    result = func()
+    size, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<36} {len(result):>6} 筆   {elapsed:>8.2f} ms/次   結果佔用 {size / 1024:>9.1f} KiB")
+    return result
+
+def seed(count):
+    now = datetime.now()
+    long_text = "很長的記憶內容，" * 40
+    for i in range(count):
+        db.save_memory(USER_ID, f"關鍵字{i}", f"{long_text}{i}")
+        db.add_location(USER_ID, f"地點{i}", f"台北市第 {i} 號", 25.0 + i / 1000, 121.5)
+        event_id = db.add_event(USER_ID, USER_ID, 'user', 'bench', f"提醒事項 {i}", now + timedelta(minutes=i))
+        db.update_reminder_time(event_id, now + timedelta(minutes=i))
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    rounds = 20
+    db.init_db()
+    seed(count)
+    print(f"資料庫: {db.engine.dialect.name}，每位使用者 {count} 筆，耗時取 {rounds} 次平均\n")
+
+    measure("舊版 記憶清單 (Memory ORM)", lambda: legacy_query(Memory, Memory.user_id == USER_ID), rounds)
+    measure("新版 記憶清單 (MemoryKeywordRow)", lambda: db.get_all_memories(USER_ID), rounds)
+    measure("舊版 地點清單 (Location ORM)", lambda: legacy_query(Location, Location.user_id == USER_ID), rounds)
+    measure("新版 地點清單 (LocationNameRow)", lambda: db.get_all_locations_by_user(USER_ID), rounds)
+    measure("舊版 提醒清單 (Event ORM)", lambda: legacy_query(Event, Event.creator_user_id == USER_ID), rounds)
+    measure("新版 提醒清單 (EventRow)", lambda: db.get_all_events_by_user(USER_ID), rounds)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# benchmarks/bench_time_parser.py (本地中文時間解析的準確率與耗時)
+#
+# 語料：benchmarks/time_parser_corpus.jsonl，每行 {"text", "event_datetime", "event_content"}，
+# 標註的時間以 REFERENCE_NOW (2026-10-17 週六 10:00，台北時間) 為「現在」。
+# event_datetime 為 null 的句子不是明確的提醒 (或說法有歧義)，本地解析不應給出有信心的結果。
+#
+# 統計：
+#   直接採用 : 信心 >= 門檻、不必再問 Gemini 的比例
+#   正確     : 直接採用的結果中，時間與內容都與標註相同的比例
+#   誤用     : 直接採用但時間錯誤 (或不該有結果) 的筆數，這些句子會得到錯誤的提醒
+#
+# 執行：python benchmarks/bench_time_parser.py [門檻] [-v]
+
+import os
+import sys
+import json
+import time
+from datetime import datetime
+
+import pytz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from features.time_parser import parse_time_expression, is_confident, LOCAL_PARSER_MIN_CONFIDENCE
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'time_parser_corpus.jsonl')
+REFERENCE_NOW = pytz.timezone('Asia/Taipei').localize(datetime(2026, 10, 17, 10, 0))
+LATENCY_ROUNDS = 200
+
+def load_corpus():
+    with open(CORPUS_PATH, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def evaluate(corpus, threshold, verbose):
+    confident = correct = content_wrong = misused = 0
+    for item in corpus:
+        result = parse_time_expression(item['text'], REFERENCE_NOW)
+        if not is_confident(result, threshold):
+            if verbose:
+                print(f"  交給 AI   {item['text']}  ({result['confidence'] if result else '無結果'})")
+            continue
+        confident += 1
+        if result['event_datetime'] != item['event_datetime']:
+            misused += 1
+            print(f"  ❌ 誤用    {item['text']}  -> {result['event_datetime']} (標註 {item['event_datetime']})")
+        elif result['event_content'] != item['event_content']:
+            content_wrong += 1
+            print(f"  ⚠️ 內容不同 {item['text']}  -> {result['event_content']!r} (標註 {item['event_content']!r})")
+        else:
+            correct += 1
+            if verbose:
+                print(f"  ✅ 正確    {item['text']}")
+
+    expected = sum(1 for item in corpus if item['event_datetime'])
+    print(f"\n語料 {len(corpus)} 句 (其中 {expected} 句是明確的提醒)，信心門檻 {threshold}")
+    print(f"直接採用     {confident:>4} 句   {confident / len(corpus):>6.1%}")
+    if confident:
+        print(f"  正確       {correct:>4} 句   {correct / confident:>6.1%}")
+        print(f"  內容不同   {content_wrong:>4} 句   {content_wrong / confident:>6.1%}")
+        print(f"  誤用       {misused:>4} 句   {misused / confident:>6.1%}")
+    print(f"交給 Gemini  {len(corpus) - confident:>4} 句")
+    return misused
+
+def measure_latency(corpus):
+    timings = []
+    for _ in range(LATENCY_ROUNDS):
+        for item in corpus:
+            start = time.perf_counter()
+            parse_time_expression(item['text'], REFERENCE_NOW)
+            timings.append((time.perf_counter() - start) * 1_000_000)
+    timings.sort()
+    avg = sum(timings) / len(timings)
+    p50 = timings[len(timings) // 2]
+    p95 = timings[int(len(timings) * 0.95)]
+    print(f"\n耗時 ({len(timings)} 次)：平均 {avg:.1f} µs，p50 {p50:.1f} µs，p95 {p95:.1f} µs，最大 {timings[-1]:.1f} µs")
+
+def main():
+    args = [arg for arg in sys.argv[1:] if arg != '-v']
+    threshold = float(args[0]) if args else LOCAL_PARSER_MIN_CONFIDENCE
+    corpus = load_corpus()
+    misused = evaluate(corpus, threshold, verbose='-v' in sys.argv)
+    measure_latency(corpus)
+    sys.exit(1 if misused else 0)
+
+if __name__ == "__main__":
+    main()
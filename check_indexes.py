@@ -0,0 +1,66 @@
+# check_indexes.py (以 EXPLAIN 確認熱門查詢都有用到索引)
+#
+# 執行：python check_indexes.py
+# 會對目前 DATABASE_URL 指向的資料庫 (SQLite 或 Postgres) 執行 EXPLAIN，
+# 並檢查每個查詢計畫中是否出現預期的索引名稱。
+
+import sys
+from datetime import datetime
+from sqlalchemy import select
+
+from db import engine, init_db, Event, Memory, Location, UserCard
+
+# (說明, 查詢, 預期使用的索引)
+HOT_QUERIES = [
+    ("get_all_events_by_user",
+     select(Event).where(Event.creator_user_id == 'U0').order_by(Event.event_datetime.asc()),
+     'ix_events_creator_datetime'),
+    ("restore_jobs (未發送的一次性提醒)",
+     select(Event).where(Event.reminder_sent == 0, Event.is_recurring == 0, Event.reminder_time > datetime(2000, 1, 1)),
+     'ix_events_pending'),
+    ("依 target_id 查詢提醒",
+     select(Event).where(Event.target_id == 'C0'),
+     'ix_events_target_id'),
+    ("save_memory / delete_memory",
+     select(Memory).where(Memory.user_id == 'U0', Memory.keyword == 'wifi'),
+     'uq_memories_user_keyword'),
+    ("get_location_by_name",
+     select(Location).where(Location.user_id == 'U0', Location.name == '公司'),
+     'uq_locations_user_name'),
+    ("add_user_card / delete_user_card",
+     select(UserCard).where(UserCard.user_id == 'U0', UserCard.card_name == 'CUBE'),
+     'uq_user_cards_user_card'),
+]
+
+def explain(conn, statement):
+    compiled = statement.compile(dialect=engine.dialect)
+    if engine.dialect.name == 'sqlite':
+        sql = f"EXPLAIN QUERY PLAN {compiled}"
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        sql = f"EXPLAIN {compiled}"
+        params = compiled.params
+    rows = conn.exec_driver_sql(sql, params).fetchall()
+    return "\n".join(" ".join(str(col) for col in row) for row in rows)
+
+def main():
+    init_db()
+    failures = 0
+    with engine.connect() as conn:
+        if engine.dialect.name == 'postgresql':
+            # 資料量小的時候規劃器會偏好全表掃描，這裡只想確認索引「能被用上」
+            conn.exec_driver_sql("SET enable_seqscan = off")
+
+        for label, statement, index_name in HOT_QUERIES:
+            plan = explain(conn, statement)
+            ok = index_name in plan
+            failures += 0 if ok else 1
+            print(f"{'✅' if ok else '❌'} {label} -> {index_name}")
+            if not ok:
+                print("   " + plan.replace("\n", "\n   "))
+
+    print(f"\n{len(HOT_QUERIES) - failures}/{len(HOT_QUERIES)} 個熱門查詢使用了預期的索引。")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,8 +2,12 @@
 
 import os
 import time
+import threading
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
 from datetime import datetime
-from sqlalchemy import create_engine, func, Column, Integer, String, Text, TIMESTAMP, DateTime, Float
+from sqlalchemy import create_engine, inspect, func, update, case, or_, and_, text, Column, Integer, String, Text, TIMESTAMP, DateTime, Float, Index
+from sqlalchemy.exc import IntegrityError, ProgrammingError, OperationalError
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 # --- 資料庫設定區塊 START ---
@@ -29,7 +33,14 @@ if _url and _url.startswith("postgres://"):
 # 4. 【關鍵修改】將最終結果賦值給 DATABASE_URL，讓 app.py 可以 import
 DATABASE_URL = _url
 
-# 5. 建立資料庫引擎
+# 5. 連線池大小 (每個 worker 行程)：連線只在短暫的交易期間被佔用 (Gemini / LINE 呼叫都在 commit 之後)，
+#    同時持有連線的執行緒遠少於執行緒總數，拿不到連線的等 DB_POOL_TIMEOUT 秒；
+#    託管的 Postgres 連線數有限，多個 worker 時總數為 WEB_CONCURRENCY * (pool_size + max_overflow)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 5))
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+
+# 6. 建立資料庫引擎
 try:
     if "sqlite" in DATABASE_URL:
         engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
@@ -39,8 +50,9 @@ try:
             DATABASE_URL,
             pool_pre_ping=True,   # 每次連線前先檢查，死了就重連 (解決 SSL closed 錯誤)
             pool_recycle=300,     # 每 300 秒(5分鐘) 自動回收連線，防止被雲端強制切斷
-            pool_size=5,
-            max_overflow=10
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT
         )
 except Exception as e:
     print(f"❌ 資料庫設定錯誤: {e}")
@@ -71,10 +83,20 @@ class Event(Base):
     created_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), nullable=False)
     is_recurring = Column(Integer, default=0, nullable=False)
     recurrence_rule = Column(String, nullable=True)
+    # 正規化後的週期規則 (見 features/recurrence.py)，讀取端不必再解析使用者輸入的原始字串
+    recurrence_spec = Column(String, nullable=True)
     next_run_time = Column(DateTime(timezone=True), nullable=True, index=True)
+    # 派送器認領後的租約到期時間：提醒寫入 outbox 後清除，行程在發送前中斷時過期即可再被認領
+    claimed_until = Column(DateTime(timezone=True), nullable=True)
     priority_level = Column(Integer, default=0)
     remaining_repeats = Column(Integer, default=0)
 
+    __table_args__ = (
+        Index('ix_events_creator_datetime', 'creator_user_id', 'event_datetime'),  # 提醒清單
+        Index('ix_events_pending', 'reminder_sent', 'is_recurring', 'reminder_time'),  # 排程修復
+        Index('ix_events_target_id', 'target_id'),
+    )
+
     def __repr__(self):
         return f"<Event(id={self.id}, content='{self.event_content}')>"
 
@@ -88,6 +110,8 @@ class Location(Base):
     longitude = Column(Float, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (Index('uq_locations_user_name', 'user_id', 'name', unique=True),)
+
     def __repr__(self):
         return f"<Location(name='{self.name}', user_id='{self.user_id}')>"
         
@@ -98,7 +122,9 @@ class Memory(Base):
     keyword = Column(String, nullable=False)
     content = Column(Text, nullable=False)
     created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
-    
+
+    __table_args__ = (Index('uq_memories_user_keyword', 'user_id', 'keyword', unique=True),)
+
     def __repr__(self):
         return f"<Memory(keyword='{self.keyword}', user_id='{self.user_id}')>"
         
@@ -109,9 +135,133 @@ class UserCard(Base):
     card_name = Column(String, nullable=False)
     created_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
 
+    __table_args__ = (Index('uq_user_cards_user_card', 'user_id', 'card_name', unique=True),)
+
     def __repr__(self):
         return f"<UserCard(name='{self.card_name}', user_id='{self.user_id}')>"
 
+class RecurringSlot(Base):
+    """
+    週期提醒的時段索引：slot = 星期 (MON=0) * 1440 + 當天第幾分鐘。
+    排程器只需為每個有提醒的時段註冊一個 job，觸發時再查出該時段的 event_id。
+    """
+    __tablename__ = 'recurring_slots'
+    id = Column(Integer, primary_key=True)
+    slot = Column(Integer, nullable=False)
+    event_id = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index('uq_recurring_slots_slot_event', 'slot', 'event_id', unique=True),
+        Index('ix_recurring_slots_event_id', 'event_id'),
+    )
+
+class OutboxMessage(Base):
+    """待送出的 LINE 推播 (payload 為 JSON 格式的訊息陣列)"""
+    __tablename__ = 'outbox'
+    id = Column(Integer, primary_key=True)
+    event_id = Column(Integer, nullable=True)
+    target_id = Column(String, nullable=False)
+    payload = Column(Text, nullable=False)
+    retry_key = Column(String(36), nullable=False)   # LINE 的 X-Line-Retry-Key，重送時沿用同一個
+    multicast_key = Column(String(36), nullable=True)  # multicast 結果不明時的 retry key：同一批成員以同一個 key 重送
+    status = Column(String, nullable=False, default='pending')  # pending / sent / dead
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), nullable=False)
+    sent_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index('ix_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+        Index('uq_outbox_retry_key', 'retry_key', unique=True),
+    )
+
+class ProfileName(Base):
+    """LINE 顯示名稱的持久化快取 (container_id：群組 / 聊天室 ID，個人則為 user_id)"""
+    __tablename__ = 'profile_names'
+    id = Column(Integer, primary_key=True)
+    source_type = Column(String, nullable=False)
+    container_id = Column(String, nullable=False)
+    user_id = Column(String, nullable=False)
+    display_name = Column(Text, nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (Index('uq_profile_names_key', 'source_type', 'container_id', 'user_id', unique=True),)
+
+class WebhookInboxEvent(Base):
+    """收到但尚未處理的 webhook 事件 (一筆一個事件)；webhook_event_id 唯一，LINE 重送的事件不會再寫入"""
+    __tablename__ = 'webhook_inbox'
+    id = Column(Integer, primary_key=True)
+    webhook_event_id = Column(String, nullable=False)
+    payload = Column(Text, nullable=False)  # 只含這個事件的 webhook body (JSON)
+    # 保序用的 key (來源的 userId，沒有時為 groupId / roomId)：同一個 key 的事件依 id 順序一個接一個處理
+    source_key = Column(String, nullable=True)
+    status = Column(String, nullable=False, default='pending')  # pending / done / failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=True)
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    processed_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index('uq_webhook_inbox_event_id', 'webhook_event_id', unique=True),
+        Index('ix_webhook_inbox_status_next_attempt', 'status', 'next_attempt_at'),
+        Index('ix_webhook_inbox_source_status', 'source_key', 'status', 'id'),
+    )
+
+class SchedulerHeartbeat(Base):
+    """排程器定期寫入的心跳時間，重新啟動時用來判斷停機期間錯過了哪些提醒"""
+    __tablename__ = 'scheduler_heartbeats'
+    name = Column(String, primary_key=True)
+    beat_at = Column(DateTime(timezone=True), nullable=False)
+
+class ConversationState(Base):
+    """使用者進行中的多步驟操作 (見 features/state_store.py)；expires_at 之後視為已放棄"""
+    __tablename__ = 'conversation_states'
+    user_id = Column(String, primary_key=True)
+    action = Column(String, nullable=False)
+    payload = Column(Text, nullable=False)  # 狀態 dataclass 的 JSON
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+
+# ---------------------------------
+# 唯讀資料列 (Read Models)
+# ---------------------------------
+# 查詢函式回傳不可變的 namedtuple (無 __dict__、不追蹤狀態)，
+# 只投影呼叫端實際用到的欄位，Session 關閉後也不會觸發 lazy load。
+
+EventRow = namedtuple('EventRow', [
+    'id', 'creator_user_id', 'target_id', 'target_type', 'target_display_name', 'event_content',
+    'event_datetime', 'reminder_time', 'reminder_sent', 'is_recurring', 'recurrence_rule', 'recurrence_spec',
+    'next_run_time', 'priority_level', 'remaining_repeats'
+])
+# 提醒管理面板只需要顯示與分頁游標用的欄位
+EventListRow = namedtuple('EventListRow', [
+    'id', 'event_content', 'event_datetime', 'reminder_time', 'is_recurring', 'recurrence_rule', 'recurrence_spec',
+    'priority_level'
+])
+# 排程對帳只需要判斷 job 觸發時間的欄位
+ScheduleRow = namedtuple('ScheduleRow', ['id', 'reminder_time', 'next_run_time'])
+LocationRow = namedtuple('LocationRow', ['id', 'name', 'address', 'latitude', 'longitude'])
+LocationNameRow = namedtuple('LocationNameRow', ['id', 'name'])
+MemoryRow = namedtuple('MemoryRow', ['id', 'keyword', 'content'])
+MemoryKeywordRow = namedtuple('MemoryKeywordRow', ['id', 'keyword'])
+ClaimedEvent = namedtuple('ClaimedEvent', ['id', 'fire_time', 'is_recurring', 'target_type'])
+OutboxRow = namedtuple('OutboxRow', ['id', 'event_id', 'target_id', 'payload', 'retry_key', 'attempts', 'multicast_key'])
+InboxRow = namedtuple('InboxRow', ['id', 'webhook_event_id', 'source_key', 'payload', 'attempts'])
+# 停機期間錯過的提醒 (補發時依 target 合併)
+MissedEvent = namedtuple('MissedEvent', [
+    'id', 'target_id', 'event_content', 'next_run_time', 'is_recurring', 'recurrence_rule', 'recurrence_spec'
+])
+
+def _columns(model, row_type):
+    return [getattr(model, field) for field in row_type._fields]
+
+def _to_row(row_type, row):
+    return row_type._make(row) if row is not None else None
+
+def _to_rows(row_type, rows):
+    return [row_type._make(row) for row in rows]
 
 # ---------------------------------
 # 核心資料庫函式
@@ -122,14 +272,128 @@ def init_db():
         Base.metadata.create_all(bind=engine)
         print("Database tables checked/created.")
     safe_db_operation(_init)
+    ensure_columns()
+    ensure_indexes()
+    ensure_memory_search_index()
+
+def ensure_columns():
+    """
+    補上模型新增的可為 NULL 欄位 (create_all 不會替已存在的資料表加欄位)。
+    可重複執行；SQLite 與 Postgres 皆適用。
+    """
+    added = []
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=engine.dialect)
+            with engine.begin() as conn:
+                conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}")
+            added.append(f"{table.name}.{column.name}")
+    if added:
+        print(f"Database columns added: {added}")
+    return added
+
+def ensure_indexes():
+    """
+    補建模型上宣告的索引 (create_all 不會替已存在的資料表加索引)。
+    可重複執行；SQLite 與 Postgres 皆適用。
+    若舊資料有重複值導致唯一索引建立失敗，退而建立同名的一般索引。
+    """
+    created = []
+    for table in Base.metadata.sorted_tables:
+        for index in sorted(table.indexes, key=lambda ix: ix.name):
+            try:
+                index.create(bind=engine, checkfirst=True)
+                created.append(index.name)
+            except (IntegrityError, ProgrammingError) as e:
+                if not index.unique:
+                    raise
+                print(f"⚠️ 唯一索引 {index.name} 建立失敗 (可能有重複資料)，改建一般索引: {e}")
+                columns = ", ".join(column.name for column in index.columns)
+                with engine.begin() as conn:
+                    conn.exec_driver_sql(f"CREATE INDEX IF NOT EXISTS {index.name} ON {table.name} ({columns})")
+                created.append(index.name)
+    print(f"Database indexes checked/created ({len(created)}).")
+    return created
+
+# 每個執行緒 (= 每個 webhook 請求或排程任務) 目前共用的 Session
+_uow = threading.local()
+
+def _current_session():
+    return getattr(_uow, 'session', None)
+
+@contextmanager
+def unit_of_work():
+    """
+    請求範圍的 Unit of Work：區塊內所有 db.py 函式共用同一個 Session (同一條連線)，
+    只在離開區塊時 commit 一次；發生例外則整批 rollback。巢狀使用時沿用外層的 Session。
+    區塊內只放資料庫操作：連線會一直被佔用到 commit，對外的 HTTP 呼叫 (LINE、Gemini) 請在 commit 之後進行，
+    或以 after_commit() 登記 (rollback 時不會執行)。
+    """
+    if _current_session() is not None:
+        yield _current_session()
+        return
+
+    db = SessionLocal()
+    _uow.session = db
+    _uow.dirty = False
+    _uow.invalidations = []
+    _uow.after_commit = []
+    try:
+        yield db
+        db.commit()
+    except Exception:
+        db.rollback()
+        _uow.after_commit = []
+        raise
+    finally:
+        _uow.session = None
+        db.close()
+        # 交易結束後再失效一次，避免其他執行緒在 commit 前把舊資料放回快取
+        for cache, key in _uow.invalidations:
+            cache.pop(key)
+        _uow.invalidations = []
+        callbacks, _uow.after_commit = _uow.after_commit, []
+    for func, args, kwargs in callbacks:
+        func(*args, **kwargs)
+
+def after_commit(func, *args, **kwargs):
+    """在目前的 Unit of Work commit (並釋放連線) 之後才執行；不在 Unit of Work 中則立即執行"""
+    if _current_session() is None:
+        return func(*args, **kwargs)
+    _uow.after_commit.append((func, args, kwargs))
 
 def get_db():
+    shared = _current_session()
+    if shared is not None:
+        yield shared
+        return
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
 
+def _commit(db):
+    """在 Unit of Work 中只 flush，交由區塊結束時統一 commit"""
+    if db is _current_session():
+        db.flush()
+        _uow.dirty = True
+    else:
+        db.commit()
+        for cache, key in db.info.pop('invalidations', []):
+            cache.pop(key)
+
+def _close(db):
+    """Unit of Work 的 Session 由區塊本身負責關閉"""
+    if db is not _current_session():
+        db.close()
+
 def cleanup_db():
     try:
         engine.dispose()
@@ -138,6 +402,9 @@ def cleanup_db():
         print(f"Error cleaning up database connections: {e}")
 
 def safe_db_operation(operation, max_retries=3):
+    # 共用 Session 出錯後必須整批 rollback，不能在同一個交易內重試
+    if _current_session() is not None:
+        return operation()
     for attempt in range(max_retries):
         try:
             return operation()
@@ -148,6 +415,122 @@ def safe_db_operation(operation, max_retries=3):
             time.sleep(1)
     return None
 
+# ---------------------------------
+# 讀取快取 (LRU + TTL)
+# ---------------------------------
+
+class TTLCache:
+    """
+    執行緒安全的 LRU + TTL 快取，並記錄命中 / 未命中次數。
+    每次 pop 都會推進失效世代：讀取資料庫前先取 generation()，回填時帶回去，
+    讀取期間該 key 被失效過就丟棄這筆回填，避免把 commit 前讀到的舊資料放回快取。
+    """
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale_sets = 0
+        self._data = OrderedDict()
+        self._generation = 0
+        self._invalidated = OrderedDict()  # key -> 最後一次失效的世代 (最多 maxsize 筆)
+        self._invalidated_floor = 0        # 被擠出 _invalidated 的 key 最後失效的世代上限
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires_at = item
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def generation(self):
+        with self._lock:
+            return self._generation
+
+    def set(self, key, value, ttl=None, generation=None):
+        """generation 為讀取前取得的世代；之後該 key 被失效過就不寫入並回傳 False"""
+        with self._lock:
+            if generation is not None and self._invalidated.get(key, self._invalidated_floor) > generation:
+                self.stale_sets += 1
+                return False
+            self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+            return True
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+            self._generation += 1
+            self._invalidated[key] = self._generation
+            self._invalidated.move_to_end(key)
+            while len(self._invalidated) > self.maxsize:
+                _, self._invalidated_floor = self._invalidated.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._generation += 1
+            self._invalidated.clear()
+            self._invalidated_floor = self._generation
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data), "maxsize": self.maxsize, "ttl": self.ttl,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "stale_sets": self.stale_sets,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
+
+# 多個 worker 之間不會互相通知失效，TTL 是跨行程資料過期的上限
+DB_CACHE_MAX_ENTRIES = int(os.environ.get('DB_CACHE_MAX_ENTRIES', 2048))
+DB_CACHE_TTL_SECONDS = int(os.environ.get('DB_CACHE_TTL_SECONDS', 60))
+
+_event_cache = TTLCache(maxsize=DB_CACHE_MAX_ENTRIES, ttl=DB_CACHE_TTL_SECONDS)       # event_id -> Event
+_collection_cache = TTLCache(maxsize=DB_CACHE_MAX_ENTRIES, ttl=DB_CACHE_TTL_SECONDS)  # (集合名稱, user_id) -> list
+
+def cache_stats():
+    return {"events": _event_cache.stats(), "collections": _collection_cache.stats()}
+
+def _invalidate(cache, key, db=None):
+    """
+    立即失效，並在交易 commit 之後再失效一次 (其他執行緒可能在 commit 前把舊資料讀回快取)。
+    在 commit 之前呼叫時要傳入 db，由 _commit 負責 commit 後的那一次。
+    """
+    cache.pop(key)
+    if _current_session() is not None:
+        _uow.invalidations.append((cache, key))
+    elif db is not None:
+        db.info.setdefault('invalidations', []).append((cache, key))
+
+def _invalidate_event(event_id, db=None):
+    _invalidate(_event_cache, event_id, db)
+
+def _invalidate_collection(name, user_id):
+    _invalidate(_collection_cache, (name, user_id))
+
+def _cacheable(db):
+    """Unit of Work 已有尚未 commit 的寫入時，不把讀到的資料放進共用快取"""
+    return db is not _current_session() or not _uow.dirty
+
+def _cache_set(db, cache, key, value, generation):
+    # 快取的都是不可變的資料列，可以安全地在執行緒之間共用；generation 是查詢前取得的失效世代
+    if _cacheable(db):
+        cache.set(key, value, generation=generation)
+
 # ---------------------------------
 # 地點功能相關的資料庫函式
 # ---------------------------------
@@ -160,28 +543,36 @@ def add_location(user_id, name, address, latitude, longitude):
             if existing_location: return f"名稱重複: 您已記錄過名為 '{name}' 的地點。"
             new_loc = Location(user_id=user_id, name=name, address=address, latitude=latitude, longitude=longitude)
             db.add(new_loc)
-            db.commit()
+            _commit(db)
+            _invalidate_collection('locations', user_id)
             return "成功"
         finally:
-            db.close()
+            _close(db)
     return safe_db_operation(_add)
 
 def get_location_by_name(user_id, name):
     def _get():
         db = next(get_db())
         try:
-            return db.query(Location).filter_by(user_id=user_id, name=name).first()
+            row = db.query(*_columns(Location, LocationRow)).filter_by(user_id=user_id, name=name).first()
+            return _to_row(LocationRow, row)
         finally:
-            db.close()
+            _close(db)
     return safe_db_operation(_get)
 
 def get_all_locations_by_user(user_id):
+    cached = _collection_cache.get(('locations', user_id))
+    if cached is not None:
+        return cached
     def _get_all():
+        generation = _collection_cache.generation()
         db = next(get_db())
         try:
-            return db.query(Location).filter_by(user_id=user_id).order_by(Location.name).all()
+            locations = _to_rows(LocationNameRow, db.query(*_columns(Location, LocationNameRow)).filter_by(user_id=user_id).order_by(Location.name))
+            _cache_set(db, _collection_cache, ('locations', user_id), locations, generation)
+            return locations
         finally:
-            db.close()
+            _close(db)
     return safe_db_operation(_get_all)
     
 def delete_location_by_name(user_id, name):
@@ -191,110 +582,447 @@ def delete_location_by_name(user_id, name):
             location_to_delete = db.query(Location).filter_by(user_id=user_id, name=name).first()
             if location_to_delete:
                 db.delete(location_to_delete)
-                db.commit()
+                _commit(db)
+                _invalidate_collection('locations', user_id)
                 return True
             return False
         finally:
-            db.close()
+            _close(db)
     return safe_db_operation(_delete)
 
 # ---------------------------------
 # 提醒功能相關的資料庫函式
 # ---------------------------------
 
-def add_event(creator_user_id, target_id, target_type, display_name, content, event_datetime, is_recurring=0, recurrence_rule=None, next_run_time=None, priority_level=0, remaining_repeats=0):
+def add_event(creator_user_id, target_id, target_type, display_name, content, event_datetime, is_recurring=0, recurrence_rule=None, next_run_time=None, priority_level=0, remaining_repeats=0, slots=None, recurrence_spec=None):
+    """
+    slots：週期提醒所屬的時段 (見 RecurringSlot)，與事件一起寫入
+    recurrence_spec：正規化後的週期規則 (見 features/recurrence.normalize_rule)
+    """
     def _add_event():
         db = next(get_db())
         try:
             new_event = Event(
                 creator_user_id=creator_user_id, target_id=target_id, target_type=target_type,
                 target_display_name=display_name, event_content=content, event_datetime=event_datetime,
-                is_recurring=is_recurring, recurrence_rule=recurrence_rule, next_run_time=next_run_time,
-                priority_level=priority_level, remaining_repeats=remaining_repeats
+                is_recurring=is_recurring, recurrence_rule=recurrence_rule, recurrence_spec=recurrence_spec,
+                next_run_time=next_run_time, priority_level=priority_level, remaining_repeats=remaining_repeats
             )
             db.add(new_event)
-            db.commit()
+            if slots:
+                db.flush()
+                db.add_all(RecurringSlot(slot=slot, event_id=new_event.id) for slot in set(slots))
+            _commit(db)
             db.refresh(new_event)
             return new_event.id
         finally:
-            db.close()
+            _close(db)
     return safe_db_operation(_add_event)
 
-def get_event(event_id):
+def get_event(event_id, use_cache=True):
+    """
+    use_cache=False 直接讀資料庫：排程器 / 派送器依事件內容決定是否發送，
+    不能用到其他 worker 修改前快取的舊資料 (快取只在行程內失效)。
+    """
+    if use_cache:
+        cached = _event_cache.get(event_id)
+        if cached is not None:
+            return cached
     def _get():
+        generation = _event_cache.generation()
         db = next(get_db())
         try:
-            return db.query(Event).filter(Event.id == event_id).first()
+            event = _to_row(EventRow, db.query(*_columns(Event, EventRow)).filter(Event.id == event_id).first())
+            if event:
+                _cache_set(db, _event_cache, event_id, event, generation)
+            return event
         finally:
-            db.close()
+            _close(db)
     return safe_db_operation(_get)
 
+def _update_event_returning(db, event_id, values, *conditions, returning=(Event.id,)):
+    """
+    單一條件式 UPDATE ... WHERE ... RETURNING，一次往返完成「檢查 + 修改」。
+    不支援 RETURNING 的 SQLite (< 3.35) 改為 UPDATE 後在同一交易內補查。
+    找不到符合條件的資料時回傳 None。
+    """
+    _invalidate_event(event_id, db)
+    stmt = update(Event).where(Event.id == event_id, *conditions).values(values) \
+        .execution_options(synchronize_session=False)
+    if engine.dialect.update_returning:
+        return db.execute(stmt.returning(*returning)).first()
+
+    result = db.execute(stmt)
+    if result.rowcount == 0:
+        return None
+    return db.query(*returning).filter(Event.id == event_id).first()
+
 def update_reminder_time(event_id, reminder_dt):
     def _update():
         db = next(get_db())
         try:
-            event = db.query(Event).filter(Event.id == event_id).first()
-            if event:
-                event.reminder_time = reminder_dt
-                db.commit()
-                return True
-            return False
+            row = _update_event_returning(db, event_id, {Event.reminder_time: reminder_dt})
+            _commit(db)
+            return row is not None
         finally:
-            db.close()
+            _close(db)
     return safe_db_operation(_update)
 
 def mark_reminder_sent(event_id):
     def _mark():
         db = next(get_db())
         try:
-            event = db.query(Event).filter(Event.id == event_id).first()
-            if event:
-                event.reminder_sent = 1
-                db.commit()
-                return True
-            return False
+            # 已完成，不再觸發
+            row = _update_event_returning(
+                db, event_id, {Event.reminder_sent: 1, Event.next_run_time: None, Event.claimed_until: None})
+            _commit(db)
+            return row is not None
         finally:
-            db.close()
+            _close(db)
     return safe_db_operation(_mark)
 
 def reset_reminder_sent_status(event_id):
     def _reset():
         db = next(get_db())
         try:
-            event = db.query(Event).filter(Event.id == event_id).first()
-            if event:
-                event.reminder_sent = 0
-                db.commit()
-                return True
-            return False
+            row = _update_event_returning(db, event_id, {Event.reminder_sent: 0})
+            _commit(db)
+            return row is not None
         finally:
-            db.close()
+            _close(db)
     return safe_db_operation(_reset)
 
 def decrease_remaining_repeats(event_id):
     def _decrease():
         db = next(get_db())
         try:
-            event = db.query(Event).filter(Event.id == event_id).first()
-            if event and event.remaining_repeats > 0:
-                event.remaining_repeats -= 1
-                db.commit()
-                return event.remaining_repeats
-            return 0
+            # 條件與遞減寫在同一個 UPDATE，與「確認收到」同時發生時也不會遺失更新
+            row = _update_event_returning(
+                db, event_id, {Event.remaining_repeats: Event.remaining_repeats - 1},
+                Event.remaining_repeats > 0,
+                returning=(Event.remaining_repeats,)
+            )
+            _commit(db)
+            return row[0] if row else 0
         finally:
-            db.close()
+            _close(db)
     return safe_db_operation(_decrease)
 
+def set_next_run_time(event_id, run_time):
+    """更新事件的下一次觸發時間 (None 代表不再排程)；新的觸發時間可以立即被認領"""
+    def _update():
+        db = next(get_db())
+        try:
+            row = _update_event_returning(db, event_id, {Event.next_run_time: run_time, Event.claimed_until: None})
+            _commit(db)
+            return row is not None
+        finally:
+            _close(db)
+    return safe_db_operation(_update)
+
+def claim_due_events(now, until, lease_until, limit=100, advance=None):
+    """
+    認領 next_run_time <= until 的事件 (依觸發時間排序，最多 limit 筆)，租約仍有效的略過。
+    advance(event) 有結果時 next_run_time 直接推進 (週期提醒)；沒有結果時保留 next_run_time，
+    改以 claimed_until = lease_until 標記已認領，等 release_event_claim / mark_reminder_sent 清除。
+    行程在認領後、寫入 outbox 前中斷時，租約過期後事件會再被認領 (也看得到它的停機補發)。
+    Postgres 使用 FOR UPDATE SKIP LOCKED，多個行程可同時輪詢。
+    回傳 [ClaimedEvent(id, fire_time, is_recurring, target_type), ...]
+    """
+    def _claim():
+        db = next(get_db())
+        try:
+            query = db.query(Event).filter(
+                Event.reminder_sent == 0,
+                Event.next_run_time.isnot(None),
+                Event.next_run_time <= until,
+                or_(Event.claimed_until.is_(None), Event.claimed_until <= now)
+            ).order_by(Event.next_run_time.asc()).limit(limit)
+            if engine.dialect.name == 'postgresql':
+                query = query.with_for_update(skip_locked=True)
+
+            claimed = []
+            for event in query.all():
+                claimed.append(ClaimedEvent(event.id, event.next_run_time, event.is_recurring, event.target_type))
+                next_time = advance(event) if advance else None
+                if next_time is not None:
+                    event.next_run_time = next_time
+                    event.claimed_until = None
+                else:
+                    event.claimed_until = lease_until
+                _invalidate_event(event.id, db)
+            _commit(db)
+            return claimed
+        finally:
+            _close(db)
+    return safe_db_operation(_claim)
+
+def release_event_claim(event_id):
+    """提醒已寫入 outbox：清除派送器的認領租約"""
+    def _release():
+        db = next(get_db())
+        try:
+            row = _update_event_returning(db, event_id, {Event.claimed_until: None})
+            _commit(db)
+            return row is not None
+        finally:
+            _close(db)
+    return safe_db_operation(_release)
+
+def backfill_next_run_times(compute_recurring_next):
+    """補齊舊資料的 next_run_time (一次性提醒沿用 reminder_time，週期提醒由規則計算)"""
+    def _backfill():
+        db = next(get_db())
+        try:
+            one_shot = db.query(Event).filter(
+                Event.is_recurring == 0,
+                Event.reminder_sent == 0,
+                Event.reminder_time.isnot(None),
+                Event.next_run_time.is_(None)
+            ).update({Event.next_run_time: Event.reminder_time}, synchronize_session=False)
+
+            recurring = 0
+            for event in db.query(Event).filter(Event.is_recurring == 1, Event.next_run_time.is_(None)).all():
+                try:
+                    event.next_run_time = compute_recurring_next(event.recurrence_spec or event.recurrence_rule)
+                    recurring += 1
+                except Exception as e:
+                    print(f"無法計算週期規則 {event.recurrence_rule} (ID {event.id}): {e}")
+            _commit(db)
+            _event_cache.clear()
+            return {"one_shot": one_shot, "recurring": recurring}
+        finally:
+            _close(db)
+    return safe_db_operation(_backfill)
+
+def iter_schedulable_events(now, batch_size=500):
+    """
+    串流讀取需要逐筆排程的事件：未發送且尚未到期的一次性提醒，
+    以及不適用時段排程 (沒有時段索引) 的週期提醒，例如每 N 天、每月。
+    每週固定時段的週期提醒由時段排程處理 (見 recurring_slots)。
+    以 yield_per 分批取回，不會一次把整張表載入記憶體。
+    """
+    db = next(get_db())
+    try:
+        query = db.query(*_columns(Event, ScheduleRow)).filter(
+            Event.reminder_sent == 0,
+            or_(Event.is_recurring == 0, ~Event.id.in_(db.query(RecurringSlot.event_id))),
+            func.coalesce(Event.next_run_time, Event.reminder_time) > now
+        ).order_by(Event.id.asc()).yield_per(batch_size)
+        for row in query:
+            yield ScheduleRow._make(row)
+    finally:
+        _close(db)
+
+def _reminder_job_query(db, columns):
+    """
+    EventJobStore 當作 reminder_{id} job 的事件：尚未完成、有 next_run_time，
+    且不屬於週期時段排程 (每週固定時段的提醒由 recurring_slot_* job 觸發)。
+    """
+    return db.query(*columns).filter(
+        Event.reminder_sent == 0,
+        Event.next_run_time.isnot(None),
+        or_(Event.is_recurring == 0, ~Event.id.in_(db.query(RecurringSlot.event_id)))
+    )
+
+def get_reminder_jobs(until=None, after=None, event_id=None, limit=None):
+    """逐筆排程的提醒 (依 next_run_time 排序)：until / after 篩選觸發時間，event_id 只查單筆"""
+    def _get():
+        db = next(get_db())
+        try:
+            query = _reminder_job_query(db, _columns(Event, ScheduleRow))
+            if until is not None:
+                query = query.filter(Event.next_run_time <= until)
+            if after is not None:
+                query = query.filter(Event.next_run_time > after)
+            if event_id is not None:
+                query = query.filter(Event.id == event_id)
+            query = query.order_by(Event.next_run_time.asc(), Event.id.asc())
+            if limit is not None:
+                query = query.limit(limit)
+            return _to_rows(ScheduleRow, query)
+        finally:
+            _close(db)
+    return safe_db_operation(_get)
+
+def get_next_reminder_job_time():
+    """逐筆排程的提醒中最早的 next_run_time，沒有時回傳 None"""
+    def _get():
+        db = next(get_db())
+        try:
+            return _reminder_job_query(db, [func.min(Event.next_run_time)]).scalar()
+        finally:
+            _close(db)
+    return safe_db_operation(_get)
+
+def clear_next_run_time(event_id, only_if=None):
+    """
+    清掉事件的 next_run_time。指定 only_if 時只有目前的值仍等於 only_if 才清除
+    (發送中的提醒可能已經寫入下一次的觸發時間，不能被覆蓋)。回傳是否有更新。
+    """
+    def _clear():
+        db = next(get_db())
+        try:
+            conditions = (Event.next_run_time == only_if,) if only_if is not None else ()
+            row = _update_event_returning(db, event_id, {Event.next_run_time: None, Event.claimed_until: None}, *conditions)
+            _commit(db)
+            return row is not None
+        finally:
+            _close(db)
+    return safe_db_operation(_clear)
+
+def get_active_slots():
+    """目前有週期提醒的所有時段"""
+    def _get():
+        db = next(get_db())
+        try:
+            return [row[0] for row in db.query(RecurringSlot.slot).distinct().all()]
+        finally:
+            _close(db)
+    return safe_db_operation(_get)
+
+def get_slot_event_ids(slot):
+    """某個時段要觸發的週期提醒 event_id"""
+    def _get():
+        db = next(get_db())
+        try:
+            rows = db.query(RecurringSlot.event_id).join(Event, Event.id == RecurringSlot.event_id).filter(
+                RecurringSlot.slot == slot,
+                Event.is_recurring == 1
+            ).order_by(RecurringSlot.event_id.asc()).all()
+            return [row[0] for row in rows]
+        finally:
+            _close(db)
+    return safe_db_operation(_get)
+
+def backfill_recurrence_specs(normalize_rule):
+    """
+    為還沒有正規化規則的週期提醒 (舊資料) 補上 recurrence_spec。
+    回傳 {"normalized": 補上的事件數, "invalid": 規則無法解析的事件數}
+    """
+    def _backfill():
+        db = next(get_db())
+        try:
+            normalized = invalid = 0
+            for event in db.query(Event).filter(Event.is_recurring == 1, Event.recurrence_spec.is_(None)).all():
+                try:
+                    event.recurrence_spec = normalize_rule(event.recurrence_rule)
+                    normalized += 1
+                except Exception as e:
+                    invalid += 1
+                    print(f"無法解析週期規則 {event.recurrence_rule} (ID {event.id}): {e}")
+            _commit(db)
+            _event_cache.clear()
+            return {"normalized": normalized, "invalid": invalid}
+        finally:
+            _close(db)
+    return safe_db_operation(_backfill)
+
+def backfill_recurring_slots(slots_for_rule):
+    """
+    為還沒有時段索引的週期提醒 (舊資料) 建立索引，並清掉已刪除事件留下的索引。
+    回傳 {"indexed": 補建的事件數, "removed": 清除的索引數, "invalid": 規則無法解析的事件數}
+    """
+    def _backfill():
+        db = next(get_db())
+        try:
+            removed = db.query(RecurringSlot).filter(
+                ~RecurringSlot.event_id.in_(db.query(Event.id).filter(Event.is_recurring == 1))
+            ).delete(synchronize_session=False)
+
+            indexed = invalid = 0
+            missing = db.query(Event.id, func.coalesce(Event.recurrence_spec, Event.recurrence_rule)).filter(
+                Event.is_recurring == 1,
+                ~Event.id.in_(db.query(RecurringSlot.event_id))
+            ).all()
+            for event_id, rule in missing:
+                try:
+                    db.add_all(RecurringSlot(slot=slot, event_id=event_id) for slot in set(slots_for_rule(rule)))
+                    indexed += 1
+                except Exception as e:
+                    invalid += 1
+                    print(f"無法解析週期規則 {rule} (ID {event_id}): {e}")
+            _commit(db)
+            return {"indexed": indexed, "removed": removed, "invalid": invalid}
+        finally:
+            _close(db)
+    return safe_db_operation(_backfill)
+
 def get_all_events_by_user(user_id):
     """獲取某個使用者建立的所有提醒 (包含一次性與週期性)"""
     def _get_all():
         db = next(get_db())
         try:
-            return db.query(Event).filter(Event.creator_user_id == user_id).order_by(Event.event_datetime.asc()).all()
+            query = db.query(*_columns(Event, EventRow)).filter(Event.creator_user_id == user_id).order_by(Event.event_datetime.asc())
+            return _to_rows(EventRow, query)
         finally:
-            db.close()
+            _close(db)
     return safe_db_operation(_get_all)
 
+# 提醒管理面板的 keyset 分頁游標：
+#   "o|<event_datetime ISO>|<id>" -> 一次性提醒 (依 event_datetime, id 排序)
+#   "r|<id>"                      -> 週期提醒 (排在一次性提醒之後，依 id 排序)
+def _encode_event_cursor(event):
+    if event.is_recurring:
+        return f"r|{event.id}"
+    return f"o|{event.event_datetime.isoformat()}|{event.id}"
+
+def _decode_event_cursor(cursor):
+    try:
+        parts = cursor.split('|')
+        if parts[0] == 'o':
+            return 'o', datetime.fromisoformat(parts[1]), int(parts[2])
+        if parts[0] == 'r':
+            return 'r', None, int(parts[1])
+    except (AttributeError, IndexError, ValueError):
+        pass
+    return 'o', None, None  # 無效或空的游標視為第一頁
+
+def get_active_events_page(user_id, limit=10, cursor=None):
+    """
+    提醒管理面板用的分頁查詢 (只包含「進行中」的提醒)：
+    一次性提醒需尚未發送且已設定提醒時間，週期提醒全部列出。
+    回傳 (events, next_cursor)；next_cursor 為 None 代表沒有下一頁。
+    """
+    def _page():
+        db = next(get_db())
+        try:
+            segment, after_dt, after_id = _decode_event_cursor(cursor)
+            rows = []
+            if segment == 'o':
+                query = db.query(*_columns(Event, EventListRow)).filter(
+                    Event.creator_user_id == user_id,
+                    Event.is_recurring == 0,
+                    Event.reminder_sent == 0,
+                    Event.reminder_time.isnot(None),
+                    Event.event_datetime.isnot(None)
+                )
+                if after_id is not None:
+                    query = query.filter(or_(
+                        Event.event_datetime > after_dt,
+                        and_(Event.event_datetime == after_dt, Event.id > after_id)
+                    ))
+                # 多取一筆用來判斷是否還有下一頁
+                rows = _to_rows(EventListRow, query.order_by(Event.event_datetime.asc(), Event.id.asc()).limit(limit + 1))
+                after_id = None
+
+            if len(rows) <= limit:
+                query = db.query(*_columns(Event, EventListRow)).filter(
+                    Event.creator_user_id == user_id,
+                    Event.is_recurring == 1,
+                    Event.reminder_sent == 0  # 有次數或結束日的週期提醒結束後會標記為已發送
+                )
+                if after_id is not None:
+                    query = query.filter(Event.id > after_id)
+                rows += _to_rows(EventListRow, query.order_by(Event.id.asc()).limit(limit + 1 - len(rows)))
+
+            page = rows[:limit]
+            next_cursor = _encode_event_cursor(page[-1]) if len(rows) > limit else None
+            return page, next_cursor
+        finally:
+            _close(db)
+    return safe_db_operation(_page)
+
 def delete_event_by_id(event_id, user_id):
     """根據 Event ID 刪除提醒，並驗證操作者是否為本人"""
     def _delete():
@@ -303,12 +1031,15 @@ def delete_event_by_id(event_id, user_id):
             event_to_delete = db.query(Event).filter(Event.id == event_id, Event.creator_user_id == user_id).first()
             if event_to_delete:
                 is_recurring = event_to_delete.is_recurring
+                if is_recurring:
+                    db.query(RecurringSlot).filter(RecurringSlot.event_id == event_id).delete(synchronize_session=False)
                 db.delete(event_to_delete)
-                db.commit()
+                _commit(db)
+                _invalidate_event(event_id)
                 return {"status": "success", "is_recurring": is_recurring}
             return {"status": "not_found"}
         finally:
-            db.close()
+            _close(db)
     return safe_db_operation(_delete)
     
 def update_event_snooze(event_id, reminder_dt, new_content):
@@ -316,15 +1047,12 @@ def update_event_snooze(event_id, reminder_dt, new_content):
     def _update():
         db = next(get_db())
         try:
-            event = db.query(Event).filter(Event.id == event_id).first()
-            if event:
-                event.reminder_time = reminder_dt
-                event.event_content = new_content  # 更新內容，加上 (延)
-                db.commit()
-                return True
-            return False
+            # 更新內容，加上 (延)
+            row = _update_event_returning(db, event_id, {Event.reminder_time: reminder_dt, Event.event_content: new_content})
+            _commit(db)
+            return row is not None
         finally:
-            db.close()
+            _close(db)
     return safe_db_operation(_update)
     
 def update_event_content(event_id, new_content):
@@ -332,14 +1060,11 @@ def update_event_content(event_id, new_content):
     def _update():
         db = next(get_db())
         try:
-            event = db.query(Event).filter(Event.id == event_id).first()
-            if event:
-                event.event_content = new_content
-                db.commit()
-                return True
-            return False
+            row = _update_event_returning(db, event_id, {Event.event_content: new_content})
+            _commit(db)
+            return row is not None
         finally:
-            db.close()
+            _close(db)
     return safe_db_operation(_update)
 
 def reschedule_event_time(event_id, new_datetime):
@@ -347,18 +1072,82 @@ def reschedule_event_time(event_id, new_datetime):
     def _update():
         db = next(get_db())
         try:
-            event = db.query(Event).filter(Event.id == event_id).first()
-            if event:
-                event.event_datetime = new_datetime # 更新原始時間
-                event.reminder_time = new_datetime  # 更新提醒時間
-                event.reminder_sent = 0             # 重置發送狀態
-                db.commit()
-                return True
-            return False
+            row = _update_event_returning(db, event_id, {
+                Event.event_datetime: new_datetime,  # 更新原始時間
+                Event.reminder_time: new_datetime,   # 更新提醒時間
+                Event.reminder_sent: 0               # 重置發送狀態
+            })
+            _commit(db)
+            return row is not None
         finally:
-            db.close()
+            _close(db)
     return safe_db_operation(_update)
     
+# ---------------------------------
+# 記憶搜尋索引 (取代 ilike '%kw%' 全表掃描)
+# ---------------------------------
+
+# Postgres: pg_trgm GIN 索引可直接服務 ILIKE '%kw%'
+# SQLite  : FTS5 trigram 虛擬表 memories_fts (rowid = memories.id)，由 save_memory / delete_memory 同步
+# trigram 至少需要 3 個字元，較短的關鍵字仍退回 ILIKE (只掃描該使用者自己的記憶)
+MEMORY_SEARCH_MIN_CHARS = 3
+_memory_search_backend = None  # 'pg_trgm' / 'fts5' / None
+
+def ensure_memory_search_index():
+    global _memory_search_backend
+    try:
+        if engine.dialect.name == 'postgresql':
+            with engine.begin() as conn:
+                conn.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_memories_keyword_trgm ON memories USING gin (keyword gin_trgm_ops)")
+                conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_memories_content_trgm ON memories USING gin (content gin_trgm_ops)")
+            _memory_search_backend = 'pg_trgm'
+        elif engine.dialect.name == 'sqlite':
+            with engine.begin() as conn:
+                exists = conn.exec_driver_sql(
+                    "SELECT 1 FROM sqlite_master WHERE type='table' AND name='memories_fts'"
+                ).first()
+                if not exists:
+                    conn.exec_driver_sql(
+                        "CREATE VIRTUAL TABLE memories_fts USING fts5(user_id UNINDEXED, keyword, content, tokenize='trigram')"
+                    )
+                    conn.exec_driver_sql(
+                        "INSERT INTO memories_fts (rowid, user_id, keyword, content) SELECT id, user_id, keyword, content FROM memories"
+                    )
+            _memory_search_backend = 'fts5'
+        print(f"Memory search index: {_memory_search_backend or 'ilike'}")
+    except (OperationalError, ProgrammingError) as e:
+        # 沒有 pg_trgm 權限或 SQLite 未編入 FTS5 時，維持原本的 ILIKE 搜尋
+        _memory_search_backend = None
+        print(f"⚠️ 無法建立記憶搜尋索引，改用 ILIKE: {e}")
+
+def _sync_memory_search(db, memory_id, user_id=None, keyword=None, content=None):
+    """同步 SQLite FTS 表；只傳 memory_id 代表刪除"""
+    if _memory_search_backend != 'fts5':
+        return
+    db.execute(text("DELETE FROM memories_fts WHERE rowid = :id"), {"id": memory_id})
+    if keyword is not None:
+        db.execute(
+            text("INSERT INTO memories_fts (rowid, user_id, keyword, content) VALUES (:id, :user_id, :keyword, :content)"),
+            {"id": memory_id, "user_id": user_id, "keyword": keyword, "content": content}
+        )
+
+def _search_memories_query(db, user_id, keyword):
+    """關鍵字或內容包含 keyword 的記憶，關鍵字命中的排在前面"""
+    query = db.query(*_columns(Memory, MemoryRow)).filter(Memory.user_id == user_id)
+    if _memory_search_backend == 'fts5' and len(keyword) >= MEMORY_SEARCH_MIN_CHARS:
+        phrase = '"' + keyword.replace('"', '""') + '"'
+        matched_ids = text("SELECT rowid FROM memories_fts WHERE memories_fts MATCH :phrase AND user_id = :user_id") \
+            .bindparams(phrase=phrase, user_id=user_id)
+        query = query.filter(Memory.id.in_(matched_ids))
+    else:
+        query = query.filter(or_(
+            Memory.keyword.icontains(keyword, autoescape=True),
+            Memory.content.icontains(keyword, autoescape=True)
+        ))
+    keyword_first = case((Memory.keyword.icontains(keyword, autoescape=True), 0), else_=1)
+    return query.order_by(keyword_first, Memory.keyword)
+
 def save_memory(user_id, keyword, content):
     """儲存記憶 (如果關鍵字已存在則更新)"""
     def _save():
@@ -372,16 +1161,20 @@ def save_memory(user_id, keyword, content):
             
             if existing:
                 existing.content = content # 更新
+                memory_item = existing
                 action = "更新"
             else:
-                new_mem = Memory(user_id=user_id, keyword=keyword, content=content)
-                db.add(new_mem)
+                memory_item = Memory(user_id=user_id, keyword=keyword, content=content)
+                db.add(memory_item)
                 action = "新增"
-            
-            db.commit()
+
+            db.flush()
+            _sync_memory_search(db, memory_item.id, user_id, keyword, content)
+            _commit(db)
+            _invalidate_collection('memories', user_id)
             return action
         finally:
-            db.close()
+            _close(db)
     return safe_db_operation(_save)
 
 def get_memory(user_id, keyword):
@@ -389,14 +1182,9 @@ def get_memory(user_id, keyword):
     def _get():
         db = next(get_db())
         try:
-            # 支援模糊搜尋 (選擇性)
-            # 這裡示範精確搜尋，比較不會搜出太多雜訊
-            return db.query(Memory).filter(
-                Memory.user_id == user_id, 
-                Memory.keyword.ilike(f"%{keyword}%")
-            ).first()
+            return _to_row(MemoryRow, _search_memories_query(db, user_id, keyword).first())
         finally:
-            db.close()
+            _close(db)
     return safe_db_operation(_get)
 
 def delete_memory(user_id, keyword):
@@ -409,22 +1197,31 @@ def delete_memory(user_id, keyword):
                 Memory.keyword == keyword
             ).first()
             if mem:
+                _sync_memory_search(db, mem.id)
                 db.delete(mem)
-                db.commit()
+                _commit(db)
+                _invalidate_collection('memories', user_id)
                 return True
             return False
         finally:
-            db.close()
+            _close(db)
     return safe_db_operation(_delete)
 
 def get_all_memories(user_id):
     """列出所有關鍵字"""
+    cached = _collection_cache.get(('memories', user_id))
+    if cached is not None:
+        return cached
     def _get_all():
+        generation = _collection_cache.generation()
         db = next(get_db())
         try:
-            return db.query(Memory).filter(Memory.user_id == user_id).all()
+            # 記憶清單只顯示關鍵字，不載入內容全文
+            memories = _to_rows(MemoryKeywordRow, db.query(*_columns(Memory, MemoryKeywordRow)).filter(Memory.user_id == user_id))
+            _cache_set(db, _collection_cache, ('memories', user_id), memories, generation)
+            return memories
         finally:
-            db.close()
+            _close(db)
     return safe_db_operation(_get_all)
     
 def search_memories_by_keyword(user_id, keyword):
@@ -432,13 +1229,10 @@ def search_memories_by_keyword(user_id, keyword):
     def _search():
         db = next(get_db())
         try:
-            # 使用 ilike 做模糊搜尋，回傳所有符合的結果 (.all())
-            return db.query(Memory).filter(
-                Memory.user_id == user_id, 
-                Memory.keyword.ilike(f"%{keyword}%") 
-            ).all()
+            # 走搜尋索引 (pg_trgm / FTS5)，回傳所有符合的結果 (.all())
+            return _to_rows(MemoryRow, _search_memories_query(db, user_id, keyword))
         finally:
-            db.close()
+            _close(db)
     return safe_db_operation(_search)
 
 def get_memory_by_id(memory_id):
@@ -446,9 +1240,9 @@ def get_memory_by_id(memory_id):
     def _get():
         db = next(get_db())
         try:
-            return db.query(Memory).filter(Memory.id == memory_id).first()
+            return _to_row(MemoryRow, db.query(*_columns(Memory, MemoryRow)).filter(Memory.id == memory_id).first())
         finally:
-            db.close()
+            _close(db)
     return safe_db_operation(_get)
     
 # ---------------------------------
@@ -467,20 +1261,26 @@ def add_user_card(user_id, card_name):
             
             new_card = UserCard(user_id=user_id, card_name=card_name)
             db.add(new_card)
-            db.commit()
+            _commit(db)
+            _invalidate_collection('cards', user_id)
             return "成功"
         finally:
-            db.close()
+            _close(db)
     return safe_db_operation(_add)
 
 def get_user_cards(user_id):
+    cached = _collection_cache.get(('cards', user_id))
+    if cached is not None:
+        return cached
     def _get():
+        generation = _collection_cache.generation()
         db = next(get_db())
         try:
-            cards = db.query(UserCard).filter(UserCard.user_id == user_id).all()
-            return [c.card_name for c in cards]
+            card_names = [name for (name,) in db.query(UserCard.card_name).filter(UserCard.user_id == user_id)]
+            _cache_set(db, _collection_cache, ('cards', user_id), card_names, generation)
+            return card_names
         finally:
-            db.close()
+            _close(db)
     return safe_db_operation(_get)
 
 def delete_user_card(user_id, card_name):
@@ -493,9 +1293,492 @@ def delete_user_card(user_id, card_name):
             ).first()
             if card:
                 db.delete(card)
-                db.commit()
+                _commit(db)
+                _invalidate_collection('cards', user_id)
                 return True
             return False
         finally:
-            db.close()
-    return safe_db_operation(_delete)
\ No newline at end of file
+            _close(db)
+    return safe_db_operation(_delete)
+
+# ---------------------------------
+# 推播 Outbox
+# ---------------------------------
+
+def enqueue_outbox(target_id, payload, retry_key, lease_until, event_id=None):
+    """
+    寫入一筆待送出的推播，回傳 OutboxRow。
+    next_attempt_at 設為 lease_until：呼叫端會立刻嘗試送出 (或等合併視窗結束)，
+    若行程在送出前中斷，租約到期後由 drain 工作接手。
+    """
+    def _enqueue():
+        db = next(get_db())
+        try:
+            message = OutboxMessage(event_id=event_id, target_id=target_id, payload=payload,
+                                    retry_key=retry_key, status='pending', attempts=0, next_attempt_at=lease_until)
+            db.add(message)
+            db.flush()
+            row = OutboxRow(message.id, event_id, target_id, payload, retry_key, 0, None)
+            _commit(db)
+            return row
+        finally:
+            _close(db)
+    return safe_db_operation(_enqueue)
+
+def claim_outbox_batch(now, lease_until, limit=50):
+    """
+    認領 next_attempt_at <= now 的待送推播，並把 next_attempt_at 延到 lease_until
+    (Postgres 使用 FOR UPDATE SKIP LOCKED，多個 drain 可同時執行)。
+    結果不明的 multicast 成員一定整批認領 (可能超過 limit)，才能以同一個 key 重送同一批。
+    """
+    def _claim():
+        db = next(get_db())
+        try:
+            query = db.query(OutboxMessage).filter(
+                OutboxMessage.status == 'pending',
+                OutboxMessage.next_attempt_at <= now
+            ).order_by(OutboxMessage.next_attempt_at.asc()).limit(limit)
+            if engine.dialect.name == 'postgresql':
+                query = query.with_for_update(skip_locked=True)
+            messages = query.all()
+
+            multicast_keys = {message.multicast_key for message in messages if message.multicast_key}
+            if multicast_keys:
+                seen = {message.id for message in messages}
+                messages += [message for message in db.query(OutboxMessage).filter(
+                    OutboxMessage.status == 'pending',
+                    OutboxMessage.multicast_key.in_(multicast_keys)
+                ) if message.id not in seen]
+
+            claimed = []
+            for message in messages:
+                claimed.append(OutboxRow(message.id, message.event_id, message.target_id,
+                                         message.payload, message.retry_key, message.attempts, message.multicast_key))
+                message.next_attempt_at = lease_until
+            _commit(db)
+            return claimed
+        finally:
+            _close(db)
+    return safe_db_operation(_claim)
+
+def mark_outbox_sent(outbox_ids, sent_at):
+    """標記一或多筆推播已送出 (合併推播時同一次呼叫包含多筆)"""
+    def _mark():
+        db = next(get_db())
+        try:
+            db.execute(update(OutboxMessage).where(OutboxMessage.id.in_(outbox_ids)).values(
+                status='sent', sent_at=sent_at, next_attempt_at=None,
+                attempts=OutboxMessage.attempts + 1, last_error=None
+            ))
+            _commit(db)
+            return True
+        finally:
+            _close(db)
+    return safe_db_operation(_mark)
+
+def mark_outbox_failed(outbox_ids, error, next_attempt_at, multicast_key=None):
+    """
+    記錄失敗；next_attempt_at 為 None 代表放棄 (status = dead)。
+    同一次合併推播的多筆使用相同的重試時間，下次仍會被一起送出。
+    multicast_key：multicast 結果不明 (LINE 可能已收下) 時記下這批成員與 key，下次原樣重送；
+    其他失敗 (包括被拒絕後改逐筆 push) 一律清除。
+    """
+    def _mark():
+        db = next(get_db())
+        try:
+            db.execute(update(OutboxMessage).where(OutboxMessage.id.in_(outbox_ids)).values(
+                status='pending' if next_attempt_at else 'dead',
+                next_attempt_at=next_attempt_at,
+                attempts=OutboxMessage.attempts + 1,
+                last_error=error[:2000],
+                multicast_key=multicast_key
+            ))
+            _commit(db)
+            return True
+        finally:
+            _close(db)
+    return safe_db_operation(_mark)
+
+def replay_outbox(now, include_dead=True, stuck_before=None, ids=None, event_id=None, dry_run=False):
+    """
+    把卡住的推播重新排入佇列 (attempts 歸零、立即可送)：
+      include_dead : 已放棄的 (dead)
+      stuck_before : next_attempt_at 早於此時間仍未送出的 pending
+    ids / event_id 可再縮小範圍。回傳符合條件的筆數。
+    """
+    def _replay():
+        db = next(get_db())
+        try:
+            conditions = []
+            if include_dead:
+                conditions.append(OutboxMessage.status == 'dead')
+            if stuck_before is not None:
+                conditions.append(and_(OutboxMessage.status == 'pending', OutboxMessage.next_attempt_at < stuck_before))
+            if not conditions:
+                return 0
+            query = db.query(OutboxMessage).filter(or_(*conditions))
+            if ids:
+                query = query.filter(OutboxMessage.id.in_(ids))
+            if event_id is not None:
+                query = query.filter(OutboxMessage.event_id == event_id)
+            if dry_run:
+                return query.count()
+            count = query.update({
+                OutboxMessage.status: 'pending',
+                OutboxMessage.attempts: 0,
+                OutboxMessage.next_attempt_at: now
+            }, synchronize_session=False)
+            _commit(db)
+            return count
+        finally:
+            _close(db)
+    return safe_db_operation(_replay)
+
+def outbox_counts():
+    """各狀態的筆數"""
+    def _count():
+        db = next(get_db())
+        try:
+            rows = db.query(OutboxMessage.status, func.count(OutboxMessage.id)).group_by(OutboxMessage.status).all()
+            return {status: count for status, count in rows}
+        finally:
+            _close(db)
+    return safe_db_operation(_count)
+
+# ---------------------------------
+# 顯示名稱快取 (Profile Names)
+# ---------------------------------
+
+def get_profile_name(source_type, container_id, user_id, newer_than):
+    """讀取 newer_than 之後寫入的顯示名稱，沒有或已過期則回傳 None"""
+    def _get():
+        db = next(get_db())
+        try:
+            row = db.query(ProfileName.display_name).filter(
+                ProfileName.source_type == source_type,
+                ProfileName.container_id == container_id,
+                ProfileName.user_id == user_id,
+                ProfileName.updated_at > newer_than
+            ).first()
+            return row[0] if row else None
+        finally:
+            _close(db)
+    return safe_db_operation(_get)
+
+def save_profile_name(source_type, container_id, user_id, display_name, updated_at):
+    """寫入 (或更新) 顯示名稱"""
+    def _save():
+        db = next(get_db())
+        try:
+            existing = db.query(ProfileName).filter(
+                ProfileName.source_type == source_type,
+                ProfileName.container_id == container_id,
+                ProfileName.user_id == user_id
+            ).first()
+            try:
+                # 用 savepoint 包住，兩個請求同時寫入同一筆時不會拖垮外層的 Unit of Work
+                with db.begin_nested():
+                    if existing:
+                        existing.display_name = display_name
+                        existing.updated_at = updated_at
+                    else:
+                        db.add(ProfileName(source_type=source_type, container_id=container_id, user_id=user_id,
+                                           display_name=display_name, updated_at=updated_at))
+            except IntegrityError:
+                return False
+            _commit(db)
+            return True
+        finally:
+            _close(db)
+    return safe_db_operation(_save)
+
+# ---------------------------------
+# 排程器心跳與停機補發 (Catch-up)
+# ---------------------------------
+
+def record_heartbeat(name, beat_at):
+    def _record():
+        db = next(get_db())
+        try:
+            db.merge(SchedulerHeartbeat(name=name, beat_at=beat_at))
+            _commit(db)
+            return True
+        finally:
+            _close(db)
+    return safe_db_operation(_record)
+
+def get_heartbeat(name):
+    """最後一次心跳時間，從未寫入過時回傳 None"""
+    def _get():
+        db = next(get_db())
+        try:
+            row = db.query(SchedulerHeartbeat.beat_at).filter(SchedulerHeartbeat.name == name).first()
+            return row[0] if row else None
+        finally:
+            _close(db)
+    return safe_db_operation(_get)
+
+def get_missed_events(until):
+    """
+    所有 next_run_time <= until 且尚未完成的提醒 (最近到期的排在前面)。
+    補發在派送器開始認領之前執行，此時仍有租約的提醒是前一個行程認領後來不及送出的，一併列入。
+    """
+    def _get():
+        db = next(get_db())
+        try:
+            query = db.query(*_columns(Event, MissedEvent)).filter(
+                Event.reminder_sent == 0,
+                Event.next_run_time.isnot(None),
+                Event.next_run_time <= until
+            ).order_by(Event.next_run_time.desc(), Event.id.asc())
+            return _to_rows(MissedEvent, query)
+        finally:
+            _close(db)
+    return safe_db_operation(_get)
+
+def settle_missed_events(sent_ids=(), cleared_ids=(), advanced=None):
+    """
+    批次更新補發 (或略過) 後的提醒狀態：
+      sent_ids   : 已補發的一次性提醒 -> 標記完成
+      cleared_ids: 略過的一次性提醒 -> 清掉 next_run_time (保留在清單中，不再自動觸發)
+      advanced   : {event_id: 下一次觸發時間} 的週期提醒；None 代表規則已結束 -> 標記完成
+    """
+    advanced = advanced or {}
+    def _settle():
+        db = next(get_db())
+        try:
+            if sent_ids:
+                db.query(Event).filter(Event.id.in_(list(sent_ids))).update(
+                    {Event.reminder_sent: 1, Event.next_run_time: None, Event.claimed_until: None},
+                    synchronize_session=False)
+            if cleared_ids:
+                db.query(Event).filter(Event.id.in_(list(cleared_ids))).update(
+                    {Event.next_run_time: None, Event.claimed_until: None}, synchronize_session=False)
+            if advanced:
+                db.execute(update(Event), [
+                    {"id": event_id, "next_run_time": next_time, "reminder_sent": 0 if next_time else 1,
+                     "claimed_until": None}
+                    for event_id, next_time in advanced.items()
+                ])
+            for event_id in (*sent_ids, *cleared_ids, *advanced):
+                _invalidate_event(event_id, db)
+            _commit(db)
+            return len(sent_ids) + len(cleared_ids) + len(advanced)
+        finally:
+            _close(db)
+    return safe_db_operation(_settle)
+
+# ---------------------------------
+# Webhook Inbox
+# ---------------------------------
+
+def append_inbox(events, received_at):
+    """
+    寫入一批 webhook 事件 [(webhook_event_id, source_key, payload), ...]，已存在的 webhook_event_id 直接略過。
+    回傳實際寫入的筆數。
+    """
+    def _append():
+        db = next(get_db())
+        try:
+            added = 0
+            for webhook_event_id, source_key, payload in events:
+                try:
+                    # 每筆用 savepoint 包住，重送的事件撞到唯一索引時不影響同一批的其他事件
+                    with db.begin_nested():
+                        db.add(WebhookInboxEvent(webhook_event_id=webhook_event_id, source_key=source_key,
+                                                 payload=payload, status='pending', attempts=0,
+                                                 next_attempt_at=received_at, created_at=received_at))
+                    added += 1
+                except IntegrityError:
+                    continue
+            _commit(db)
+            return added
+        finally:
+            _close(db)
+    return safe_db_operation(_append)
+
+def claim_inbox_batch(now, lease_until, limit=50):
+    """
+    依收到的順序認領待處理的事件，attempts + 1 並把 next_attempt_at 延到 lease_until
+    (處理中的行程中斷時，租約過期後由其他 worker 接手；Postgres 使用 FOR UPDATE SKIP LOCKED)。
+    每一筆都以條件式 UPDATE 認領，只保留 rowcount == 1 的：沒有 SKIP LOCKED 的 SQLite 上，
+    兩個 worker 同時查到同一批事件時也只有一個認領得到。
+    同一個 source_key 只認領「前面沒有其他未完成事件」的連續幾筆：前一筆還在別的行程 (或這個行程) 處理中時，
+    後面的事件留在 inbox 等它完成，跨行程也能維持同一位使用者的事件順序。
+    """
+    def _claim():
+        db = next(get_db())
+        try:
+            query = db.query(WebhookInboxEvent).filter(
+                WebhookInboxEvent.status == 'pending',
+                WebhookInboxEvent.next_attempt_at <= now
+            ).order_by(WebhookInboxEvent.id.asc()).limit(limit)
+            if engine.dialect.name == 'postgresql':
+                query = query.with_for_update(skip_locked=True)
+            candidates = query.all()
+
+            # 每個 key 未完成事件的 id 依序排列，只有與候選事件從頭對得上的部分可以認領
+            # (處理中、被其他行程鎖住或超出 limit 的事件會讓同一個 key 後面的事件等待)
+            keys = {item.source_key for item in candidates if item.source_key is not None}
+            unfinished = {}
+            if keys:
+                rows = db.query(WebhookInboxEvent.source_key, WebhookInboxEvent.id).filter(
+                    WebhookInboxEvent.source_key.in_(keys),
+                    WebhookInboxEvent.status == 'pending',
+                    WebhookInboxEvent.id <= max(item.id for item in candidates)
+                ).order_by(WebhookInboxEvent.id.asc()).all()
+                for source_key, inbox_id in rows:
+                    unfinished.setdefault(source_key, []).append(inbox_id)
+            position = {}
+
+            claimed = []
+            for item in candidates:
+                if item.source_key is not None:
+                    index = position.get(item.source_key, 0)
+                    ids = unfinished.get(item.source_key, [])
+                    if index is None or index >= len(ids) or ids[index] != item.id:
+                        position[item.source_key] = None
+                        continue
+                result = db.execute(update(WebhookInboxEvent).where(
+                    WebhookInboxEvent.id == item.id,
+                    WebhookInboxEvent.status == 'pending',
+                    WebhookInboxEvent.next_attempt_at <= now
+                ).values(
+                    next_attempt_at=lease_until, attempts=WebhookInboxEvent.attempts + 1
+                ).execution_options(synchronize_session=False))
+                if result.rowcount != 1:
+                    # 已被其他 worker 搶先認領：同一個 key 後面的事件也要等它完成
+                    if item.source_key is not None:
+                        position[item.source_key] = None
+                    continue
+                if item.source_key is not None:
+                    position[item.source_key] = index + 1
+                claimed.append(InboxRow(item.id, item.webhook_event_id, item.source_key, item.payload, item.attempts + 1))
+            _commit(db)
+            return claimed
+        finally:
+            _close(db)
+    return safe_db_operation(_claim)
+
+def mark_inbox_done(inbox_ids, processed_at):
+    def _mark():
+        db = next(get_db())
+        try:
+            count = db.query(WebhookInboxEvent).filter(WebhookInboxEvent.id.in_(list(inbox_ids))).update(
+                {WebhookInboxEvent.status: 'done', WebhookInboxEvent.processed_at: processed_at},
+                synchronize_session=False)
+            _commit(db)
+            return count
+        finally:
+            _close(db)
+    return safe_db_operation(_mark)
+
+def mark_inbox_failed(inbox_ids, error, processed_at):
+    def _mark():
+        db = next(get_db())
+        try:
+            count = db.query(WebhookInboxEvent).filter(WebhookInboxEvent.id.in_(list(inbox_ids))).update(
+                {WebhookInboxEvent.status: 'failed', WebhookInboxEvent.last_error: error,
+                 WebhookInboxEvent.processed_at: processed_at},
+                synchronize_session=False)
+            _commit(db)
+            return count
+        finally:
+            _close(db)
+    return safe_db_operation(_mark)
+
+def fail_exhausted_inbox(max_attempts, now):
+    """租約已過期、且已嘗試 max_attempts 次仍未完成的事件標記為 failed (避免讓 worker 反覆當掉)"""
+    def _fail():
+        db = next(get_db())
+        try:
+            count = db.query(WebhookInboxEvent).filter(
+                WebhookInboxEvent.status == 'pending',
+                WebhookInboxEvent.attempts >= max_attempts,
+                WebhookInboxEvent.next_attempt_at <= now
+            ).update({WebhookInboxEvent.status: 'failed', WebhookInboxEvent.last_error: '超過重試次數',
+                      WebhookInboxEvent.processed_at: now}, synchronize_session=False)
+            _commit(db)
+            return count
+        finally:
+            _close(db)
+    return safe_db_operation(_fail)
+
+def prune_inbox(before):
+    """刪除 before 之前收到、已處理完的事件 (保留期間內仍可用來比對重送)"""
+    def _prune():
+        db = next(get_db())
+        try:
+            count = db.query(WebhookInboxEvent).filter(
+                WebhookInboxEvent.status.in_(['done', 'failed']),
+                WebhookInboxEvent.created_at < before
+            ).delete(synchronize_session=False)
+            _commit(db)
+            return count
+        finally:
+            _close(db)
+    return safe_db_operation(_prune)
+
+def inbox_counts():
+    def _counts():
+        db = next(get_db())
+        try:
+            rows = db.query(WebhookInboxEvent.status, func.count(WebhookInboxEvent.id)).group_by(WebhookInboxEvent.status).all()
+            return {status: count for status, count in rows}
+        finally:
+            _close(db)
+    return safe_db_operation(_counts)
+
+# ---------------------------------
+# 對話狀態 (Conversation States)
+# ---------------------------------
+
+def get_conversation_state(user_id, now):
+    """尚未過期的狀態 JSON，沒有則回傳 None"""
+    def _get():
+        db = next(get_db())
+        try:
+            row = db.query(ConversationState.payload).filter(
+                ConversationState.user_id == user_id,
+                ConversationState.expires_at > now
+            ).first()
+            return row[0] if row else None
+        finally:
+            _close(db)
+    return safe_db_operation(_get)
+
+def save_conversation_state(user_id, action, payload, expires_at):
+    def _save():
+        db = next(get_db())
+        try:
+            db.merge(ConversationState(user_id=user_id, action=action, payload=payload, expires_at=expires_at))
+            _commit(db)
+            return True
+        finally:
+            _close(db)
+    return safe_db_operation(_save)
+
+def delete_conversation_state(user_id):
+    def _delete():
+        db = next(get_db())
+        try:
+            count = db.query(ConversationState).filter(ConversationState.user_id == user_id).delete(
+                synchronize_session=False)
+            _commit(db)
+            return count
+        finally:
+            _close(db)
+    return safe_db_operation(_delete)
+
+def prune_conversation_states(now):
+    """刪除已過期的狀態"""
+    def _prune():
+        db = next(get_db())
+        try:
+            count = db.query(ConversationState).filter(ConversationState.expires_at <= now).delete(
+                synchronize_session=False)
+            _commit(db)
+            return count
+        finally:
+            _close(db)
+    return safe_db_operation(_prune)
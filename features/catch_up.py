@@ -0,0 +1,124 @@
+# features/catch_up.py (停機補發：依排程器心跳找出重新部署或資料庫中斷期間錯過的提醒)
+#
+# 排程器每隔一段時間把目前時間寫入 scheduler_heartbeats。重新啟動時，
+# next_run_time 落在「最後一次心跳」到「現在」之間、卻還沒送出的提醒就是停機期間錯過的，
+# 依 target 合併成一則「遲到的提醒」補發；總數有上限，長時間停機也不會一次湧出大量推播。
+# 超過上限或比心跳更早的提醒不補發：一次性提醒清掉 next_run_time，週期提醒直接推進到下一次。
+
+import os
+import logging
+from datetime import datetime, timedelta
+
+from linebot.models import TextSendMessage
+
+from db import (
+    unit_of_work, record_heartbeat, get_heartbeat, get_missed_events, settle_missed_events
+)
+from features.dispatcher import as_aware
+from features.outbox import enqueue_push, deliver_all, is_coalescing
+from features.recurrence import rule_of
+
+logger = logging.getLogger(__name__)
+
+REMINDER_CATCHUP = os.environ.get('REMINDER_CATCHUP', 'on').strip().lower() in ('1', 'on', 'true', 'yes')
+HEARTBEAT_SECONDS = int(os.environ.get('SCHEDULER_HEARTBEAT_SECONDS', 30))
+# 一次啟動最多補發幾則提醒，以及最多往回找多久 (沒有心跳紀錄時也以此為準)
+CATCHUP_MAX_REMINDERS = int(os.environ.get('CATCHUP_MAX_REMINDERS', 200))
+CATCHUP_MAX_AGE_HOURS = float(os.environ.get('CATCHUP_MAX_AGE_HOURS', 24))
+# 每批處理的 target 數 (每批一個 Unit of Work，commit 後送出)
+CATCHUP_BATCH_TARGETS = int(os.environ.get('CATCHUP_BATCH_TARGETS', 50))
+# 剛過期不久的提醒仍在排程器的 misfire_grace_time 內，交給排程器 / 派送器照常發送
+CATCHUP_GRACE_SECONDS = int(os.environ.get('CATCHUP_GRACE_SECONDS', 60))
+# 一則補發訊息最多列出幾個提醒
+MAX_LINES_PER_MESSAGE = 20
+
+HEARTBEAT_NAME = 'scheduler'
+HEARTBEAT_JOB_ID = 'scheduler_heartbeat'
+
+def _beat(TAIPEI_TZ):
+    record_heartbeat(HEARTBEAT_NAME, datetime.now(TAIPEI_TZ))
+
+def start_heartbeat(scheduler, TAIPEI_TZ, jobstore):
+    """註冊定期寫入心跳的 job (應在補發完成後才啟動，否則會蓋掉停機前的心跳)"""
+    scheduler.add_job(
+        _beat,
+        'interval',
+        seconds=HEARTBEAT_SECONDS,
+        args=[TAIPEI_TZ],
+        id=HEARTBEAT_JOB_ID,
+        jobstore=jobstore,
+        next_run_time=datetime.now(TAIPEI_TZ),
+        replace_existing=True
+    )
+
+def _late_message(events, TAIPEI_TZ):
+    lines = [
+        f"• {as_aware(event.next_run_time, TAIPEI_TZ).astimezone(TAIPEI_TZ):%m/%d %H:%M} {event.event_content}"
+        for event in events[:MAX_LINES_PER_MESSAGE]
+    ]
+    if len(events) > MAX_LINES_PER_MESSAGE:
+        lines.append(f"…還有 {len(events) - MAX_LINES_PER_MESSAGE} 則")
+    return TextSendMessage(text="⏰ 系統暫停期間錯過的提醒：\n" + "\n".join(lines))
+
+def _settle(events, now, TAIPEI_TZ, sent):
+    """已補發 (sent=True) 或略過的提醒：一次性提醒標記完成或清掉觸發時間，週期提醒推進到下一次"""
+    one_shot = [event.id for event in events if not event.is_recurring]
+    advanced = {}
+    for event in events:
+        if event.is_recurring:
+            try:
+                advanced[event.id] = rule_of(event).next_after(now, TAIPEI_TZ)
+            except ValueError as e:
+                logger.error(f"無法解析週期規則 (ID {event.id}): {e}")
+    if sent:
+        return settle_missed_events(sent_ids=one_shot, advanced=advanced)
+    return settle_missed_events(cleared_ids=one_shot, advanced=advanced)
+
+def catch_up_missed(line_bot_api, TAIPEI_TZ, now=None, grace_seconds=CATCHUP_GRACE_SECONDS):
+    """
+    補發停機期間錯過的提醒 (應在排程器 / 派送器開始處理到期提醒之前執行)。
+    grace_seconds 內剛到期的提醒留給排程器 / 派送器照常發送。
+    回傳 {"late": 補發的提醒數, "targets": 補發的對象數, "skipped": 略過的提醒數}
+    """
+    now = now or datetime.now(TAIPEI_TZ)
+    counts = {"late": 0, "targets": 0, "skipped": 0}
+    if not REMINDER_CATCHUP:
+        return counts
+    missed = get_missed_events(now - timedelta(seconds=grace_seconds))
+    if not missed:
+        return counts
+
+    since = now - timedelta(hours=CATCHUP_MAX_AGE_HOURS)
+    last_beat = get_heartbeat(HEARTBEAT_NAME)
+    if last_beat is not None:
+        # 心跳之後到停機之間還有不到一個心跳週期的空檔，往前多留一個週期
+        since = max(since, as_aware(last_beat, TAIPEI_TZ) - timedelta(seconds=HEARTBEAT_SECONDS))
+
+    late, skipped = [], []
+    for event in missed:
+        if as_aware(event.next_run_time, TAIPEI_TZ) > since and len(late) < CATCHUP_MAX_REMINDERS:
+            late.append(event)
+        else:
+            skipped.append(event)
+
+    by_target = {}
+    for event in reversed(late):  # 訊息內依到期時間由早到晚列出
+        by_target.setdefault(event.target_id, []).append(event)
+    targets = list(by_target.items())
+
+    for start in range(0, len(targets), CATCHUP_BATCH_TARGETS):
+        batch = targets[start:start + CATCHUP_BATCH_TARGETS]
+        # 寫入 outbox 與狀態更新一起 commit：中途失敗時整批重來，不會重複也不會遺漏
+        with unit_of_work():
+            rows = [enqueue_push(target_id, _late_message(events, TAIPEI_TZ)) for target_id, events in batch]
+            _settle([event for _, events in batch for event in events], now, TAIPEI_TZ, sent=True)
+        if not is_coalescing():
+            deliver_all(line_bot_api, rows)
+        counts["targets"] += len(batch)
+        counts["late"] += sum(len(events) for _, events in batch)
+
+    if skipped:
+        _settle(skipped, now, TAIPEI_TZ, sent=False)
+        counts["skipped"] = len(skipped)
+    logger.info(f"⏰ 停機補發 (自 {since:%m/%d %H:%M:%S} 起): {counts}")
+    return counts
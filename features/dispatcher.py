@@ -0,0 +1,120 @@
+# features/dispatcher.py (以 events.next_run_time 索引驅動的提醒派送器)
+
+import os
+import logging
+from datetime import datetime, timedelta
+
+from db import claim_due_events
+from features.leader import is_leader_election_enabled
+from features.send_queue import ReminderSender
+from features.outbox import MULTICAST_MAX_RECIPIENTS
+from features.recurrence import rule_of
+
+logger = logging.getLogger(__name__)
+
+# 'jobs'      : 每個提醒各自註冊一個 APScheduler job (原本的做法)
+# 'dispatcher': 提醒只寫入 events.next_run_time，由派送器定期批次撈出即將到期的提醒
+# 開啟 leader election 時一律使用派送器模式，非 leader 的 worker 才能透過資料庫交辦排程
+DISPATCH_MODE = os.environ.get('REMINDER_DISPATCH_MODE', 'jobs').strip().lower()
+DISPATCH_INTERVAL_SECONDS = int(os.environ.get('DISPATCH_INTERVAL_SECONDS', 10))
+DISPATCH_LOOKAHEAD_SECONDS = int(os.environ.get('DISPATCH_LOOKAHEAD_SECONDS', DISPATCH_INTERVAL_SECONDS))
+DISPATCH_BATCH_SIZE = int(os.environ.get('DISPATCH_BATCH_SIZE', 200))
+# 一次性提醒認領後的租約長度：超過這段時間仍未寫入 outbox (行程當掉、重新部署、失去 leader) 就重新認領
+DISPATCH_LEASE_SECONDS = int(os.environ.get('DISPATCH_LEASE_SECONDS', 300))
+
+# 派送器專用的 job 放在記憶體 jobstore，不寫入資料庫
+DISPATCH_JOBSTORE = 'memory'
+DISPATCH_JOB_ID = 'dispatch_due_reminders'
+
+_sender = None
+
+def is_dispatcher_mode():
+    return DISPATCH_MODE == 'dispatcher' or is_leader_election_enabled()
+
+def as_aware(dt, TAIPEI_TZ):
+    """SQLite 取回的是 naive datetime，補上台北時區"""
+    if dt is None or dt.tzinfo is not None:
+        return dt
+    return TAIPEI_TZ.localize(dt)
+
+def is_claim_current(event, fire_time, TAIPEI_TZ):
+    """
+    認領後到真正發送前，提醒可能已被延後、改時間或改規則：
+    一次性提醒的 next_run_time 必須仍是認領時的觸發時間；週期提醒的觸發時間必須仍符合目前的規則。
+    """
+    if not event.is_recurring:
+        return as_aware(event.next_run_time, TAIPEI_TZ) == fire_time
+    return rule_of(event).next_after(fire_time - timedelta(seconds=1), TAIPEI_TZ) == fire_time
+
+def _group_for_fanout(claimed):
+    """
+    同一時間觸發、對象為個人的週期提醒組成一組一起送出
+    (訊息內容相同的會合併成 multicast，見 features/outbox.plan)；其餘逐筆送出。
+    """
+    groups = {}
+    for item in claimed:
+        if item.is_recurring and item.target_type == 'user':
+            groups.setdefault(item.fire_time, []).append(item.id)
+        else:
+            yield item.id, item.fire_time
+    for fire_time, event_ids in groups.items():
+        for start in range(0, len(event_ids), MULTICAST_MAX_RECIPIENTS):
+            yield tuple(event_ids[start:start + MULTICAST_MAX_RECIPIENTS]), fire_time
+
+def dispatch_due_reminders(sender, TAIPEI_TZ, compute_recurring_next):
+    """
+    撈出 next_run_time 落在「現在 + lookahead」之內的提醒，交給發送佇列，
+    由佇列在觸發時間依速率限制與併發上限送出 (不再經過 APScheduler 的 misfire 判斷)。
+    週期提醒在認領時順便推進到下一次的觸發時間；一次性提醒只取得租約，寫入 outbox 後才算完成。
+    佇列已滿時停止認領，剩下的提醒留在資料庫等下一輪。
+    """
+    now = datetime.now(TAIPEI_TZ)
+    horizon = now + timedelta(seconds=DISPATCH_LOOKAHEAD_SECONDS)
+    lease_until = horizon + timedelta(seconds=DISPATCH_LEASE_SECONDS)
+
+    def _advance(event):
+        if not event.is_recurring:
+            return None
+        after = max(now, as_aware(event.next_run_time, TAIPEI_TZ))
+        return compute_recurring_next(event.recurrence_spec or event.recurrence_rule, after)
+
+    total = 0
+    while True:
+        limit = min(DISPATCH_BATCH_SIZE, sender.capacity())
+        if limit <= 0:
+            logger.warning("📬 發送佇列已滿，其餘到期提醒延到下一輪認領。")
+            break
+        claimed = claim_due_events(now, horizon, lease_until, limit=limit, advance=_advance)
+        for event_ids, fire_time in _group_for_fanout(claimed):
+            sender.submit(event_ids, as_aware(fire_time, TAIPEI_TZ))
+        total += len(claimed)
+        if len(claimed) < limit:
+            break
+
+    if total:
+        logger.info(f"📬 派送器認領 {total} 筆即將到期的提醒。")
+    return total
+
+def stop_dispatcher():
+    """失去 leader 身分時丟棄發送佇列中尚未送出的提醒，回傳丟棄的筆數"""
+    return _sender.clear() if _sender else 0
+
+def dispatcher_stats():
+    return _sender.stats() if _sender else None
+
+def start_dispatcher(scheduler, send_reminder_func, TAIPEI_TZ, compute_recurring_next, send_reminders_func=None):
+    """註冊派送器的輪詢 job (發送佇列在第一次啟動時建立，之後重複使用)"""
+    global _sender
+    if _sender is None:
+        _sender = ReminderSender(send_reminder_func, TAIPEI_TZ, send_batch_func=send_reminders_func)
+    scheduler.add_job(
+        dispatch_due_reminders,
+        'interval',
+        seconds=DISPATCH_INTERVAL_SECONDS,
+        args=[_sender, TAIPEI_TZ, compute_recurring_next],
+        id=DISPATCH_JOB_ID,
+        jobstore=DISPATCH_JOBSTORE,
+        next_run_time=datetime.now(TAIPEI_TZ),
+        replace_existing=True
+    )
+    logger.info(f"📬 派送器已啟動 (每 {DISPATCH_INTERVAL_SECONDS} 秒輪詢一次)。")
@@ -0,0 +1,189 @@
+# features/event_jobstore.py (直接由 events 資料表推導 job 的 APScheduler job store)
+#
+# 原本每個提醒都存兩份：events 一份，apscheduler_jobs 再存一份 pickle 過的 job，
+# 而且 SQLAlchemyJobStore 會另外開一個連線池。這個 job store 不存任何東西，
+# job 全部由資料庫現有的欄位推導 (共用 db.engine)：
+#   reminder_{id}        : events.next_run_time 不為 NULL 的逐筆提醒 (一次性、每 N 天 / 每月的週期提醒)
+#   recurring_slot_XXX   : recurring_slots 中有提醒的每週時段 (cron)
+# 新增 / 修改 reminder_{id} job 等同寫入 next_run_time，移除則是清掉 next_run_time。
+
+import os
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from apscheduler.job import Job
+from apscheduler.jobstores.base import BaseJobStore, JobLookupError
+from apscheduler.triggers.date import DateTrigger
+
+from db import get_reminder_jobs, get_next_reminder_job_time, set_next_run_time, clear_next_run_time, get_active_slots
+from features.dispatcher import as_aware
+from features.recurring_slots import (
+    SLOT_JOB_PREFIX, SLOT_MISFIRE_GRACE_SECONDS, slot_job_id, slot_from_job_id, slot_trigger
+)
+
+logger = logging.getLogger(__name__)
+
+# 其他行程 (例如另一個 web worker) 寫入的 next_run_time 不會喚醒排程器，至少每隔這麼久重新查一次
+EVENT_JOBSTORE_POLL_SECONDS = int(os.environ.get('EVENT_JOBSTORE_POLL_SECONDS', 10))
+# 每次最多取出的到期提醒數
+EVENT_JOBSTORE_BATCH_SIZE = int(os.environ.get('EVENT_JOBSTORE_BATCH_SIZE', 500))
+
+REMINDER_JOB_PREFIX = 'reminder_'
+
+class EventJobStore(BaseJobStore):
+    """
+    以 events / recurring_slots 為準的唯讀式 job store。
+    所有 job 都呼叫 bind() 指定的函式：reminder_{id} -> send_reminder(id)，
+    recurring_slot_XXX -> send_slot(slot)。
+    """
+
+    def __init__(self, TAIPEI_TZ, job_defaults=None, poll_seconds=EVENT_JOBSTORE_POLL_SECONDS):
+        super().__init__()
+        self.tz = TAIPEI_TZ
+        self.job_defaults = dict(job_defaults or {})
+        self.poll_seconds = poll_seconds
+        self.send_reminder_func = None
+        self.send_slot_func = None
+        self.lock = threading.Lock()
+        # 交給排程器執行的提醒 {event_id: 當時的 next_run_time}，移除 job 時用來比對是否已被改寫
+        self.fired = {}
+        # 每週時段的下一次觸發時間 {slot: datetime}
+        self.slot_times = {}
+
+    def bind(self, send_reminder_func, send_slot_func):
+        """指定 job 要呼叫的函式 (app 中這兩個函式在建立排程器之後才定義)"""
+        self.send_reminder_func = send_reminder_func
+        self.send_slot_func = send_slot_func
+
+    def _make_job(self, job_id, func, trigger, args, next_run_time, misfire_grace_time):
+        job = Job(
+            self._scheduler,
+            id=job_id,
+            func=func,
+            trigger=trigger,
+            executor='default',
+            args=args,
+            kwargs={},
+            name=func.__name__,
+            misfire_grace_time=misfire_grace_time,
+            coalesce=self.job_defaults.get('coalesce', True),
+            max_instances=self.job_defaults.get('max_instances', 1),
+            next_run_time=next_run_time,
+        )
+        job._jobstore_alias = self._alias
+        return job
+
+    def _reminder_job(self, row):
+        run_time = as_aware(row.next_run_time, self.tz)
+        return self._make_job(
+            f"{REMINDER_JOB_PREFIX}{row.id}", self.send_reminder_func, DateTrigger(run_time, self.tz),
+            [row.id], run_time, self.job_defaults.get('misfire_grace_time', 30)
+        )
+
+    def _slot_job(self, slot, next_run_time):
+        return self._make_job(
+            slot_job_id(slot), self.send_slot_func, slot_trigger(slot, self.tz),
+            [slot], next_run_time, SLOT_MISFIRE_GRACE_SECONDS
+        )
+
+    def _refresh_slots(self, now):
+        """同步有提醒的時段 (新時段從現在起算下一次觸發，已沒有提醒的時段移除)"""
+        active = set(get_active_slots())
+        with self.lock:
+            for slot in self.slot_times.keys() - active:
+                del self.slot_times[slot]
+            for slot in active - self.slot_times.keys():
+                self.slot_times[slot] = slot_trigger(slot, self.tz).get_next_fire_time(None, now)
+            return dict(self.slot_times)
+
+    def _is_bound(self):
+        return self.send_reminder_func is not None and self.send_slot_func is not None
+
+    # --- BaseJobStore ---
+
+    def lookup_job(self, job_id):
+        if not self._is_bound():
+            return None
+        if job_id.startswith(SLOT_JOB_PREFIX):
+            slot = slot_from_job_id(job_id)
+            with self.lock:
+                next_run_time = self.slot_times.get(slot)
+            return self._slot_job(slot, next_run_time) if next_run_time else None
+        if job_id.startswith(REMINDER_JOB_PREFIX):
+            rows = get_reminder_jobs(event_id=int(job_id[len(REMINDER_JOB_PREFIX):]))
+            return self._reminder_job(rows[0]) if rows else None
+        return None
+
+    def get_due_jobs(self, now):
+        if not self._is_bound():
+            return []
+        rows = get_reminder_jobs(until=now, limit=EVENT_JOBSTORE_BATCH_SIZE)
+        with self.lock:
+            for row in rows:
+                self.fired[row.id] = row.next_run_time
+        jobs = [self._reminder_job(row) for row in rows]
+        jobs += [self._slot_job(slot, run_time) for slot, run_time in self._refresh_slots(now).items() if run_time <= now]
+        return sorted(jobs, key=lambda job: job.next_run_time)
+
+    def get_next_run_time(self):
+        if not self._is_bound():
+            return None
+        now = datetime.now(self.tz)
+        candidates = [now + timedelta(seconds=self.poll_seconds)]
+        next_reminder = get_next_reminder_job_time()
+        if next_reminder is not None:
+            candidates.append(as_aware(next_reminder, self.tz))
+        with self.lock:
+            candidates.extend(self.slot_times.values())
+        return min(candidates)
+
+    def get_all_jobs(self):
+        """
+        尚未到期的 job (已到期的由 get_due_jobs 交給排程器執行)。
+        與 job_reconciler 推導出的「應該存在的 job」是同一份資料，對帳時不會互相刪除。
+        """
+        if not self._is_bound():
+            return []
+        now = datetime.now(self.tz)
+        jobs = [self._reminder_job(row) for row in get_reminder_jobs(after=now)]
+        jobs += [self._slot_job(slot, run_time) for slot, run_time in self._refresh_slots(now).items()]
+        return sorted(jobs, key=lambda job: job.next_run_time)
+
+    def add_job(self, job):
+        if job.id.startswith(SLOT_JOB_PREFIX):
+            with self.lock:
+                self.slot_times[slot_from_job_id(job.id)] = job.next_run_time
+        elif job.id.startswith(REMINDER_JOB_PREFIX):
+            if not set_next_run_time(int(job.id[len(REMINDER_JOB_PREFIX):]), job.next_run_time):
+                raise JobLookupError(job.id)
+        else:
+            raise ValueError(f"EventJobStore 只能存放 reminder_ / recurring_slot_ job: {job.id}")
+
+    def update_job(self, job):
+        self.add_job(job)
+
+    def remove_job(self, job_id):
+        if job_id.startswith(SLOT_JOB_PREFIX):
+            with self.lock:
+                if self.slot_times.pop(slot_from_job_id(job_id), None) is None:
+                    raise JobLookupError(job_id)
+            return
+        if not job_id.startswith(REMINDER_JOB_PREFIX):
+            raise JobLookupError(job_id)
+        event_id = int(job_id[len(REMINDER_JOB_PREFIX):])
+        with self.lock:
+            fired_at = self.fired.pop(event_id, None)
+        # 排程器在提醒交給執行緒之後就會移除 date job；發送端若已寫入下一次的時間 (重要提醒重試、週期提醒)，保留不動
+        if not clear_next_run_time(event_id, only_if=fired_at) and fired_at is None:
+            raise JobLookupError(job_id)
+
+    def remove_all_jobs(self):
+        """只清除記憶體中的時段狀態；提醒本身以 events 為準，要取消請修改資料庫"""
+        with self.lock:
+            self.slot_times.clear()
+            self.fired.clear()
+        logger.warning("EventJobStore.remove_all_jobs 不會刪除 events 中的提醒。")
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__}>"
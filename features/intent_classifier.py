@@ -0,0 +1,111 @@
+# features/intent_classifier.py (判斷訊息是不是「設定提醒」的本地分類器，決定要不要問 Gemini)
+#
+# 原本只要訊息含有數字或「點、分、後」之類的字就送去 Gemini，「我買了3個蘋果」與群組閒聊都會花一次 API 呼叫。
+# 這裡以字元 n-gram 權重加上幾個正規表達式特徵計算分數 (logistic)，並把本地時間解析 (time_parser) 的結果當成特徵：
+#   分數 >= 門檻 (REMINDER_INTENT_THRESHOLD，群組另有較嚴格的門檻) 才視為提醒意圖。
+# 權重是人工調整的，修改後請執行 python benchmarks/bench_intent_classifier.py 確認標註樣本沒有退步。
+
+import os
+import re
+import math
+import threading
+from collections import namedtuple
+
+REMINDER_INTENT_THRESHOLD = float(os.environ.get('REMINDER_INTENT_THRESHOLD', 0.5))
+# 群組裡閒聊多，預設要更有把握才問 AI
+REMINDER_INTENT_GROUP_THRESHOLD = float(os.environ.get('REMINDER_INTENT_GROUP_THRESHOLD', 0.65))
+
+Intent = namedtuple('Intent', ['is_reminder', 'score', 'features'])
+
+BIAS = -1.5
+
+# 字元 n-gram 權重 (1~3 字；訊息中出現一次以上就計分一次)
+NGRAM_WEIGHTS = {
+    # 明確要求提醒
+    '提醒': 2.5, '記得': 1.5, '叫我': 1.5, '別忘': 1.5, '不要忘': 1.5, '幫我': 0.6, '通知我': 1.5,
+    # 常見的待辦事項
+    '開會': 0.8, '會議': 0.5, '面試': 0.8, '看牙': 0.8, '回診': 0.8, '吃藥': 0.8, '繳費': 0.8, '繳': 0.4,
+    '交報告': 0.8, '截止': 0.8, '預約': 0.8, '訂位': 0.6, '搶票': 0.8, '上課': 0.6, '聚餐': 0.6, '出門': 0.4,
+    '要去': 0.4, '去接': 0.6, '起床': 0.6, '倒垃圾': 0.6,
+    # 過去式 / 敘述
+    '昨天': -2.0, '剛剛': -1.5, '剛才': -1.5, '已經': -1.0, '上週': -1.5, '上禮拜': -1.5, '去年': -1.5, '了': -0.8,
+    # 問句 / 閒聊
+    '嗎': -1.0, '什麼': -1.0, '為什麼': -1.0, '要不要': -1.2, '幾點了': -2.0, '哈哈': -2.0, '笑死': -2.0,
+    'XD': -1.5, '好喔': -0.8, '謝謝': -1.0, '多少錢': -1.5,
+}
+_NGRAM_SIZES = sorted({len(key) for key in NGRAM_WEIGHTS}, reverse=True)
+
+_NUM = r'[0-9零〇一二兩两三四五六七八九十]'
+# (名稱, pattern, 權重)
+REGEX_FEATURES = [
+    ('relative_time', re.compile(rf'{_NUM}+\s*個?半?\s*(?:分鐘|小時|鐘頭|天|週)\s*(?:之後|以後|後)|半小時後'), 2.0),
+    ('clock_time', re.compile(rf'{_NUM}+\s*[點点時](?:半|{_NUM}+分?)?|\d{{1,2}}:\d{{2}}'), 1.2),
+    ('day_word', re.compile(r'明天|後天|明早|明晚|今晚|[這下本]?(?:週|周|星期|禮拜)[一二三四五六日天]|\d{1,2}/\d{1,2}|月\s*\S{1,3}\s*[日號]|\d{1,2}\s*號(?!房)'), 1.0),
+    # 「今天」在閒聊中很常見，單獨出現時只是弱特徵
+    ('today', re.compile(r'今天|今日'), 0.3),
+    ('period', re.compile(r'早上|上午|中午|下午(?!茶)|傍晚|晚上'), 0.4),
+    # 數量、金額、門牌等與時間無關的數字
+    ('quantity', re.compile(rf'{_NUM}+\s*(?:個|元|塊|張|次|歲|樓|號房|杯|份|人|件|本|公斤|公里|%|％)'), -1.8),
+    ('long_number', re.compile(r'\d{5,}'), -1.5),
+    ('question', re.compile(r'[?？]$|幾點$'), -1.2),
+    ('url', re.compile(r'https?://'), -3.0),
+]
+# 本地時間解析 (time_parser) 有結果時的權重：依信心超過 0.5 的部分加權 (只解析出日期的 0.6 幾乎不加分)
+PARSED_TIME_WEIGHT = 2.5
+# 太長的訊息多半是轉貼或聊天
+LONG_MESSAGE_CHARS = 60
+LONG_MESSAGE_WEIGHT = -1.0
+
+_lock = threading.Lock()
+_stats = {"classified": 0, "rejected": 0, "local_parsed": 0, "ai_calls": 0}
+
+def _ngram_features(text):
+    found = {}
+    for size in _NGRAM_SIZES:
+        for start in range(len(text) - size + 1):
+            gram = text[start:start + size]
+            if gram in NGRAM_WEIGHTS:
+                found[gram] = NGRAM_WEIGHTS[gram]
+    return found
+
+def score_text(text, parsed=None):
+    """
+    回傳 (分數 0~1, 命中的特徵 {名稱: 權重})。
+    parsed 為 time_parser.parse_time_expression 的結果 (可省略)。
+    """
+    features = _ngram_features(text)
+    for name, pattern, weight in REGEX_FEATURES:
+        if pattern.search(text):
+            features[name] = weight
+    if parsed is not None:
+        features['parsed_time'] = PARSED_TIME_WEIGHT * max(0.0, parsed['confidence'] - 0.5) * 2
+    if len(text) > LONG_MESSAGE_CHARS:
+        features['long_message'] = LONG_MESSAGE_WEIGHT
+    logit = BIAS + sum(features.values())
+    return 1 / (1 + math.exp(-logit)), features
+
+def classify_intent(text, source_type='user', parsed=None, threshold=None):
+    """判斷訊息是否為提醒意圖；群組 / 聊天室使用 REMINDER_INTENT_GROUP_THRESHOLD"""
+    if threshold is None:
+        threshold = REMINDER_INTENT_THRESHOLD if source_type == 'user' else REMINDER_INTENT_GROUP_THRESHOLD
+    score, features = score_text(text.strip(), parsed)
+    intent = Intent(score >= threshold, round(score, 3), features)
+    with _lock:
+        _stats["classified"] += 1
+        if not intent.is_reminder:
+            _stats["rejected"] += 1
+    return intent
+
+def record_parse(used_ai):
+    """記錄提醒意圖的訊息最後由本地解析 (used_ai=False) 還是 Gemini 處理"""
+    with _lock:
+        _stats["ai_calls" if used_ai else "local_parsed"] += 1
+
+def intent_stats():
+    with _lock:
+        return {
+            **_stats,
+            "ai_calls_avoided": _stats["rejected"] + _stats["local_parsed"],
+            "threshold": REMINDER_INTENT_THRESHOLD,
+            "group_threshold": REMINDER_INTENT_GROUP_THRESHOLD,
+        }
@@ -0,0 +1,98 @@
+# features/job_reconciler.py (以集合差異比對資料庫與排程器，一次修正所有逐筆 job)
+
+import logging
+from datetime import datetime
+
+from db import iter_schedulable_events, get_active_slots
+from features.dispatcher import as_aware
+from features.recurring_slots import slot_job_id, slot_trigger, SLOT_MISFIRE_GRACE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# recurring_ 也涵蓋舊版逐筆註冊的 recurring_{event_id}，改用時段排程後會被當作孤兒移除
+JOB_PREFIXES = ('reminder_', 'recurring_')
+
+def _expected_jobs(TAIPEI_TZ, now):
+    """
+    從資料庫算出「應該存在」的 job：{job_id: (args, trigger 種類, 觸發設定)}，
+    以及無法解析的 job_id 集合。
+      一次性提醒：每筆一個 date job，以 next_run_time 為準 (舊資料沒有時才退回 reminder_time)
+      週期提醒  ：每個有提醒的時段一個 cron job
+    """
+    expected = {}
+    invalid = set()
+    for event in iter_schedulable_events(now):
+        job_id = f"reminder_{event.id}"
+        try:
+            expected[job_id] = ([event.id], 'date', as_aware(event.next_run_time or event.reminder_time, TAIPEI_TZ))
+        except Exception as e:
+            invalid.add(job_id)
+            logger.error(f"  ! 無法解析 ID {event.id} 的排程時間: {e}")
+    for slot in get_active_slots():
+        expected[slot_job_id(slot)] = ([slot], 'cron', slot_trigger(slot, TAIPEI_TZ))
+    return expected, invalid
+
+def _is_drifted(job, kind, spec):
+    if job.next_run_time is None:
+        # 被暫停的 job 視同需要重新註冊
+        return True
+    if kind == 'cron':
+        return str(job.trigger) != str(spec)
+    return job.next_run_time != spec
+
+def reconcile_jobs(scheduler, send_reminder_func, TAIPEI_TZ, send_slot_func, jobstore='default'):
+    """
+    比對資料庫中的提醒與排程器中的 reminder_* / recurring_slot_* job：
+      missing : 資料庫有、排程器沒有 -> 新增
+      orphaned: 排程器有、資料庫已刪除 (或已發送/過期、時段已無提醒) -> 移除
+      drifted : 兩邊都有但觸發時間不同 -> 以資料庫為準重新註冊
+    排程器的 job 只讀取一次 (get_jobs)，不再逐筆 get_job。
+    回傳各類別的數量。
+    """
+    now = datetime.now(TAIPEI_TZ)
+    expected, invalid = _expected_jobs(TAIPEI_TZ, now)
+    existing = {job.id: job for job in scheduler.get_jobs(jobstore=jobstore) if job.id.startswith(JOB_PREFIXES)}
+
+    missing = expected.keys() - existing.keys()
+    # 時間無法解析的事件保留原本的 job，不當作孤兒移除
+    orphaned = existing.keys() - expected.keys() - invalid
+    drifted = {job_id for job_id in expected.keys() & existing.keys() if _is_drifted(existing[job_id], *expected[job_id][1:])}
+
+    failed = 0
+    for job_id in orphaned:
+        try:
+            scheduler.remove_job(job_id, jobstore=jobstore)
+        except Exception as e:
+            failed += 1
+            logger.error(f"  ! 移除孤兒排程 {job_id} 失敗: {e}")
+
+    for job_id in missing | drifted:
+        args, kind, spec = expected[job_id]
+        if kind == 'cron':
+            func, trigger, options = send_slot_func, spec, {'misfire_grace_time': SLOT_MISFIRE_GRACE_SECONDS}
+        else:
+            func, trigger, options = send_reminder_func, 'date', {'run_date': spec}
+        try:
+            scheduler.add_job(
+                func,
+                trigger=trigger,
+                args=args,
+                id=job_id,
+                jobstore=jobstore,
+                replace_existing=True,
+                **options
+            )
+        except Exception as e:
+            failed += 1
+            logger.error(f"  ! 註冊排程 {job_id} 失敗: {e}")
+
+    counts = {
+        "expected": len(expected),
+        "missing": len(missing),
+        "orphaned": len(orphaned),
+        "drifted": len(drifted),
+        "invalid": len(invalid),
+        "failed": failed,
+    }
+    logger.info(f"✅ 排程對帳完成: {counts}")
+    return counts
@@ -0,0 +1,104 @@
+# features/keyed_executor.py (依 key 保序的平行執行器：同一個 key 依序執行，不同 key 平行)
+#
+# webhook 事件以使用者為 key：同一位使用者的事件嚴格依收到的順序處理
+# (對話狀態的多步驟流程依賴順序)，不同使用者 / 群組之間則平行處理。
+
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+class KeyedExecutor:
+    """
+    每個 key 一條佇列，同一時間最多一條執行緒在處理某個 key。
+    每執行完一個工作就把該 key 排回執行緒池的尾端，工作很多的 key 不會霸佔執行緒。
+    佇列總長度有上限 (max_pending)，滿了之後 submit 會阻塞 (或在 block=False 時回傳 None)。
+    """
+
+    def __init__(self, workers, max_pending=1000, name="keyed"):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self.cond = threading.Condition()
+        self.queues = {}        # key -> deque[(func, args, future, enqueued_at)]
+        self.scheduled = set()  # 已排入執行緒池 (或正在執行) 的 key
+        self.pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.blocked = 0        # submit 因佇列已滿而等待的次數
+        self.rejected = 0
+        self.max_key_depth = 0
+        self.waits = deque(maxlen=1000)
+
+    def capacity(self):
+        """佇列還能接受的工作數"""
+        with self.cond:
+            return max(0, self.max_pending - self.pending)
+
+    def submit(self, key, func, *args, block=True, timeout=None):
+        """排入一個工作並回傳 Future；佇列已滿且 block=False (或等待逾時) 時回傳 None"""
+        with self.cond:
+            if self.pending >= self.max_pending:
+                if not block:
+                    self.rejected += 1
+                    return None
+                self.blocked += 1
+                if not self.cond.wait_for(lambda: self.pending < self.max_pending, timeout):
+                    self.rejected += 1
+                    return None
+            future = Future()
+            queue = self.queues.setdefault(key, deque())
+            queue.append((func, args, future, time.monotonic()))
+            self.pending += 1
+            self.max_key_depth = max(self.max_key_depth, len(queue))
+            if key not in self.scheduled:
+                self.scheduled.add(key)
+                self.pool.submit(self._run_next, key)
+            return future
+
+    def _run_next(self, key):
+        with self.cond:
+            func, args, future, enqueued_at = self.queues[key].popleft()
+        self.waits.append((time.monotonic() - enqueued_at) * 1000)
+        ok = False
+        try:
+            future.set_result(func(*args))
+            ok = True
+        except Exception as e:
+            logger.error(f"KeyedExecutor 工作失敗 (key={key}): {e}", exc_info=True)
+            future.set_exception(e)
+        finally:
+            with self.cond:
+                self.pending -= 1
+                if ok:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                if self.queues[key]:
+                    self.pool.submit(self._run_next, key)
+                else:
+                    del self.queues[key]
+                    self.scheduled.discard(key)
+                self.cond.notify_all()
+
+    def stats(self):
+        waits = sorted(self.waits)
+        with self.cond:
+            return {
+                "pending": self.pending,
+                "max_pending": self.max_pending,
+                "active_keys": len(self.scheduled),
+                "max_key_depth": self.max_key_depth,
+                "completed": self.completed,
+                "failed": self.failed,
+                "blocked": self.blocked,
+                "rejected": self.rejected,
+                "wait_ms_avg": round(sum(waits) / len(waits), 1) if waits else 0.0,
+                "wait_ms_p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 1) if waits else 0.0,
+            }
+
+    def shutdown(self, wait=True):
+        self.pool.shutdown(wait=wait)
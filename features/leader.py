@@ -0,0 +1,144 @@
+# features/leader.py (多個 gunicorn worker 之間選出唯一執行排程器的 leader)
+
+import os
+import time
+import logging
+import threading
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+
+from db import DATABASE_URL
+
+logger = logging.getLogger(__name__)
+
+# 開啟後只有搶到鎖的 worker 會啟動排程器，其他 worker 只處理 /callback；
+# 排程一律透過 events.next_run_time 交給 leader 的派送器 (見 features/dispatcher.py)
+LEADER_ELECTION = os.environ.get('SCHEDULER_LEADER_ELECTION', 'off').strip().lower() in ('1', 'on', 'true', 'yes')
+LEADER_POLL_SECONDS = int(os.environ.get('LEADER_POLL_SECONDS', 5))
+
+# Postgres advisory lock 的鍵值 (任意固定整數，所有 worker 必須相同)
+LEADER_LOCK_KEY = int(os.environ.get('LEADER_LOCK_KEY', 0x6C72656D))
+
+def is_leader_election_enabled():
+    return LEADER_ELECTION
+
+def _lock_database_url():
+    """
+    advisory lock 綁定在 session 上，經過 transaction pooler (例如 Neon 的 -pooler 端點)
+    會被別的連線共用，必須改連直連端點。可用 LEADER_LOCK_DATABASE_URL 明確指定。
+    """
+    url = os.environ.get('LEADER_LOCK_DATABASE_URL')
+    if url:
+        return url.replace("postgres://", "postgresql://", 1)
+    return DATABASE_URL.replace("-pooler.", ".", 1)
+
+def _lock_file_path():
+    path = os.environ.get('LEADER_LOCK_FILE')
+    if path:
+        return path
+    db_path = DATABASE_URL.split("sqlite:///", 1)[-1] or "reminders.db"
+    return f"{db_path}.leader.lock"
+
+class _AdvisoryLock:
+    """Postgres：以專用連線持有 pg_try_advisory_lock，連線斷掉時鎖會自動釋放"""
+
+    def __init__(self):
+        self.engine = create_engine(_lock_database_url(), poolclass=NullPool)
+        self.conn = None
+
+    def acquire(self):
+        conn = self.engine.connect()
+        try:
+            if conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": LEADER_LOCK_KEY}).scalar():
+                conn.commit()
+                self.conn = conn
+                return True
+        except Exception:
+            conn.close()
+            raise
+        conn.close()
+        return False
+
+    def is_held(self):
+        try:
+            self.conn.execute(text("SELECT 1"))
+            self.conn.commit()
+            return True
+        except Exception:
+            self.release()
+            return False
+
+    def release(self):
+        if self.conn is not None:
+            try:
+                self.conn.close()
+            except Exception:
+                pass
+            self.conn = None
+
+class _FileLock:
+    """SQLite / 本機：對鎖檔取得排他鎖，行程結束時作業系統會自動釋放"""
+
+    def __init__(self):
+        self.path = _lock_file_path()
+        self.handle = None
+
+    def acquire(self):
+        handle = open(self.path, 'a+')
+        try:
+            if os.name == 'nt':
+                import msvcrt
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        self.handle = handle
+        return True
+
+    def is_held(self):
+        return self.handle is not None
+
+    def release(self):
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+
+def _make_lock():
+    return _FileLock() if "sqlite" in DATABASE_URL else _AdvisoryLock()
+
+_state = {"is_leader": False}
+
+def is_leader():
+    return _state["is_leader"]
+
+def start_leader_election(on_elected, on_lost):
+    """
+    在背景執行緒中不斷嘗試取得 leader 鎖：
+      取得鎖 -> 呼叫 on_elected() (啟動排程器)
+      失去鎖 -> 呼叫 on_lost() (停止排程器)，之後繼續嘗試
+    leader 行程死掉時鎖會被釋放，其他 worker 在下一次輪詢時接手。
+    """
+    lock = _make_lock()
+
+    def _loop():
+        while True:
+            try:
+                if _state["is_leader"]:
+                    if not lock.is_held():
+                        _state["is_leader"] = False
+                        logger.warning("👑 失去 leader 鎖，停止排程器。")
+                        on_lost()
+                elif lock.acquire():
+                    _state["is_leader"] = True
+                    logger.info(f"👑 PID {os.getpid()} 成為 leader，啟動排程器。")
+                    on_elected()
+            except Exception as e:
+                logger.error(f"Leader election error: {e}")
+            time.sleep(LEADER_POLL_SECONDS)
+
+    threading.Thread(target=_loop, name="leader-election", daemon=True).start()
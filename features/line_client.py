@@ -0,0 +1,201 @@
+# features/line_client.py (連線池化、有時限的 LINE 對外呼叫層)
+#
+# 以 SDK v3 的 AsyncMessagingApi 為底層，在一條專用的 asyncio 執行緒上共用
+# aiohttp 連線池；對外提供與 v1 LineBotApi 相同的同步方法，
+# 既有的 handler 與 send_reminder 不需要改寫。
+
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+import concurrent.futures
+from collections import defaultdict, deque
+
+import aiohttp
+from linebot.exceptions import LineBotApiError
+from linebot.models import Profile
+from linebot.models.error import Error
+from linebot.v3.messaging import (
+    AsyncApiClient,
+    AsyncMessagingApi,
+    Configuration,
+    Message,
+    MulticastRequest,
+    PushMessageRequest,
+    ReplyMessageRequest,
+)
+from linebot.v3.messaging.exceptions import ApiException
+
+from db import after_commit
+
+logger = logging.getLogger(__name__)
+
+LINE_HTTP_POOL_SIZE = int(os.environ.get('LINE_HTTP_POOL_SIZE', 20))
+# 各類呼叫的時限 (秒)：reply token 本身很快就會失效，profile 只是顯示名稱，逾時就放棄
+LINE_REPLY_TIMEOUT = float(os.environ.get('LINE_REPLY_TIMEOUT', 5))
+LINE_PUSH_TIMEOUT = float(os.environ.get('LINE_PUSH_TIMEOUT', 10))
+LINE_PROFILE_TIMEOUT = float(os.environ.get('LINE_PROFILE_TIMEOUT', 3))
+
+def _to_v3_messages(messages):
+    """v1 的 SendMessage 或 JSON dict (單一或 list) 轉成 v3 的 Message"""
+    if not isinstance(messages, (list, tuple)):
+        messages = [messages]
+    return [Message.from_dict(message if isinstance(message, dict) else message.as_json_dict()) for message in messages]
+
+def _to_v1_profile(profile):
+    return Profile(
+        display_name=profile.display_name,
+        user_id=profile.user_id,
+        picture_url=getattr(profile, 'picture_url', None),
+        status_message=getattr(profile, 'status_message', None),
+        language=getattr(profile, 'language', None),
+    )
+
+def _to_line_bot_api_error(e):
+    """v3 的 ApiException 轉成 v1 的 LineBotApiError，讓既有的 except 區塊照常運作"""
+    headers = dict(e.headers or {})
+    try:
+        error = Error.new_from_json_dict(json.loads(e.body)) if e.body else Error(message=e.reason)
+    except ValueError:
+        error = Error(message=str(e.body))
+    return LineBotApiError(
+        status_code=e.status,
+        headers=headers,
+        request_id=headers.get('x-line-request-id'),
+        accepted_request_id=headers.get('x-line-accepted-request-id'),
+        error=error,
+    )
+
+class LineClient:
+    """
+    同步外觀、非同步底層的 LINE Messaging API 用戶端。
+    每次呼叫都有時限，並記錄各方法的延遲、錯誤與逾時次數。
+    """
+
+    def __init__(self, access_token, pool_size=LINE_HTTP_POOL_SIZE):
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="line-client", daemon=True).start()
+
+        configuration = Configuration(access_token=access_token)
+        configuration.connection_pool_maxsize = pool_size
+
+        async def _build():
+            # aiohttp 的 session 必須在事件迴圈內建立
+            client = AsyncApiClient(configuration)
+            return client, AsyncMessagingApi(client)
+        self.client, self.api = asyncio.run_coroutine_threadsafe(_build(), self.loop).result()
+
+        self.metrics_lock = threading.Lock()
+        self.calls = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.timeouts = defaultdict(int)
+        self.latencies = defaultdict(lambda: deque(maxlen=500))
+
+    def _call(self, name, timeout, coro_factory):
+        start = time.perf_counter()
+        future = asyncio.run_coroutine_threadsafe(
+            coro_factory(aiohttp.ClientTimeout(total=timeout)), self.loop
+        )
+        outcome = self.calls
+        try:
+            return future.result(timeout=timeout + 1)
+        except (concurrent.futures.TimeoutError, asyncio.TimeoutError):
+            future.cancel()
+            outcome = self.timeouts
+            raise LineBotApiError(status_code=408, headers={}, error=Error(message=f"{name} 超過 {timeout} 秒未回應"))
+        except ApiException as e:
+            outcome = self.errors
+            raise _to_line_bot_api_error(e)
+        except Exception:
+            outcome = self.errors
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            with self.metrics_lock:
+                outcome[name] += 1
+                self.latencies[name].append(elapsed_ms)
+
+    # --- 與 v1 LineBotApi 相同的方法 ---
+
+    def reply_message(self, reply_token, messages, notification_disabled=False, timeout=None):
+        request = ReplyMessageRequest(
+            reply_token=reply_token,
+            messages=_to_v3_messages(messages),
+            notification_disabled=notification_disabled,
+        )
+        self._call('reply_message', timeout or LINE_REPLY_TIMEOUT,
+                   lambda t: self.api.reply_message(request, _request_timeout=t))
+
+    def push_message(self, to, messages, notification_disabled=False, timeout=None, retry_key=None):
+        """retry_key 會以 X-Line-Retry-Key 送出，同一個 key 重送時 LINE 不會重複發送"""
+        request = PushMessageRequest(
+            to=to,
+            messages=_to_v3_messages(messages),
+            notification_disabled=notification_disabled,
+        )
+        self._call('push_message', timeout or LINE_PUSH_TIMEOUT,
+                   lambda t: self.api.push_message(request, x_line_retry_key=retry_key, _request_timeout=t))
+
+    def multicast(self, to, messages, notification_disabled=False, timeout=None, retry_key=None):
+        """一次推播給最多 500 位使用者 (只能是 user ID)"""
+        request = MulticastRequest(
+            to=list(to),
+            messages=_to_v3_messages(messages),
+            notification_disabled=notification_disabled,
+        )
+        self._call('multicast', timeout or LINE_PUSH_TIMEOUT,
+                   lambda t: self.api.multicast(request, x_line_retry_key=retry_key, _request_timeout=t))
+
+    def get_profile(self, user_id, timeout=None):
+        profile = self._call('get_profile', timeout or LINE_PROFILE_TIMEOUT,
+                             lambda t: self.api.get_profile(user_id, _request_timeout=t))
+        return _to_v1_profile(profile)
+
+    def get_group_member_profile(self, group_id, user_id, timeout=None):
+        profile = self._call('get_group_member_profile', timeout or LINE_PROFILE_TIMEOUT,
+                             lambda t: self.api.get_group_member_profile(group_id, user_id, _request_timeout=t))
+        return _to_v1_profile(profile)
+
+    def get_room_member_profile(self, room_id, user_id, timeout=None):
+        profile = self._call('get_room_member_profile', timeout or LINE_PROFILE_TIMEOUT,
+                             lambda t: self.api.get_room_member_profile(room_id, user_id, _request_timeout=t))
+        return _to_v1_profile(profile)
+
+    def stats(self):
+        result = {}
+        with self.metrics_lock:
+            for name, samples in self.latencies.items():
+                latencies = sorted(samples)
+                result[name] = {
+                    "ok": self.calls[name],
+                    "errors": self.errors[name],
+                    "timeouts": self.timeouts[name],
+                    "ms_avg": round(sum(latencies) / len(latencies), 1),
+                    "ms_p95": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 1),
+                    "ms_max": round(latencies[-1], 1),
+                }
+        return result
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.client.close(), self.loop).result(timeout=5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+class AfterCommitReplies:
+    """
+    交給功能模組的 LINE 用戶端：reply_message / push_message 延到目前的 Unit of Work commit 之後才送出
+    (資料確定存檔才回覆「設定成功」，rollback 時不會送出)；查詢顯示名稱等其他呼叫直接轉給原本的用戶端。
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def reply_message(self, *args, **kwargs):
+        after_commit(self._client.reply_message, *args, **kwargs)
+
+    def push_message(self, *args, **kwargs):
+        after_commit(self._client.push_message, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
@@ -8,6 +8,7 @@ from db import (
     add_location, get_all_locations_by_user, get_location_by_name,
     delete_location_by_name
 )
+from features.state_store import AwaitingLocName, AwaitingLocation
 
 def handle_list_locations_command(event, line_bot_api):
     """處理'地點清單'指令，作為地點功能主選單"""
@@ -30,12 +31,11 @@ def handle_list_locations_command(event, line_bot_api):
     ])
     line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text, quick_reply=quick_reply))
 
-def handle_save_location_command(event, line_bot_api, user_states):
+def handle_save_location_command(event, line_bot_api, state_store):
     """處理使用者在'awaiting_loc_name'狀態下輸入的地點名稱"""
     user_id, location_name = event.source.user_id, event.message.text.strip()
     
-    if user_id in user_states: del user_states[user_id]
-    user_states[user_id] = {'action': 'awaiting_location', 'name': location_name}
+    state_store.set(user_id, AwaitingLocation(name=location_name))
     
     quick_reply = QuickReply(items=[QuickReplyButton(action=PostbackAction(label="取消新增", data="action=cancel"))])
     line_bot_api.reply_message(
@@ -73,26 +73,26 @@ def handle_delete_location_command(event, line_bot_api):
         reply_text = f"🤔 咦？找不到名為「{location_name}」的地點，可能已被刪除。"
     line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text))
 
-def handle_location_message(event, line_bot_api, user_states):
+def handle_location_message(event, line_bot_api, state_store):
     """處理使用者傳送的 LINE 位置訊息"""
     user_id = event.source.user_id
-    if user_id in user_states and user_states[user_id]['action'] == 'awaiting_location':
-        state = user_states[user_id]
-        location_name, loc_msg = state['name'], event.message
+    state = state_store.get(user_id)
+    if isinstance(state, AwaitingLocation):
+        location_name, loc_msg = state.name, event.message
         result = add_location(user_id=user_id, name=location_name, address=loc_msg.address,
                               latitude=loc_msg.latitude, longitude=loc_msg.longitude)
         reply_text = f"✅ 地點「{location_name}」已成功儲存！" if result == "成功" else f"❌ 儲存失敗：{result}"
         line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text))
-        del user_states[user_id]
+        state_store.pop(user_id)
 
-def handle_location_postback(event, line_bot_api, user_states):
+def handle_location_postback(event, line_bot_api, state_store):
     """處理地點功能相關的 Postback 事件"""
     data = dict(x.split('=', 1) for x in event.postback.data.split('&'))
     action = data.get('action')
     user_id = event.source.user_id
 
     if action == 'loc_add_prompt':
-        user_states[user_id] = {'action': 'awaiting_loc_name'}
+        state_store.set(user_id, AwaitingLocName())
         line_bot_api.reply_message(
             event.reply_token,
             TextSendMessage(text="📝 請直接輸入您想新增的地點名稱（例如：公司停車位）：")
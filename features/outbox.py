@@ -0,0 +1,233 @@
+# features/outbox.py (提醒推播的持久化 outbox：先寫入資料庫，再送出，失敗則退避重試；可依 target 合併推播)
+
+import os
+import json
+import uuid
+import random
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytz
+from linebot.exceptions import LineBotApiError
+
+from db import OutboxRow, enqueue_outbox, claim_outbox_batch, mark_outbox_sent, mark_outbox_failed
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_POLL_SECONDS = int(os.environ.get('OUTBOX_POLL_SECONDS', 15))
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 500))
+OUTBOX_CONCURRENCY = int(os.environ.get('OUTBOX_CONCURRENCY', 4))
+# 寫入後若行程在送出前中斷，超過租約時間就由 drain 工作接手
+OUTBOX_LEASE_SECONDS = int(os.environ.get('OUTBOX_LEASE_SECONDS', 60))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 8))
+OUTBOX_BACKOFF_BASE_SECONDS = float(os.environ.get('OUTBOX_BACKOFF_BASE_SECONDS', 5))
+OUTBOX_BACKOFF_MAX_SECONDS = float(os.environ.get('OUTBOX_BACKOFF_MAX_SECONDS', 1800))
+# 合併視窗 (秒)：大於 0 時，同一個 target 在視窗內到期的提醒會合併成一次推播送出
+REMINDER_COALESCE_SECONDS = int(os.environ.get('REMINDER_COALESCE_SECONDS', 0))
+# LINE 單次推播最多 5 則訊息，multicast 一次最多 500 位使用者
+MAX_MESSAGES_PER_PUSH = 5
+MULTICAST_MAX_RECIPIENTS = 500
+# 內容完全相同、對象為個人的推播合併成 multicast (只有 user ID 能用 multicast)
+OUTBOX_MULTICAST = os.environ.get('OUTBOX_MULTICAST', 'on').strip().lower() in ('1', 'on', 'true', 'yes')
+
+OUTBOX_JOB_ID = 'drain_outbox'
+
+def is_coalescing():
+    return REMINDER_COALESCE_SECONDS > 0
+
+def _now():
+    return datetime.now(pytz.UTC)
+
+def backoff_delay(attempts):
+    """指數退避加上抖動 (equal jitter)：第 n 次失敗後等待 base * 2^(n-1) 的 50%~100%"""
+    delay = min(OUTBOX_BACKOFF_MAX_SECONDS, OUTBOX_BACKOFF_BASE_SECONDS * (2 ** max(attempts - 1, 0)))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def _is_retryable(e):
+    # 408 (逾時)、429 (超過速率)、5xx 值得重試；其他 4xx 代表請求本身有問題，重送也不會成功
+    if isinstance(e, LineBotApiError):
+        return e.status_code in (408, 429) or e.status_code >= 500
+    return True  # 連線錯誤等
+
+def _is_rejected(e):
+    # 明確的 4xx 拒絕代表 LINE 沒有收下這次請求；逾時、連線錯誤、429 與 5xx 則可能已經送達
+    return isinstance(e, LineBotApiError) and 400 <= e.status_code < 500 and e.status_code not in (408, 409, 429)
+
+def enqueue_push(target_id, messages, event_id=None):
+    """
+    把推播寫入 outbox (與呼叫端的 Unit of Work 一起 commit)，回傳 OutboxRow。
+    未開啟合併時，呼叫端在 commit 之後應呼叫 deliver() 立刻送出一次；
+    開啟合併時則等視窗結束，由 drain 工作與同一 target 的其他提醒一起送出。
+    """
+    if not isinstance(messages, (list, tuple)):
+        messages = [messages]
+    payload = json.dumps([message.as_json_dict() for message in messages], ensure_ascii=False)
+    wait = REMINDER_COALESCE_SECONDS if is_coalescing() else OUTBOX_LEASE_SECONDS
+    return enqueue_outbox(target_id, payload, str(uuid.uuid4()), _now() + timedelta(seconds=wait), event_id=event_id)
+
+def _group_key(rows):
+    # 單筆沿用自己的 retry key；合併推播則由成員的 key 推導出固定的 key，重試時組合不變就不會重複發送
+    if len(rows) == 1:
+        return rows[0].retry_key
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, ",".join(sorted(row.retry_key for row in rows))))
+
+def deliver(line_bot_api, rows):
+    """
+    以一次推播送出同一個 target 的一或多筆 outbox 訊息 (總數不超過 5 則)，
+    並記錄結果，成功回傳 True。
+    """
+    if isinstance(rows, OutboxRow):
+        rows = [rows]
+    ids = [row.id for row in rows]
+    label = f"推播 {ids} (event {[row.event_id for row in rows]})"
+    messages = [message for row in rows for message in json.loads(row.payload)]
+    try:
+        line_bot_api.push_message(rows[0].target_id, messages, retry_key=_group_key(rows))
+    except Exception as e:
+        if isinstance(e, LineBotApiError) and e.status_code == 409:
+            # 同一個 retry key 先前已被 LINE 接受，視為已送出
+            mark_outbox_sent(ids, _now())
+            return True
+        attempts = max(row.attempts for row in rows) + 1
+        if _is_retryable(e) and attempts < OUTBOX_MAX_ATTEMPTS:
+            next_attempt_at = _now() + timedelta(seconds=backoff_delay(attempts))
+            logger.warning(f"📮 {label} 第 {attempts} 次失敗，{next_attempt_at:%H:%M:%S} 重試: {e}")
+        else:
+            next_attempt_at = None
+            logger.error(f"📮 {label} 放棄重試 ({attempts} 次): {e}")
+        mark_outbox_failed(ids, str(e), next_attempt_at)
+        return False
+    mark_outbox_sent(ids, _now())
+    return True
+
+def deliver_multicast(line_bot_api, rows):
+    """
+    以 multicast 送出內容相同、對象不同的多筆推播。
+    LINE 明確拒絕 (4xx) 時退回逐筆 push (各自沿用自己的 retry key 與重試次數)；
+    逾時、連線錯誤或 5xx 時 LINE 可能已經送出，改用逐筆 push 會重複，
+    因此記下這批成員與 retry key，下次 drain 以同一個 key 重送同一批 (已收下的會回 409)。
+    """
+    ids = [row.id for row in rows]
+    retry_key = rows[0].multicast_key or _group_key(rows)
+    try:
+        line_bot_api.multicast([row.target_id for row in rows], json.loads(rows[0].payload), retry_key=retry_key)
+    except Exception as e:
+        if isinstance(e, LineBotApiError) and e.status_code == 409:
+            mark_outbox_sent(ids, _now())
+            return len(rows)
+        if _is_rejected(e):
+            logger.warning(f"📮 multicast {len(rows)} 位被拒絕，改為逐筆推播: {e}")
+            return sum(deliver(line_bot_api, [row]) for row in rows)
+        attempts = max(row.attempts for row in rows) + 1
+        if attempts < OUTBOX_MAX_ATTEMPTS:
+            next_attempt_at = _now() + timedelta(seconds=backoff_delay(attempts))
+            logger.warning(f"📮 multicast {len(rows)} 位第 {attempts} 次失敗，{next_attempt_at:%H:%M:%S} 以同一個 key 重試: {e}")
+        else:
+            next_attempt_at = None
+            logger.error(f"📮 multicast {len(rows)} 位放棄重試 ({attempts} 次): {e}")
+        mark_outbox_failed(ids, str(e), next_attempt_at, multicast_key=retry_key)
+        return 0
+    mark_outbox_sent(ids, _now())
+    return len(rows)
+
+def plan(rows):
+    """
+    把一批 outbox 推播規劃成實際的 API 呼叫：
+      ('multicast', rows): 相同內容、不同使用者，每批最多 500 位；上次結果不明的 multicast 原樣重送
+      ('push', rows)     : 其餘的逐筆推播 (開啟合併時依 target 合併)
+    """
+    calls = []
+    pending = {}
+    for row in rows:
+        if row.multicast_key:
+            pending.setdefault(row.multicast_key, []).append(row)
+    calls.extend(('multicast', same) for same in pending.values())
+    rest = [row for row in rows if not row.multicast_key]
+    if OUTBOX_MULTICAST:
+        by_payload = {}
+        for row in rest:
+            if row.target_id.startswith('U'):
+                by_payload.setdefault(row.payload, []).append(row)
+        for same in by_payload.values():
+            recipients = {}
+            for row in same:
+                recipients.setdefault(row.target_id, row)  # 同一位使用者重複的那筆留給逐筆 push
+            unique = list(recipients.values())
+            if len(unique) < 2:
+                continue
+            for start in range(0, len(unique), MULTICAST_MAX_RECIPIENTS):
+                chunk = unique[start:start + MULTICAST_MAX_RECIPIENTS]
+                if len(chunk) > 1:
+                    calls.append(('multicast', chunk))
+                    chunk_ids = {row.id for row in chunk}
+                    rest = [row for row in rest if row.id not in chunk_ids]
+
+    groups = coalesce(rest) if is_coalescing() else [[row] for row in rest]
+    calls.extend(('push', group) for group in groups)
+    return calls
+
+def _deliver_call(line_bot_api, call):
+    kind, rows = call
+    if kind == 'multicast':
+        return deliver_multicast(line_bot_api, rows)
+    return len(rows) if deliver(line_bot_api, rows) else 0
+
+def deliver_all(line_bot_api, rows, pool=None):
+    """依 plan() 送出一批 outbox 推播，回傳 (成功筆數, API 呼叫次數)"""
+    calls = plan(rows)
+    if pool is None:
+        sent = sum(_deliver_call(line_bot_api, call) for call in calls)
+    else:
+        sent = sum(pool.map(lambda call: _deliver_call(line_bot_api, call), calls))
+    return sent, len(calls)
+
+def coalesce(rows):
+    """依 target 分組，每組依序切成訊息總數不超過 5 則的推播"""
+    by_target = {}
+    for row in rows:
+        by_target.setdefault(row.target_id, []).append(row)
+
+    pushes = []
+    for target_rows in by_target.values():
+        current, count = [], 0
+        for row in target_rows:
+            size = len(json.loads(row.payload))
+            if current and count + size > MAX_MESSAGES_PER_PUSH:
+                pushes.append(current)
+                current, count = [], 0
+            current.append(row)
+            count += size
+        pushes.append(current)
+    return pushes
+
+def drain_outbox(line_bot_api):
+    """送出所有到期的 outbox 推播 (合併視窗結束、重試中與租約過期的)，依 plan() 合併送出"""
+    total = sent = pushes = 0
+    with ThreadPoolExecutor(max_workers=OUTBOX_CONCURRENCY) as pool:
+        while True:
+            now = _now()
+            rows = claim_outbox_batch(now, now + timedelta(seconds=OUTBOX_LEASE_SECONDS), limit=OUTBOX_BATCH_SIZE)
+            batch_sent, batch_calls = deliver_all(line_bot_api, rows, pool)
+            total += len(rows)
+            sent += batch_sent
+            pushes += batch_calls
+            if len(rows) < OUTBOX_BATCH_SIZE:
+                break
+    if total:
+        logger.info(f"📮 Outbox 送出 {total} 筆 (共 {pushes} 次 API 呼叫)，成功 {sent} 筆。")
+    return total, sent
+
+def start_outbox_worker(scheduler, line_bot_api, jobstore):
+    """註冊定期重送 outbox 的 job (開啟合併時輪詢間隔不超過合併視窗)"""
+    seconds = min(OUTBOX_POLL_SECONDS, REMINDER_COALESCE_SECONDS) if is_coalescing() else OUTBOX_POLL_SECONDS
+    scheduler.add_job(
+        drain_outbox,
+        'interval',
+        seconds=seconds,
+        args=[line_bot_api],
+        id=OUTBOX_JOB_ID,
+        jobstore=jobstore,
+        replace_existing=True
+    )
+    logger.info(f"📮 Outbox 重送工作已啟動 (每 {seconds} 秒)。")
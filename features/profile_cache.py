@@ -0,0 +1,71 @@
+# features/profile_cache.py (LINE 顯示名稱的 LRU + TTL 快取)
+
+import os
+import logging
+from datetime import datetime, timedelta
+
+import pytz
+from linebot.exceptions import LineBotApiError
+
+from db import TTLCache, get_profile_name, save_profile_name
+
+logger = logging.getLogger(__name__)
+
+PROFILE_CACHE_MAX_ENTRIES = int(os.environ.get('PROFILE_CACHE_MAX_ENTRIES', 4096))
+PROFILE_CACHE_TTL_SECONDS = int(os.environ.get('PROFILE_CACHE_TTL_SECONDS', 6 * 3600))
+# 查不到 (例如使用者未加好友、已離開群組) 的結果只快取較短的時間
+PROFILE_NEGATIVE_TTL_SECONDS = int(os.environ.get('PROFILE_NEGATIVE_TTL_SECONDS', 300))
+# 只有這些狀態碼代表「真的查不到」；逾時 (line_client 的 408)、429、5xx 是暫時性錯誤，下次照常重查
+PROFILE_NEGATIVE_STATUSES = (403, 404)
+# 開啟後名稱會寫入 profile_names 資料表，重新啟動後仍可直接使用
+PROFILE_CACHE_PERSIST = os.environ.get('PROFILE_CACHE_PERSIST', 'off').strip().lower() in ('1', 'on', 'true', 'yes')
+PROFILE_PERSIST_MAX_AGE_DAYS = int(os.environ.get('PROFILE_PERSIST_MAX_AGE_DAYS', 7))
+
+_MISSING = object()
+_profile_cache = TTLCache(maxsize=PROFILE_CACHE_MAX_ENTRIES, ttl=PROFILE_CACHE_TTL_SECONDS)
+
+def profile_cache_stats():
+    return _profile_cache.stats()
+
+def _fetch(line_bot_api, source_type, container_id, user_id):
+    if source_type == 'group':
+        return line_bot_api.get_group_member_profile(container_id, user_id).display_name
+    if source_type == 'room':
+        return line_bot_api.get_room_member_profile(container_id, user_id).display_name
+    return line_bot_api.get_profile(user_id).display_name
+
+def get_display_name(line_bot_api, source_type, container_id, user_id, default="您"):
+    """
+    取得使用者在該聊天室中的顯示名稱，依序查：記憶體快取 -> (選用) 資料庫 -> LINE API。
+    LINE API 回傳錯誤時回傳 default；只有查不到 (404 / 403) 會快取一段時間。
+    """
+    if source_type not in ('group', 'room'):
+        source_type, container_id = 'user', user_id
+    key = (source_type, container_id, user_id)
+
+    name = _profile_cache.get(key, _MISSING)
+    if name is not _MISSING:
+        return default if name is None else name
+
+    now = datetime.now(pytz.UTC)
+    if PROFILE_CACHE_PERSIST:
+        name = get_profile_name(*key, newer_than=now - timedelta(days=PROFILE_PERSIST_MAX_AGE_DAYS))
+        if name:
+            _profile_cache.set(key, name)
+            return name
+
+    try:
+        name = _fetch(line_bot_api, *key)
+    except LineBotApiError as e:
+        logger.info(f"無法取得 {key} 的顯示名稱: {e.status_code}")
+        if e.status_code in PROFILE_NEGATIVE_STATUSES:
+            _profile_cache.set(key, None, ttl=PROFILE_NEGATIVE_TTL_SECONDS)
+        return default
+
+    _profile_cache.set(key, name)
+    if PROFILE_CACHE_PERSIST:
+        try:
+            save_profile_name(*key, display_name=name, updated_at=now)
+        except Exception as e:
+            logger.warning(f"顯示名稱寫入資料庫失敗: {e}")
+    return name
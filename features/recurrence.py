@@ -0,0 +1,262 @@
+# features/recurrence.py (週期規則編譯：規則字串只解析一次，之後直接計算接下來的觸發時間)
+#
+# 規則字串格式 (相容舊的 "MON,WED|23:00")：
+#   MON,WED|23:00           每週一、三 23:00
+#   DAILY|08:00             每天 08:00
+#   MONTHLY:15|09:00        每月 15 號 (該月沒有這一天時改在月底)
+#   MONTHLY:2TUE|09:00      每月第 2 個星期二；MONTHLY:-1FRI 為每月最後一個星期五
+# 時間後面可以再加上以分號分隔的選項：
+#   ;INTERVAL=3             每 3 天 / 週 / 月 (需要 START)
+#   ;START=2026-10-17       起算日 (第一次觸發不早於這天)
+#   ;COUNT=10               自起算日起共觸發 10 次 (需要 START)
+#   ;UNTIL=2026-12-31       最後一天 (含)
+#
+# compile_rule() 以字串為 key 快取編譯結果，內容相同的規則共用同一個 Rule；
+# Rule.spec 是正規化後的字串 (星期排序、時間補零、選項固定順序)，存在 events.recurrence_spec。
+
+import calendar
+from collections import namedtuple
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+
+DAYS = ['MON', 'TUE', 'WED', 'THU', 'FRI', 'SAT', 'SUN']
+WEEKDAY_NAMES = ['一', '二', '三', '四', '五', '六', '日']
+ALL_DAYS_MASK = (1 << 7) - 1
+# 沒有設定 UNTIL / COUNT 時，最多往後找這麼多天 (確保迴圈一定會結束)
+MAX_SEARCH_DAYS = 366 * 8
+
+def _parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+def _month_index(day):
+    return day.year * 12 + day.month - 1
+
+def _nth_weekday(year, month, weekday, nth):
+    """某月第 nth 個星期 weekday (nth = -1 為最後一個)，不存在時回傳 None"""
+    first_weekday, days_in_month = calendar.monthrange(year, month)
+    if nth > 0:
+        day = 1 + (weekday - first_weekday) % 7 + (nth - 1) * 7
+    else:
+        last_weekday = (first_weekday + days_in_month - 1) % 7
+        day = days_in_month - (last_weekday - weekday) % 7 + (nth + 1) * 7
+    return date(year, month, day) if 1 <= day <= days_in_month else None
+
+class Rule(namedtuple('Rule', [
+    'kind', 'weekdays', 'month_day', 'nth', 'hour', 'minute', 'interval', 'start', 'count', 'until'
+])):
+    """
+    編譯後的週期規則 (不可變，可當作 dict key)：
+      kind     : 'weekly' / 'daily' / 'monthly'
+      weekdays : 星期的 bitmask (bit 0 = 週一)；每月第 N 個星期幾時只有一個 bit
+      month_day: 每月幾號 (kind == 'monthly' 且不是第 N 個星期幾時)
+      nth      : 每月第幾個星期幾 (1~5，-1 為最後一個；0 代表不適用)
+    """
+    __slots__ = ()
+
+    @property
+    def spec(self):
+        """正規化後的規則字串"""
+        if self.kind == 'daily':
+            head = 'DAILY'
+        elif self.kind == 'weekly':
+            head = ','.join(day for index, day in enumerate(DAYS) if self.weekdays & (1 << index))
+        elif self.nth:
+            head = f"MONTHLY:{self.nth}{DAYS[self.weekdays.bit_length() - 1]}"
+        else:
+            head = f"MONTHLY:{self.month_day}"
+        spec = f"{head}|{self.hour:02d}:{self.minute:02d}"
+        if self.interval != 1:
+            spec += f";INTERVAL={self.interval}"
+        if self.start:
+            spec += f";START={self.start.isoformat()}"
+        if self.count:
+            spec += f";COUNT={self.count}"
+        if self.until:
+            spec += f";UNTIL={self.until.isoformat()}"
+        return spec
+
+    @property
+    def is_slot_based(self):
+        """能否交給每週時段排程 (見 recurring_slots)：每週固定星期與時間、沒有其他條件"""
+        return (self.kind in ('weekly', 'daily') and self.interval == 1
+                and not (self.start or self.count or self.until))
+
+    def weekly_minutes(self):
+        """每週觸發的 (星期, 當天第幾分鐘)，只適用於 is_slot_based 的規則"""
+        mask = ALL_DAYS_MASK if self.kind == 'daily' else self.weekdays
+        return [(index, self.hour * 60 + self.minute) for index in range(7) if mask & (1 << index)]
+
+    def describe(self):
+        """給提醒清單顯示的中文說明，例如「每週一,三 23:00」"""
+        time_str = f"{self.hour:02d}:{self.minute:02d}"
+        if self.kind == 'daily':
+            text = "每天" if self.interval == 1 else f"每 {self.interval} 天"
+        elif self.kind == 'weekly':
+            names = ','.join(WEEKDAY_NAMES[index] for index in range(7) if self.weekdays & (1 << index))
+            text = f"每週{names}" if self.interval == 1 else f"每 {self.interval} 週的週{names}"
+        else:
+            every = "每月" if self.interval == 1 else f"每 {self.interval} 個月"
+            if self.nth:
+                weekday = WEEKDAY_NAMES[self.weekdays.bit_length() - 1]
+                which = "最後一個" if self.nth == -1 else f"第 {self.nth} 個"
+                text = f"{every}{which}週{weekday}"
+            else:
+                text = f"{every} {self.month_day} 號"
+        text = f"{text} {time_str}"
+        if self.count:
+            text += f" (共 {self.count} 次)"
+        elif self.until:
+            text += f" (至 {self.until:%Y/%m/%d})"
+        return text
+
+    def _dates_from(self, first):
+        """依序產生 first (含) 之後所有符合規則的日期 (不考慮 COUNT / UNTIL)"""
+        if self.start and first < self.start:
+            first = self.start
+        if self.kind == 'monthly':
+            anchor = _month_index(self.start) if self.start else 0
+            index = _month_index(first)
+            index += -(index - anchor) % self.interval
+            while True:
+                year, month = divmod(index, 12)
+                month += 1
+                if self.nth:
+                    day = _nth_weekday(year, month, self.weekdays.bit_length() - 1, self.nth)
+                else:
+                    day = date(year, month, min(self.month_day, calendar.monthrange(year, month)[1]))
+                if day is not None and day >= first:
+                    yield day
+                index += self.interval
+        elif self.kind == 'daily':
+            day = first
+            if self.start and self.interval > 1:
+                day += timedelta(days=-(first - self.start).days % self.interval)
+            while True:
+                yield day
+                day += timedelta(days=self.interval)
+        else:
+            anchor = (self.start - timedelta(days=self.start.weekday())) if self.start else None
+            day = first
+            while True:
+                if anchor is not None and self.interval > 1:
+                    week = (day - anchor).days // 7
+                    if week % self.interval:
+                        # 跳到下一個要觸發的那週的週一
+                        day = anchor + timedelta(weeks=week + self.interval - week % self.interval)
+                        continue
+                if self.weekdays & (1 << day.weekday()):
+                    yield day
+                day += timedelta(days=1)
+
+    @property
+    def last_date(self):
+        """最後一次觸發的日期 (COUNT 與 UNTIL 取較早者)；沒有結束條件時為 None"""
+        return _last_date(self)
+
+    def next_occurrences(self, after, tz, k=1):
+        """after 之後 (不含) 的接下來 k 次觸發時間 (tz 的 aware datetime)；規則已結束時回傳的數量會少於 k"""
+        after = after.astimezone(tz)
+        last = self.last_date
+        at = time(self.hour, self.minute)
+        if hasattr(tz, 'localize'):  # pytz 時區必須用 localize 才會套用正確的 UTC 偏移
+            make = lambda day: tz.localize(datetime.combine(day, at))
+        else:
+            make = lambda day: datetime.combine(day, at, tzinfo=tz)
+
+        limit = after.date() + timedelta(days=MAX_SEARCH_DAYS)
+        result = []
+        for day in self._dates_from(after.date()):
+            if (last and day > last) or day > limit:
+                break
+            fire_time = make(day)
+            if fire_time > after:
+                result.append(fire_time)
+                if len(result) >= k:
+                    break
+        return result
+
+    def next_after(self, after, tz):
+        """after 之後的下一次觸發時間，規則已結束時回傳 None"""
+        occurrences = self.next_occurrences(after, tz, 1)
+        return occurrences[0] if occurrences else None
+
+@lru_cache(maxsize=4096)
+def _last_date(rule):
+    last = rule.until
+    if rule.count:
+        dates = rule._dates_from(rule.start)
+        for _ in range(rule.count - 1):
+            next(dates)
+        counted = next(dates)
+        last = min(last, counted) if last else counted
+    return last
+
+def _parse_head(head):
+    """規則的日期部分 -> (kind, weekdays, month_day, nth)"""
+    head = head.strip().upper()
+    if head == 'DAILY':
+        return 'daily', ALL_DAYS_MASK, None, 0
+    if head.startswith('MONTHLY:'):
+        value = head[len('MONTHLY:'):].strip()
+        if value[-3:] in DAYS:
+            nth = int(value[:-3])
+            if nth not in (-1, 1, 2, 3, 4, 5):
+                raise ValueError(f"第幾個星期必須是 1~5 或 -1: {value}")
+            return 'monthly', 1 << DAYS.index(value[-3:]), None, nth
+        month_day = int(value)
+        if not 1 <= month_day <= 31:
+            raise ValueError(f"日期超出範圍: {value}")
+        return 'monthly', 0, month_day, 0
+
+    weekdays = 0
+    for day in head.split(','):
+        day = day.strip()
+        if day not in DAYS:
+            raise ValueError(f"無法辨識的星期: {day}")
+        weekdays |= 1 << DAYS.index(day)
+    return 'weekly', weekdays, None, 0
+
+@lru_cache(maxsize=4096)
+def compile_rule(rule_str):
+    """解析週期規則字串成 Rule；格式錯誤時拋出 ValueError"""
+    if not rule_str or '|' not in rule_str:
+        raise ValueError(f"週期規則格式錯誤: {rule_str!r}")
+    head, rest = rule_str.split('|', 1)
+    time_str, *options = rest.split(';')
+    hour, minute = (int(part) for part in time_str.strip().split(':'))
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError(f"時間超出範圍: {time_str}")
+    kind, weekdays, month_day, nth = _parse_head(head)
+
+    interval, start, count, until = 1, None, None, None
+    for option in options:
+        if not option.strip():
+            continue
+        key, _, value = option.partition('=')
+        key, value = key.strip().upper(), value.strip()
+        if key == 'INTERVAL':
+            interval = int(value)
+        elif key == 'START':
+            start = _parse_date(value)
+        elif key == 'COUNT':
+            count = int(value)
+        elif key == 'UNTIL':
+            until = _parse_date(value)
+        else:
+            raise ValueError(f"無法辨識的選項: {key}")
+    if interval < 1 or (count is not None and count < 1):
+        raise ValueError(f"INTERVAL / COUNT 必須大於 0: {rule_str!r}")
+    if (interval > 1 or count) and start is None:
+        raise ValueError(f"INTERVAL / COUNT 需要指定 START: {rule_str!r}")
+    # 每天觸發的每週規則與 DAILY 相同，統一成 DAILY
+    if kind == 'weekly' and weekdays == ALL_DAYS_MASK and interval == 1:
+        kind = 'daily'
+    return Rule(kind, weekdays, month_day, nth, hour, minute, interval, start, count, until)
+
+def normalize_rule(rule_str):
+    """規則字串 -> 正規化字串 (寫入 events.recurrence_spec)"""
+    return compile_rule(rule_str).spec
+
+def rule_of(event):
+    """事件的編譯後規則 (優先使用正規化欄位，舊資料退回原始字串)"""
+    return compile_rule(getattr(event, 'recurrence_spec', None) or event.recurrence_rule)
@@ -3,7 +3,13 @@
 from linebot.models import (
     TextSendMessage, FlexSendMessage
 )
+from datetime import datetime
 from db import add_event
+from features.dispatcher import is_dispatcher_mode
+from features.profile_cache import get_display_name
+from features.recurrence import DAYS, compile_rule
+from features.recurring_slots import slots_for_rule, ensure_slot_jobs
+from features.state_store import SettingRecurring, AwaitingRecurringContent
 
 WEEKDAYS_MAP = {"MON": "一", "TUE": "二", "WED": "三", "THU": "四", "FRI": "五", "SAT": "六", "SUN": "日"}
 
@@ -47,12 +53,12 @@ def _create_flex_message(selected_days):
     
     return flex_json
 
-def start_flow(event, line_bot_api, user_states):
+def start_flow(event, line_bot_api, state_store):
     """開始設定流程"""
     user_id = event.source.user_id
-    user_states[user_id] = {"action": "setting_recurring", "selected_days": set(), "selected_time": None}
+    state_store.set(user_id, SettingRecurring())
     
-    flex_contents = _create_flex_message(set())
+    flex_contents = _create_flex_message(())
     line_bot_api.reply_message(
         event.reply_token,
         [
@@ -61,69 +67,64 @@ def start_flow(event, line_bot_api, user_states):
         ]
     )
 
-def handle_postback(event, line_bot_api, user_states):
+def handle_postback(event, line_bot_api, state_store):
     """處理週期提醒相關的 Postback 事件"""
     user_id = event.source.user_id
     data = dict(x.split('=', 1) for x in event.postback.data.split('&'))
     action = data.get('action')
 
-    if user_id not in user_states or user_states[user_id].get("action") not in ["setting_recurring", "awaiting_recurring_content"]:
+    state = state_store.get(user_id)
+    if not isinstance(state, SettingRecurring):
         return
 
-    state = user_states[user_id]
-
     if action == 'toggle_weekday':
-        if state.get("action") != "setting_recurring": return
         day_to_toggle = data.get('day')
-        if day_to_toggle in state["selected_days"]:
-            state["selected_days"].remove(day_to_toggle)
-        else:
-            state["selected_days"].add(day_to_toggle)
+        if day_to_toggle not in DAYS: return
+        selected = set(state.days) ^ {day_to_toggle}
+        state = SettingRecurring(days=tuple(day for day in DAYS if day in selected), time=state.time)
+        state_store.set(user_id, state)
         
-        flex_contents = _create_flex_message(state["selected_days"])
+        flex_contents = _create_flex_message(state.days)
         line_bot_api.reply_message(
             event.reply_token,
             FlexSendMessage(alt_text="更新星期選擇", contents=flex_contents)
         )
 
     elif action == 'set_recurring_time':
-        if state.get("action") != "setting_recurring": return
         selected_time = event.postback.params.get('time')
-        state["selected_time"] = selected_time
         
-        if not state["selected_days"]:
+        if not state.days:
+            state_store.set(user_id, SettingRecurring(days=state.days, time=selected_time))
             line_bot_api.reply_message(event.reply_token, TextSendMessage(text="請先選擇至少一個星期！"))
             return
 
-        user_states[user_id]['action'] = 'awaiting_recurring_content'
+        state_store.set(user_id, AwaitingRecurringContent(days=state.days, time=selected_time))
         line_bot_api.reply_message(
             event.reply_token,
             TextSendMessage(text=f"好的，時間設定為 {selected_time}。\n現在，請直接輸入要提醒的【事件內容】：")
         )
 
-def handle_content_input(event, line_bot_api, user_states, scheduler, send_reminder_func, TAIPEI_TZ):
+def handle_content_input(event, line_bot_api, state_store, scheduler, send_slot_func, TAIPEI_TZ, send_reminder_func=None):
     """處理使用者輸入的提醒內容，並完成最終設定"""
-    from linebot.exceptions import LineBotApiError
     user_id = event.source.user_id
     content = event.message.text.strip()
-    state = user_states[user_id]
+    state = state_store.get(user_id)
+    if not isinstance(state, AwaitingRecurringContent):
+        return
+
+    days_str = ",".join(state.days)
+    rule_str = f"{days_str}|{state.time}"
+    rule = compile_rule(rule_str)
+    slots = slots_for_rule(rule_str)
+    next_run_time = rule.next_after(datetime.now(TAIPEI_TZ), TAIPEI_TZ)
 
-    days_str = ",".join(sorted(list(state["selected_days"])))
-    hour, minute = state["selected_time"].split(':')
-    
-    rule_str = f"{days_str}|{state['selected_time']}"
-
-    # 獲取使用者名稱
-    try:
-        profile = line_bot_api.get_profile(user_id)
-        display_name = profile.display_name
-    except LineBotApiError:
-        display_name = "您"
-    
     # 取得 target_id
     source = event.source
     target_id = getattr(source, f'{source.type}_id', user_id)
 
+    # 獲取使用者名稱 (快取)
+    display_name = get_display_name(line_bot_api, source.type, target_id, user_id)
+
     event_id = add_event(
         creator_user_id=user_id,
         target_id=target_id,
@@ -132,33 +133,31 @@ def handle_content_input(event, line_bot_api, user_states, scheduler, send_remin
         content=content,
         event_datetime=None,
         is_recurring=1,
-        recurrence_rule=rule_str
+        recurrence_rule=rule_str,
+        recurrence_spec=rule.spec,
+        next_run_time=next_run_time,
+        slots=slots
     )
 
     if not event_id:
         line_bot_api.reply_message(event.reply_token, TextSendMessage(text="❌ 建立週期提醒失敗，請稍后再试。"))
-        del user_states[user_id]
+        state_store.pop(user_id)
         return
 
-    job_id = f"recurring_{event_id}"
-    scheduler.add_job(
-        send_reminder_func,
-        trigger='cron',
-        args=[event_id],
-        id=job_id,
-        day_of_week=days_str.lower(),
-        hour=int(hour),
-        minute=int(minute),
-        replace_existing=True,
-        misfire_grace_time=60
-    )
+    # 派送器模式下只需寫入 next_run_time；否則確保每個時段都有對應的 cron job，
+    # 不適用時段排程的規則 (每 N 天、每月...) 則以 next_run_time 註冊單次 job，發送後再排下一次
+    if not is_dispatcher_mode():
+        if slots:
+            ensure_slot_jobs(scheduler, slots, send_slot_func, TAIPEI_TZ)
+        elif next_run_time and send_reminder_func:
+            scheduler.add_job(send_reminder_func, 'date', run_date=next_run_time, args=[event_id],
+                              id=f"reminder_{event_id}", replace_existing=True)
 
-    del user_states[user_id]
+    state_store.pop(user_id)
     
-    selected_day_names = [WEEKDAYS_MAP[day] for day in sorted(list(state["selected_days"]))]
     reply_text = (
         f"✅ 設定完成！\n"
-        f"將在每【周{', '.join(selected_day_names)}】的【{state['selected_time']}】\n"
+        f"將在【{rule.describe()}】\n"
         f"提醒您：『{content}』"
     )
     line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_text))
\ No newline at end of file
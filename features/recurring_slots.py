@@ -0,0 +1,52 @@
+# features/recurring_slots.py (週期提醒的時段排程：每個「星期 + 時間」只註冊一個 cron job)
+#
+# 每週固定星期與時間的規則 (例如 "MON,WED|23:00") 所有可能的時段只有 7 x 1440 個。
+# 排程器為每個有提醒的時段註冊一個 job，觸發時再從 recurring_slots 索引查出要發送的提醒，
+# job 數量與記憶體用量只跟時段數有關，不會隨提醒數量成長。
+
+from apscheduler.triggers.cron import CronTrigger
+
+from features.recurrence import DAYS, compile_rule
+
+MINUTES_PER_DAY = 1440
+SLOT_JOB_PREFIX = 'recurring_slot_'
+SLOT_MISFIRE_GRACE_SECONDS = 60
+
+def slots_for_rule(rule_str):
+    """
+    把週期規則轉成時段編號 (星期 * 1440 + 當天第幾分鐘)。
+    每 N 天、每月、有起訖條件的規則不適用時段排程，回傳空 list (改由 next_run_time 逐筆排程)。
+    """
+    rule = compile_rule(rule_str)
+    if not rule.is_slot_based:
+        return []
+    return sorted({day * MINUTES_PER_DAY + minute_of_day for day, minute_of_day in rule.weekly_minutes()})
+
+def slot_job_id(slot):
+    day, minute_of_day = divmod(slot, MINUTES_PER_DAY)
+    return f"{SLOT_JOB_PREFIX}{DAYS[day]}_{minute_of_day // 60:02d}{minute_of_day % 60:02d}"
+
+def slot_from_job_id(job_id):
+    """slot_job_id 的反向：recurring_slot_MON_2300 -> 時段編號"""
+    day, hhmm = job_id[len(SLOT_JOB_PREFIX):].split('_')
+    return DAYS.index(day) * MINUTES_PER_DAY + int(hhmm[:2]) * 60 + int(hhmm[2:])
+
+def slot_trigger(slot, TAIPEI_TZ):
+    day, minute_of_day = divmod(slot, MINUTES_PER_DAY)
+    return CronTrigger(day_of_week=DAYS[day].lower(), hour=minute_of_day // 60, minute=minute_of_day % 60, timezone=TAIPEI_TZ)
+
+def ensure_slot_jobs(scheduler, slots, send_slot_func, TAIPEI_TZ):
+    """為還沒有 job 的時段註冊 cron job (已存在的不會重新註冊)"""
+    added = 0
+    for slot in slots:
+        if scheduler.get_job(slot_job_id(slot)) is None:
+            scheduler.add_job(
+                send_slot_func,
+                trigger=slot_trigger(slot, TAIPEI_TZ),
+                args=[slot],
+                id=slot_job_id(slot),
+                replace_existing=True,
+                misfire_grace_time=SLOT_MISFIRE_GRACE_SECONDS
+            )
+            added += 1
+    return added
@@ -3,7 +3,6 @@
 import re
 import pytz
 from datetime import datetime, timedelta
-from linebot.exceptions import LineBotApiError
 from linebot.models import (
     TextSendMessage, QuickReply, QuickReplyButton, PostbackAction, MessageAction,
     FlexSendMessage, BubbleContainer, BoxComponent, TextComponent, 
@@ -11,10 +10,11 @@ from linebot.models import (
 )
 from db import (
     add_event, get_event, update_reminder_time, reset_reminder_sent_status,
-    get_all_events_by_user, delete_event_by_id, update_event_snooze,update_event_content, reschedule_event_time
+    get_active_events_page, delete_event_by_id, update_event_snooze,update_event_content, reschedule_event_time
 )
-
-WEEKDAYS_MAP = {"MON": "一", "TUE": "二", "WED": "三", "THU": "四", "FRI": "五", "SAT": "六", "SUN": "日"}
+from features.profile_cache import get_display_name
+from features.recurrence import rule_of
+from features.state_store import SettingPriorityTime, SettingPriorityLevel, AwaitingEditContent
 
 PRIORITY_RULES = {
     1: {"color": "#28a745", "label": "🟢 綠色 (30分/1次)", "interval": 30, "repeats": 1},
@@ -22,6 +22,8 @@ PRIORITY_RULES = {
     3: {"color": "#dc3545", "label": "🔴 紅色 (5分/3次)",  "interval": 5,  "repeats": 3}
 }
 
+MANAGE_PAGE_SIZE = 10
+
 EARLY_REMINDER_OPTIONS = {
     0: "準時",
     5: "前 5 分鐘",
@@ -76,12 +78,7 @@ def handle_reminder_command(event, line_bot_api, TAIPEI_TZ, now_in_taipei):
             return
         target_display_name = who_to_remind_text
         if who_to_remind_text == '我':
-            try:
-                if source_type == 'group': profile = line_bot_api.get_group_member_profile(destination_id, creator_user_id)
-                elif source_type == 'room': profile = line_bot_api.get_room_member_profile(destination_id, creator_user_id)
-                else: profile = line_bot_api.get_profile(creator_user_id)
-                target_display_name = profile.display_name
-            except LineBotApiError: target_display_name = "您"
+            target_display_name = get_display_name(line_bot_api, source_type, destination_id, creator_user_id)
             
         event_id = add_event(
             creator_user_id=creator_user_id, target_id=destination_id, target_type=source_type,
@@ -101,7 +98,7 @@ def handle_reminder_command(event, line_bot_api, TAIPEI_TZ, now_in_taipei):
     except Exception as e:
         raise e
 
-def handle_priority_reminder_command(event, line_bot_api, user_states, TAIPEI_TZ):
+def handle_priority_reminder_command(event, line_bot_api, state_store, TAIPEI_TZ):
     """處理'重要提醒'指令 - 第一步：選擇提早時間"""
     text = event.message.text.strip()
     match = re.match(r'^重要提醒(.*?)\s+(今天|明天|後天|[0-9/]+)\s*([0-9]{1,2}:[0-9]{2})?\s*(.+)$', text)
@@ -111,10 +108,7 @@ def handle_priority_reminder_command(event, line_bot_api, user_states, TAIPEI_TZ
         return
 
     user_id = event.source.user_id
-    user_states[user_id] = {
-        "action": "setting_priority_time",
-        "data": match.groups()
-    }
+    state_store.set(user_id, SettingPriorityTime(data=match.groups()))
 
     buttons = []
     for minutes, label in sorted(EARLY_REMINDER_OPTIONS.items(), key=lambda x: x[0]):
@@ -141,7 +135,7 @@ def handle_priority_reminder_command(event, line_bot_api, user_states, TAIPEI_TZ
     line_bot_api.reply_message(event.reply_token, FlexSendMessage(alt_text="選擇提前時間", contents=bubble))
 
 
-def handle_reminder_postback(event, line_bot_api, scheduler, send_reminder_func, safe_add_job_func, TAIPEI_TZ, user_states):
+def handle_reminder_postback(event, line_bot_api, scheduler, send_reminder_func, safe_add_job_func, TAIPEI_TZ, state_store):
     """處理提醒功能相關的 Postback 事件"""
     data = dict(x.split('=', 1) for x in event.postback.data.split('&'))
     action = data.get('action')
@@ -155,9 +149,8 @@ def handle_reminder_postback(event, line_bot_api, scheduler, send_reminder_func,
             page = int(data.get('page', 1))
         except ValueError:
             page = 1
-        events = get_all_events_by_user(user_id)
-        if events:
-            bubble = create_management_flex(events, page=page)
+        bubble, page = build_management_panel(user_id, page=page, cursor=data.get('after'))
+        if bubble:
             flex_message = FlexSendMessage(alt_text=f"提醒管理面板 (第 {page} 頁)", contents=bubble)
             line_bot_api.reply_message(event.reply_token, flex_message)
         else:
@@ -166,11 +159,11 @@ def handle_reminder_postback(event, line_bot_api, scheduler, send_reminder_func,
 
     # --- 重要提醒：選擇提早時間 ---
     if action == 'set_priority_time':
-        if user_id not in user_states or user_states[user_id].get("action") != "setting_priority_time": return
+        state = state_store.get(user_id)
+        if not isinstance(state, SettingPriorityTime): return
         
         minutes_early = int(data.get('minutes'))
-        user_states[user_id]["minutes_early"] = minutes_early
-        user_states[user_id]["action"] = "setting_priority_level"
+        state_store.set(user_id, SettingPriorityLevel(data=state.data, minutes_early=minutes_early))
 
         bubble = BubbleContainer(
             body=BoxComponent(
@@ -191,12 +184,13 @@ def handle_reminder_postback(event, line_bot_api, scheduler, send_reminder_func,
 
     # --- 重要提醒：選擇等級並設定排程 ---
     if action == 'set_priority':
-        if user_id not in user_states or user_states[user_id].get("action") != "setting_priority_level": return
+        state = state_store.get(user_id)
+        if not isinstance(state, SettingPriorityLevel): return
         level = int(data.get('level'))
         
-        raw_data = user_states[user_id]["data"]
-        minutes_early = user_states[user_id]["minutes_early"]
-        del user_states[user_id]
+        raw_data = state.data
+        minutes_early = state.minutes_early
+        state_store.pop(user_id)
         
         who, date_str, time_str, content = raw_data
         who = who.strip() or "我"
@@ -240,6 +234,11 @@ def handle_reminder_postback(event, line_bot_api, scheduler, send_reminder_func,
             line_bot_api.reply_message(event.reply_token, TextSendMessage(text="❌ 排程設定失敗。"))
         return
 
+    if action == 'confirm_recurring':
+        # 週期提醒的確認按鈕不帶 event_id (同內容的提醒共用同一則 multicast 訊息)
+        line_bot_api.reply_message(event.reply_token, TextSendMessage(text="✅ 提醒已確認收到！(下個週期會繼續提醒)"))
+        return
+
     # --- 2. 嘗試獲取 event_id (針對需要 ID 的操作) ---
     try:
         event_id = int(data.get('id', 0))
@@ -387,11 +386,7 @@ def handle_reminder_postback(event, line_bot_api, scheduler, send_reminder_func,
         if not event_record: return
         
         # 設定使用者狀態，等待輸入
-        user_states[user_id] = {
-            'action': 'awaiting_edit_content',
-            'event_id': event_id,
-            'original_content': event_record.event_content
-        }
+        state_store.set(user_id, AwaitingEditContent(event_id=event_id, original_content=event_record.event_content))
         
         msg = (
             f"目前內容：\n『{event_record.event_content}』\n\n"
@@ -427,9 +422,8 @@ def handle_reminder_postback(event, line_bot_api, scheduler, send_reminder_func,
         if result.get("status") == "success":
             job_id = f"recurring_{event_id}" if result.get("is_recurring") else f"reminder_{event_id}"
             if scheduler.get_job(job_id): scheduler.remove_job(job_id)
-            events = get_all_events_by_user(user_id)
-            if events:
-                bubble = create_management_flex(events)
+            bubble, _ = build_management_panel(user_id)
+            if bubble:
                 flex_message = FlexSendMessage(alt_text="提醒管理面板", contents=bubble)
                 line_bot_api.reply_message(event.reply_token, flex_message)
             else:
@@ -440,30 +434,25 @@ def handle_reminder_postback(event, line_bot_api, scheduler, send_reminder_func,
 # --- Flex Message ---
 # features/reminder.py
 
-def create_management_flex(events, page=1):
+def build_management_panel(user_id, page=1, cursor=None):
+    """
+    查詢一頁「進行中」的提醒並產生管理面板，回傳 (bubble, page)。
+    過濾與分頁都在 SQL 完成；游標失效 (例如提醒已被刪光) 時回到第一頁。
+    """
+    events, next_cursor = get_active_events_page(user_id, limit=MANAGE_PAGE_SIZE, cursor=cursor)
+    if not events and cursor:
+        page, cursor = 1, None
+        events, next_cursor = get_active_events_page(user_id, limit=MANAGE_PAGE_SIZE)
+    if not events:
+        return None, page
+    return create_management_flex(events, page=page, next_cursor=next_cursor), page
+
+def create_management_flex(events, page=1, next_cursor=None):
+    """events 為已過濾好的單頁資料；next_cursor 不為 None 代表還有下一頁"""
     if not events: return None
     
     TAIPEI_TZ = pytz.timezone('Asia/Taipei')
-
-    valid_events = []
-    for event in events:
-        if not event.is_recurring and event.reminder_sent == 1:
-            continue
-        if not event.is_recurring and event.reminder_time is None:
-            continue
-        valid_events.append(event)
-
-    if not valid_events:
-        return None
-
-    ITEMS_PER_PAGE = 10
-    total_events = len(valid_events)
-    start_index = (page - 1) * ITEMS_PER_PAGE
-    end_index = start_index + ITEMS_PER_PAGE
-    display_events = valid_events[start_index:end_index]
-    
-    if not display_events and page > 1:
-        return create_management_flex(events, page=1)
+    display_events = events
 
     header = BoxComponent(
         layout='vertical', 
@@ -479,12 +468,8 @@ def create_management_flex(events, page=1):
 
         if event.is_recurring:
             try:
-                rule_parts = event.recurrence_rule.split('|')
-                days_code = rule_parts[0].split(',')
-                day_names = [WEEKDAYS_MAP.get(d, '') for d in days_code]
-                time_str = rule_parts[1]
-                time_text = f"每週{','.join(day_names)} {time_str}"
-            except: 
+                time_text = rule_of(event).describe()
+            except ValueError:
                 time_text = "週期設定"
             icon = "🔄"
             
@@ -536,10 +521,10 @@ def create_management_flex(events, page=1):
         body_contents.append(SeparatorComponent(margin='sm'))
 
     footer_contents = []
-    if end_index < total_events:
+    if next_cursor:
         next_page = page + 1
         btn_label = f"顯示更多 ({next_page})"
-        btn_data = f'action=refresh_manage_panel&page={next_page}'
+        btn_data = f'action=refresh_manage_panel&page={next_page}&after={next_cursor}'
     else:
         btn_label = "回到第一頁"
         btn_data = 'action=refresh_manage_panel&page=1'
@@ -554,9 +539,7 @@ def create_management_flex(events, page=1):
 
 def handle_list_reminders(event, line_bot_api):
     user_id = event.source.user_id
-    events = get_all_events_by_user(user_id)
-
-    bubble = create_management_flex(events, page=1)
+    bubble, _ = build_management_panel(user_id)
     
     if not bubble:
         line_bot_api.reply_message(event.reply_token, TextSendMessage(text="您目前沒有「進行中」的提醒喔！(已完成或未設定的已隱藏)"))
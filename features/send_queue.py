@@ -0,0 +1,163 @@
+# features/send_queue.py (有併發上限與速率限制的提醒發送佇列)
+
+import os
+import time
+import heapq
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# LINE push API 每個頻道上限約 2,000 次/秒，保留一半給 reply 與其他推播
+SEND_RATE_PER_SECOND = float(os.environ.get('DISPATCH_SEND_RATE', 1000))
+SEND_BURST = int(os.environ.get('DISPATCH_SEND_BURST', 200))
+SEND_CONCURRENCY = int(os.environ.get('DISPATCH_SEND_CONCURRENCY', 16))
+# 佇列中最多累積的提醒數，超過時派送器暫停認領 (其餘留在資料庫等下一輪)
+SEND_QUEUE_LIMIT = int(os.environ.get('DISPATCH_SEND_QUEUE_LIMIT', 2000))
+
+class TokenBucket:
+    """令牌桶：平均每秒 rate 個，最多累積 capacity 個"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """取得一個令牌，不夠時阻塞等待"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class ReminderSender:
+    """
+    依觸發時間排序的發送佇列：
+    一條 feeder 執行緒在提醒到期時取令牌，再交給固定大小的執行緒池發送。
+    每筆提醒從「應觸發時間」到「實際開始發送」的排隊時間都會被記錄下來。
+    同一筆提醒以新的觸發時間重新排入 (認領後被延後、改期) 時取代舊的那筆；
+    發送時再由 send_func 依認領的觸發時間確認提醒沒有改變 (見 app._prepare_reminder)。
+    """
+
+    def __init__(self, send_func, TAIPEI_TZ, send_batch_func=None, rate=SEND_RATE_PER_SECOND, burst=SEND_BURST,
+                 concurrency=SEND_CONCURRENCY, queue_limit=SEND_QUEUE_LIMIT):
+        self.send_func = send_func
+        self.send_batch_func = send_batch_func
+        self.tz = TAIPEI_TZ
+        self.bucket = TokenBucket(rate, burst)
+        self.pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="reminder-sender")
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.queue_limit = queue_limit
+        self.heap = []
+        self.seq = 0
+        self.queued = {}  # event_id -> 目前有效的觸發時間 (heap 中時間不符的是被取代的舊項目)
+        self.cond = threading.Condition()
+        self.sent = 0
+        self.failed = 0
+        self.queue_delays = deque(maxlen=1000)
+        threading.Thread(target=self._feed, name="reminder-feeder", daemon=True).start()
+
+    def capacity(self):
+        """佇列還能接受的提醒數"""
+        with self.cond:
+            return max(0, self.queue_limit - len(self.queued))
+
+    def submit(self, event_ids, fire_time):
+        """
+        排入一筆提醒 (event_id) 或一組同時觸發、要一起送出的提醒 (event_id 的 tuple)。
+        一組提醒只佔用一個令牌，由 send_batch_func 一起處理。
+        已在佇列中、觸發時間相同的提醒會被略過；觸發時間不同則以新的時間取代。
+        """
+        if not isinstance(event_ids, tuple):
+            event_ids = (event_ids,)
+        with self.cond:
+            event_ids = tuple(event_id for event_id in event_ids if self.queued.get(event_id) != fire_time)
+            if not event_ids:
+                return False
+            self.seq += 1
+            heapq.heappush(self.heap, (fire_time, self.seq, event_ids))
+            self.queued.update((event_id, fire_time) for event_id in event_ids)
+            self.cond.notify()
+            return True
+
+    def clear(self):
+        """丟棄尚未開始發送的提醒 (已交給執行緒池的照常送完)，回傳丟棄的筆數"""
+        with self.cond:
+            dropped = len(self.queued)
+            self.heap.clear()
+            self.queued.clear()
+            return dropped
+
+    def _feed(self):
+        while True:
+            with self.cond:
+                while True:
+                    if self.heap:
+                        wait = (self.heap[0][0] - datetime.now(self.tz)).total_seconds()
+                        if wait <= 0:
+                            break
+                        self.cond.wait(wait)
+                    else:
+                        self.cond.wait()
+                fire_time, _seq, event_ids = heapq.heappop(self.heap)
+                # 已被新的觸發時間取代 (或已被 clear) 的提醒不再送出
+                event_ids = tuple(event_id for event_id in event_ids if self.queued.get(event_id) == fire_time)
+                if not event_ids:
+                    continue
+
+            self.bucket.acquire()
+            self.slots.acquire()
+            with self.cond:
+                # 等令牌期間也可能被取代
+                event_ids = tuple(event_id for event_id in event_ids if self.queued.get(event_id) == fire_time)
+                for event_id in event_ids:
+                    del self.queued[event_id]
+            if not event_ids:
+                self.slots.release()
+                continue
+            self.pool.submit(self._send, event_ids, fire_time)
+
+    def _send(self, event_ids, fire_time):
+        queued_ms = (datetime.now(self.tz) - fire_time).total_seconds() * 1000
+        self.queue_delays.append(queued_ms)
+        logger.debug(f"提醒 {list(event_ids)} 排隊 {queued_ms:.0f} ms 後開始發送")
+        ok = False
+        try:
+            # 帶上認領時的觸發時間，發送前確認提醒沒有被延後或改期
+            if len(event_ids) > 1 and self.send_batch_func:
+                self.send_batch_func(list(event_ids), fire_time)
+            else:
+                for event_id in event_ids:
+                    self.send_func(event_id, fire_time)
+            ok = True
+        except Exception as e:
+            logger.error(f"Error sending reminder {list(event_ids)}: {e}", exc_info=True)
+        finally:
+            self.slots.release()
+            with self.cond:
+                if ok:
+                    self.sent += len(event_ids)
+                else:
+                    self.failed += len(event_ids)
+
+    def stats(self):
+        delays = sorted(self.queue_delays)
+        return {
+            "queued": len(self.queued),
+            "sent": self.sent,
+            "failed": self.failed,
+            "queue_ms_avg": round(sum(delays) / len(delays), 1) if delays else 0.0,
+            "queue_ms_p95": round(delays[min(len(delays) - 1, int(len(delays) * 0.95))], 1) if delays else 0.0,
+            "queue_ms_max": round(delays[-1], 1) if delays else 0.0,
+        }
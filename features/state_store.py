@@ -0,0 +1,232 @@
+# features/state_store.py (對話流程狀態：每位使用者目前進行中的多步驟操作)
+#
+# 原本的 user_states 是 app.py 中的 dict：放棄的流程永遠不會被清掉，也無法在多個 worker 之間共用。
+# 這裡把每種狀態定義成不可變的 dataclass (可序列化成 JSON)，並提供兩種 StateStore：
+#   memory : 行程內的 LRU + TTL 快取 (單一 worker 的預設)
+#   db     : conversation_states 資料表 (多個 worker / 多個行程共用；SQLite 檔案亦可；開啟 leader election 時的預設)
+# 狀態超過 STATE_TTL_MINUTES 沒有更新就視為放棄，讀取時當作不存在。
+
+import os
+import json
+import logging
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict, fields
+from datetime import datetime, timedelta
+from typing import ClassVar, Optional, Tuple
+
+import pytz
+
+from db import (
+    TTLCache, get_conversation_state, save_conversation_state, delete_conversation_state, prune_conversation_states
+)
+from features.leader import is_leader_election_enabled
+
+logger = logging.getLogger(__name__)
+
+# 開啟 leader election (多個 worker) 時同一位使用者連續的 webhook 可能落在不同 worker，預設改存資料庫
+STATE_STORE = os.environ.get('STATE_STORE', 'db' if is_leader_election_enabled() else 'memory').strip().lower()
+STATE_TTL_MINUTES = float(os.environ.get('STATE_TTL_MINUTES', 30))
+STATE_MAX_ENTRIES = int(os.environ.get('STATE_MAX_ENTRIES', 10000))
+# db 模式下多久清一次過期的狀態
+STATE_PRUNE_SECONDS = 600
+
+# ---------------------------------
+# 狀態 (不可變；轉換流程時以新的狀態覆蓋)
+# ---------------------------------
+
+@dataclass(frozen=True)
+class AwaitingLocName:
+    """地點：等待輸入地點名稱"""
+    action: ClassVar[str] = 'awaiting_loc_name'
+
+@dataclass(frozen=True)
+class AwaitingLocation:
+    """地點：已輸入名稱，等待位置訊息"""
+    action: ClassVar[str] = 'awaiting_location'
+    name: str
+
+@dataclass(frozen=True)
+class SettingRecurring:
+    """週期提醒：選擇星期與時間 (days 依 MON~SUN 排序)"""
+    action: ClassVar[str] = 'setting_recurring'
+    days: Tuple[str, ...] = ()
+    time: Optional[str] = None
+
+@dataclass(frozen=True)
+class AwaitingRecurringContent:
+    """週期提醒：星期與時間已選好，等待輸入內容"""
+    action: ClassVar[str] = 'awaiting_recurring_content'
+    days: Tuple[str, ...]
+    time: str
+
+@dataclass(frozen=True)
+class SettingPriorityTime:
+    """重要提醒：等待選擇提早時間 (data 為指令解析出的 (who, date, time, content))"""
+    action: ClassVar[str] = 'setting_priority_time'
+    data: Tuple[Optional[str], ...]
+
+@dataclass(frozen=True)
+class SettingPriorityLevel:
+    """重要提醒：等待選擇重要程度"""
+    action: ClassVar[str] = 'setting_priority_level'
+    data: Tuple[Optional[str], ...]
+    minutes_early: int
+
+@dataclass(frozen=True)
+class AwaitingEditContent:
+    """編輯提醒：等待輸入新內容"""
+    action: ClassVar[str] = 'awaiting_edit_content'
+    event_id: int
+    original_content: str
+
+STATE_TYPES = {cls.action: cls for cls in (
+    AwaitingLocName, AwaitingLocation, SettingRecurring, AwaitingRecurringContent,
+    SettingPriorityTime, SettingPriorityLevel, AwaitingEditContent,
+)}
+
+def encode_state(state):
+    """狀態 -> JSON 字串 ({"action": ..., 其餘欄位})"""
+    return json.dumps({"action": state.action, **asdict(state)}, ensure_ascii=False, separators=(',', ':'))
+
+def decode_state(payload):
+    """JSON 字串 -> 狀態；無法辨識的內容 (例如舊版本寫入的) 回傳 None"""
+    try:
+        data = json.loads(payload)
+        cls = STATE_TYPES[data.pop('action')]
+        values = {
+            field.name: tuple(data[field.name]) if isinstance(data.get(field.name), list) else data[field.name]
+            for field in fields(cls) if field.name in data
+        }
+        return cls(**values)
+    except (ValueError, KeyError, TypeError) as e:
+        logger.warning(f"無法解析對話狀態: {e}")
+        return None
+
+# ---------------------------------
+# StateStore
+# ---------------------------------
+
+class StateStore(ABC):
+    """
+    以 user_id 為 key 的對話狀態。讀取-修改-寫入的流程請包在 lock(user_id) 中，
+    同一位使用者的兩個事件不會同時改到同一筆狀態。
+    子類別必須實作 get / set / pop，少實作時在建立時就會失敗。
+    """
+
+    def __init__(self, ttl_seconds):
+        self.ttl_seconds = ttl_seconds
+        # 每位使用者各自一把鎖 (不共用分段鎖：處理中會呼叫 Gemini / LINE，別的使用者不該跟著等)；
+        # 沒有人持有或等待時就移除，數量只跟同時處理中的使用者數有關
+        self._locks = {}  # user_id -> [RLock, 持有或等待中的數量]
+        self._locks_guard = threading.Lock()
+
+    @contextmanager
+    def lock(self, user_id):
+        with self._locks_guard:
+            entry = self._locks.setdefault(user_id, [threading.RLock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._locks_guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[user_id]
+
+    def active_locks(self):
+        """目前持有或等待中的使用者鎖數量"""
+        with self._locks_guard:
+            return len(self._locks)
+
+    @abstractmethod
+    def get(self, user_id):
+        """目前的狀態 (沒有或已過期則回傳 None)"""
+
+    @abstractmethod
+    def set(self, user_id, state):
+        """以新的狀態覆蓋 (並重新計算 TTL)"""
+
+    @abstractmethod
+    def pop(self, user_id):
+        """刪除並回傳目前的狀態 (沒有則回傳 None)"""
+
+    def action(self, user_id):
+        """目前狀態的 action 名稱，沒有進行中的流程時回傳 None"""
+        state = self.get(user_id)
+        return state.action if state is not None else None
+
+    def stats(self):
+        return {}
+
+class MemoryStateStore(StateStore):
+    """行程內的狀態 (LRU + TTL，超過 max_entries 時淘汰最久沒更新的)"""
+
+    def __init__(self, ttl_seconds, max_entries=STATE_MAX_ENTRIES):
+        super().__init__(ttl_seconds)
+        self._cache = TTLCache(maxsize=max_entries, ttl=ttl_seconds)
+
+    def get(self, user_id):
+        return self._cache.get(user_id)
+
+    def set(self, user_id, state):
+        self._cache.set(user_id, state)
+
+    def pop(self, user_id):
+        with self.lock(user_id):
+            state = self._cache.get(user_id)
+            self._cache.pop(user_id)
+            return state
+
+    def stats(self):
+        return {"backend": "memory", "locks": self.active_locks(), **self._cache.stats()}
+
+class DbStateStore(StateStore):
+    """存在 conversation_states 資料表的狀態 (多個 worker 共用；鎖只在行程內有效，跨行程的順序由 webhook inbox 保證)"""
+
+    def __init__(self, ttl_seconds):
+        super().__init__(ttl_seconds)
+        self._last_prune = None
+        self._prune_lock = threading.Lock()
+
+    def _now(self):
+        return datetime.now(pytz.UTC)
+
+    def get(self, user_id):
+        payload = get_conversation_state(user_id, self._now())
+        return decode_state(payload) if payload else None
+
+    def set(self, user_id, state):
+        now = self._now()
+        save_conversation_state(user_id, state.action, encode_state(state), now + timedelta(seconds=self.ttl_seconds))
+        self._maybe_prune(now)
+
+    def pop(self, user_id):
+        with self.lock(user_id):
+            state = self.get(user_id)
+            delete_conversation_state(user_id)
+            return state
+
+    def _maybe_prune(self, now):
+        with self._prune_lock:
+            if self._last_prune and (now - self._last_prune).total_seconds() < STATE_PRUNE_SECONDS:
+                return
+            self._last_prune = now
+        try:
+            prune_conversation_states(now)
+        except Exception as e:
+            logger.warning(f"清除過期的對話狀態失敗: {e}")
+
+    def stats(self):
+        return {"backend": "db", "ttl": self.ttl_seconds, "locks": self.active_locks()}
+
+def create_state_store(backend=STATE_STORE, ttl_minutes=STATE_TTL_MINUTES):
+    """依 STATE_STORE 建立 StateStore (memory / db)"""
+    ttl_seconds = int(ttl_minutes * 60)
+    if backend == 'db':
+        return DbStateStore(ttl_seconds)
+    if backend != 'memory':
+        logger.warning(f"未知的 STATE_STORE: {backend}，改用 memory。")
+    return MemoryStateStore(ttl_seconds)
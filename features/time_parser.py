@@ -0,0 +1,299 @@
+# features/time_parser.py (本地的中文時間解析：常見的提醒句型不必等 Gemini)
+#
+# 大部分提醒都是固定的句型，例如「明天早上九點開會」、「下週三下午3點半交報告」、「10分鐘後關火」。
+# parse_time_expression() 以規則解析相對 / 絕對的日期與時間，回傳與 ai_parser.parse_natural_language
+# 相同格式的 {event_content, event_datetime}，並附上 confidence (0~1)：
+# 句子裡還有沒解析到的數字或時間用語、只有時段沒有幾點 (「明天下午」)、沒有上下午的 1~6 點等情況信心較低，
+# 低於 LOCAL_PARSER_MIN_CONFIDENCE 時應交給 Gemini。
+#
+# 準確率與耗時的基準測試：python benchmarks/bench_time_parser.py
+
+import os
+import re
+from datetime import datetime, time, timedelta
+
+LOCAL_PARSER_MIN_CONFIDENCE = float(os.environ.get('LOCAL_PARSER_MIN_CONFIDENCE', 0.8))
+
+# 沒有提醒內容時的預設內容 (例如只說「10分鐘後」)
+DEFAULT_CONTENT = "提醒"
+
+_CN_DIGITS = {'零': 0, '〇': 0, '一': 1, '二': 2, '兩': 2, '两': 2, '三': 3, '四': 4,
+              '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
+_NUM = r'[0-9零〇一二兩两三四五六七八九十百]+'
+_MARK = '\x00'  # 已解析的片段以這個字元取代，避免前後文字黏在一起
+
+_WEEKDAYS = {'一': 0, '二': 1, '三': 2, '四': 3, '五': 4, '六': 5, '日': 6, '天': 6, '末': 5,
+             '1': 0, '2': 1, '3': 2, '4': 3, '5': 4, '6': 5, '7': 6}
+_DAY_WORDS = {'大後天': 3, '大后天': 3, '後天': 2, '后天': 2, '明天': 1, '明日': 1, '今天': 0, '今日': 0}
+# 「明早」「今晚」同時帶有日期與時段
+_DAY_PERIOD_WORDS = {'明早': (1, '早上'), '明晚': (1, '晚上'), '今早': (0, '早上'), '今晚': (0, '晚上'),
+                     '今晨': (0, '早上')}
+# 只說時段、沒說幾點時的預設時間
+_PERIOD_DEFAULT_HOUR = {'凌晨': 3, '清晨': 6, '早上': 9, '早晨': 9, '上午': 9, '中午': 12, '下午': 15,
+                        '傍晚': 18, '晚上': 20, '夜裡': 22, '半夜': 0}
+_PM_PERIODS = ('下午', '傍晚', '晚上', '夜裡')
+
+_REL_RE = re.compile(
+    rf'(?=[0-9零〇一二兩两三四五六七八九十百半])'
+    rf'(?:(?P<weeks>{_NUM})\s*個?\s*(?:週|周|星期|禮拜))?'
+    rf'\s*(?:(?P<days>{_NUM})\s*天)?'
+    rf'\s*(?:(?P<hours>{_NUM}|半)\s*個?(?P<half1>半)?\s*(?:小時|鐘頭)(?P<half2>半)?)?'
+    rf'\s*(?:(?P<minutes>{_NUM})\s*分鐘?)?'
+    r'\s*(?:之後|以後|後|后)'
+)
+_WEEKDAY_RE = re.compile(r'(?P<prefix>下下|下個|下|這個|這|本)?\s*(?:週|周|星期|禮拜|礼拜)(?P<day>[一二三四五六日天末1-7])')
+_DAY_PERIOD_RE = re.compile('|'.join(_DAY_PERIOD_WORDS))
+_DAY_WORD_RE = re.compile('|'.join(sorted(_DAY_WORDS, key=len, reverse=True)))
+_ISO_DATE_RE = re.compile(r'(?<!\d)(?P<y>\d{4})\s*[-.]\s*(?P<m>\d{1,2})\s*[-.]\s*(?P<d>\d{1,2})(?!\d)')
+_SLASH_DATE_RE = re.compile(r'(?<!\d)(?:(?P<y>\d{4})\s*/\s*)?(?P<m>\d{1,2})\s*/\s*(?P<d>\d{1,2})(?!\d)')
+_CN_DATE_RE = re.compile(rf'(?:(?P<y>\d{{4}})\s*年\s*)?(?P<m>{_NUM})\s*月\s*(?P<d>{_NUM})\s*[日號号]?')
+_MONTH_DAY_RE = re.compile(rf'(?P<which>下個?月|這個?月|本月)\s*(?P<d>{_NUM})\s*[日號号]')
+_DAY_ONLY_RE = re.compile(rf'(?P<d>{_NUM})\s*[號号]')
+_PERIOD_RE = re.compile(rf"(?:{'|'.join(_PERIOD_DEFAULT_HOUR)})(?!茶)")  # 「下午茶」不是時段
+_COLON_TIME_RE = re.compile(r'(?<!\d)(?P<h>\d{1,2})\s*:\s*(?P<m>\d{2})(?!\d)')
+_CN_TIME_RE = re.compile(
+    rf'(?P<h>{_NUM})\s*(?:點|点|時)鐘?\s*(?:(?P<half>半)|(?P<quarter>[一三])刻|(?P<m>{_NUM})\s*分?|整)?'
+)
+
+_LEADING_FILLER_RE = re.compile(r'^(?:之前|以前|之後|以後|前|後)?(?:請|麻煩)?(?:提醒我|提醒|幫我|叫我|記得|我要)*')
+_TRAILING_FILLER_RE = re.compile(r'(?:提醒我|叫我|喔|哦|啊|啦|吧|唷|呦|[!！。.~～?？])+$')
+_SEPARATORS = ' ，,、；;：:\t'
+# 清掉解析到的片段後還留著這些字，代表句子裡有沒看懂的時間
+_LEFTOVER_TIME_RE = re.compile(
+    r'\d|[零一二兩三四五六七八九十][點点時]|分鐘|小時|明天|後天|今天|[週周][一二三四五六日天]|星期|禮拜|個月|[號号]'
+    r'|早上|上午|中午|下午(?!茶)|晚上'
+)
+
+def _to_int(value):
+    """阿拉伯數字或中文數字 (九十九以內、含「百」) 轉成整數"""
+    if value.isdigit():
+        return int(value)
+    total, number = 0, 0
+    for ch in value:
+        if ch in _CN_DIGITS:
+            number = _CN_DIGITS[ch]
+        elif ch == '十':
+            total += (number or 1) * 10
+            number = 0
+        elif ch == '百':
+            total += (number or 1) * 100
+            number = 0
+    return total + number
+
+def _normalize(text):
+    # 全形數字與冒號轉成半形
+    text = text.translate(str.maketrans('０１２３４５６７８９：／', '0123456789:/'))
+    return re.sub(r'\s+', ' ', text.strip())
+
+class _Scan:
+    """依序套用各個 pattern，把解析到的片段從工作字串中挖掉"""
+
+    def __init__(self, text):
+        self.text = text
+        self.found = 0
+
+    def take(self, pattern):
+        """回傳所有符合的片段 (呼叫端依數量判斷是否有歧義)"""
+        matches = [m for m in pattern.finditer(self.text) if m.group(0).strip()]
+        for m in reversed(matches):
+            self.text = self.text[:m.start()] + _MARK + self.text[m.end():]
+        self.found += len(matches)
+        return matches
+
+def _relative_delta(m):
+    weeks = _to_int(m.group('weeks')) if m.group('weeks') else 0
+    days = _to_int(m.group('days')) if m.group('days') else 0
+    minutes = _to_int(m.group('minutes')) if m.group('minutes') else 0
+    hours_str = m.group('hours')
+    hours = 0.5 if hours_str == '半' else (_to_int(hours_str) if hours_str else 0)
+    if m.group('half1') or m.group('half2'):
+        hours += 0.5
+    return weeks * 7 + days, timedelta(hours=hours, minutes=minutes)
+
+def _clean_content(text):
+    content = text.replace(_MARK, ' ')
+    content = re.sub(r'\s+', ' ', content).strip(_SEPARATORS)
+    content = _LEADING_FILLER_RE.sub('', content).strip(_SEPARATORS)
+    content = _TRAILING_FILLER_RE.sub('', content).strip(_SEPARATORS)
+    # 挖掉片段後中間殘留的分隔字
+    return re.sub(r'\s*[，,、]\s*(?=[，,、]|$)', '', content).strip(_SEPARATORS)
+
+def _apply_period(hour, period):
+    """依時段把 12 小時制的鐘點換成 24 小時制；回傳 (hour, 是否跨到隔天 0 點)"""
+    if period in _PM_PERIODS:
+        if hour == 12:
+            # 下午 12 點就是中午；晚上 12 點是隔天 0 點
+            return (12, False) if period == '下午' else (0, True)
+        return (hour + 12 if hour < 12 else hour), False
+    if period == '中午':
+        return (hour + 12 if 1 <= hour <= 5 else hour), False
+    if period in ('凌晨', '半夜') and hour == 12:
+        return 0, False
+    return hour, False
+
+def _safe_date(year, month, day):
+    try:
+        return datetime(year, month, day).date()
+    except ValueError:
+        return None
+
+def _next_month(year, month):
+    return (year + 1, 1) if month == 12 else (year, month + 1)
+
+def _scan_dates(scan, today):
+    """
+    找出句子中的日期，回傳 (dates, period, same_weekday)。
+    period：「明早」「今晚」這類字詞帶出的時段；same_weekday：沒有「下」的「週X」剛好是今天 (時間已過則延到下週)。
+    """
+    dates, period, same_weekday = [], None, False
+    for m in scan.take(_DAY_PERIOD_RE):
+        offset, period = _DAY_PERIOD_WORDS[m.group(0)]
+        dates.append(today + timedelta(days=offset))
+    for m in scan.take(_DAY_WORD_RE):
+        dates.append(today + timedelta(days=_DAY_WORDS[m.group(0)]))
+    monday = today - timedelta(days=today.weekday())
+    for m in scan.take(_WEEKDAY_RE):
+        weekday = _WEEKDAYS[m.group('day')]
+        prefix = m.group('prefix') or ''
+        if prefix.startswith('下下'):
+            dates.append(monday + timedelta(weeks=2, days=weekday))
+        elif prefix.startswith('下'):
+            dates.append(monday + timedelta(weeks=1, days=weekday))
+        elif prefix:
+            dates.append(monday + timedelta(days=weekday))
+        else:
+            # 只說「週三」：接下來的第一個週三
+            dates.append(today + timedelta(days=(weekday - today.weekday()) % 7))
+            same_weekday = weekday == today.weekday()
+    for m in scan.take(_MONTH_DAY_RE):
+        year, month = today.year, today.month
+        if m.group('which').startswith('下'):
+            year, month = _next_month(year, month)
+        dates.append(_safe_date(year, month, _to_int(m.group('d'))))
+    for pattern in (_ISO_DATE_RE, _SLASH_DATE_RE, _CN_DATE_RE):
+        for m in scan.take(pattern):
+            month, day = _to_int(m.group('m')), _to_int(m.group('d'))
+            if m.group('y'):
+                dates.append(_safe_date(int(m.group('y')), month, day))
+                continue
+            # 沒寫年份：今年的這天已經過了就是明年
+            candidate = _safe_date(today.year, month, day)
+            if candidate is not None and candidate < today:
+                candidate = _safe_date(today.year + 1, month, day)
+            dates.append(candidate)
+    for m in scan.take(_DAY_ONLY_RE):
+        # 只寫「25號」：這個月的這天已經過了就是下個月
+        day = _to_int(m.group('d'))
+        candidate = _safe_date(today.year, today.month, day)
+        if candidate is not None and candidate < today:
+            candidate = _safe_date(*_next_month(today.year, today.month), day)
+        dates.append(candidate)
+    return dates, period, same_weekday
+
+def _scan_clock(scan):
+    """句子中的鐘點 -> [(hour, minute)]"""
+    clocks = []
+    for m in scan.take(_COLON_TIME_RE):
+        clocks.append((int(m.group('h')), int(m.group('m'))))
+    for m in scan.take(_CN_TIME_RE):
+        if m.group('half'):
+            minute = 30
+        elif m.group('quarter'):
+            minute = 15 if m.group('quarter') == '一' else 45
+        else:
+            minute = _to_int(m.group('m')) if m.group('m') else 0
+        clocks.append((_to_int(m.group('h')), minute))
+    return clocks
+
+def parse_time_expression(text, now):
+    """
+    解析中文的提醒句子，now 為目前時間 (回傳的時間與 now 同一個時區，不含時區資訊)。
+    回傳 {"event_content", "event_datetime": "YYYY-MM-DD HH:MM", "confidence"}；
+    找不到時間、或時間說法互相矛盾 (「明天或後天」) 時回傳 None。
+    """
+    scan = _Scan(_normalize(text))
+    base = now.replace(tzinfo=None, second=0, microsecond=0)
+    today = base.date()
+    confidence = 1.0
+
+    # 1. 相對時間：「10分鐘後」「一個半小時後」「3天後」
+    relative = scan.take(_REL_RE)
+    if len(relative) > 1:
+        return None
+    relative_days, delta = _relative_delta(relative[0]) if relative else (0, timedelta(0))
+
+    # 2. 日期、時段、鐘點
+    dates, period, same_weekday = _scan_dates(scan, today)
+    periods = {m.group(0) for m in scan.take(_PERIOD_RE)}
+    if period:
+        periods.add(period)
+    clocks = _scan_clock(scan)
+    if not scan.found:
+        return None
+    if None in dates or len(dates) > 1 or len(periods) > 1 or len(clocks) > 1:
+        return None  # 不存在的日期，或一句話裡有兩個時間
+    period = periods.pop() if periods else None
+
+    if delta:
+        # 「10分鐘後」「2小時後」：不能再搭配日期或鐘點
+        if relative_days or dates or clocks or period:
+            return None
+        result = base + delta
+        confidence = 0.95
+    else:
+        date = dates[0] if dates else None
+        if relative_days:
+            if date is not None:
+                return None
+            date = today + timedelta(days=relative_days)
+
+        if clocks:
+            hour, minute = clocks[0]
+            if hour > 24 or minute > 59:
+                return None
+        elif relative_days and period is None:
+            hour, minute = base.hour, base.minute  # 「3天後」：與現在同一時間
+        elif date is not None:
+            hour, minute = _PERIOD_DEFAULT_HOUR.get(period, 9), 0
+            confidence = 0.6  # 只說了哪天 (或哪個時段)，沒說幾點
+        else:
+            return None  # 只有「晚上」之類的時段
+
+        next_day = False
+        if period and clocks:
+            hour, next_day = _apply_period(hour, period)
+        elif period is None and 1 <= hour <= 6:
+            confidence = min(confidence, 0.6)  # 沒說上午還是下午的 1~6 點
+        if hour == 24:
+            hour, next_day = 0, True
+
+        result = datetime.combine(date or today, time(hour, minute))
+        if next_day:
+            result += timedelta(days=1)
+        if date is None and result <= base:
+            if period is None and 0 < hour < 12 and result + timedelta(hours=12) > base:
+                # 上午 10 點說「8點吃藥」，指的是晚上 8 點；0 點與 12 點沒有上下午之分，一律順延到隔天
+                result += timedelta(hours=12)
+                confidence = min(confidence, 0.85)
+            else:
+                result += timedelta(days=1)
+        elif same_weekday and result <= base:
+            result += timedelta(weeks=1)
+
+    content = _clean_content(scan.text)
+    if _LEFTOVER_TIME_RE.search(content):
+        confidence = min(confidence, 0.4)  # 還有沒看懂的時間說法
+    if not content:
+        content = DEFAULT_CONTENT
+        confidence = min(confidence, 0.85)
+
+    return {
+        "event_content": content,
+        "event_datetime": result.strftime('%Y-%m-%d %H:%M'),
+        "confidence": round(confidence, 2),
+    }
+
+def is_confident(result, threshold=None):
+    """本地解析的結果是否可以直接使用 (不必再問 Gemini)"""
+    threshold = LOCAL_PARSER_MIN_CONFIDENCE if threshold is None else threshold
+    return result is not None and result["confidence"] >= threshold
@@ -0,0 +1,209 @@
+# features/webhook_inbox.py (webhook 快速回應：驗證簽章、寫入 inbox 後立即回 200，由背景 worker 處理)
+#
+# /callback 只做簽章驗證與一次 INSERT，Gemini、搜尋、profile 查詢與資料庫操作都移到 worker。
+# 每個事件以 webhookEventId 為唯一鍵寫入 webhook_inbox，LINE 重送的事件會被唯一索引擋下，
+# 同一個事件不會進到 handle_message / handle_postback 兩次。
+# worker 處理時把單一事件重新包成 webhook body 並以 channel secret 簽章，交給原本的 WebhookHandler。
+# 事件以來源使用者為 key 交給 KeyedExecutor：不同使用者平行處理，同一位使用者嚴格依收到的順序處理
+# (對話狀態的 awaiting_edit_content、setting_priority_time 等多步驟流程依賴這個順序)。
+
+import os
+import json
+import time
+import hmac
+import base64
+import hashlib
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+
+import pytz
+from linebot.exceptions import InvalidSignatureError
+
+from db import (
+    append_inbox, claim_inbox_batch, mark_inbox_done, mark_inbox_failed, fail_exhausted_inbox, prune_inbox
+)
+from features.keyed_executor import KeyedExecutor
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_INBOX = os.environ.get('WEBHOOK_INBOX', 'on').strip().lower() in ('1', 'on', 'true', 'yes')
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', 8))
+# 沒有被喚醒時 (其他行程寫入、或租約過期的事件) 多久檢查一次 inbox
+WEBHOOK_POLL_SECONDS = float(os.environ.get('WEBHOOK_POLL_SECONDS', 5))
+# 處理中的行程中斷時，超過租約才由其他 worker 接手；處理失敗的事件不重試 (reply token 早已失效)
+WEBHOOK_LEASE_SECONDS = int(os.environ.get('WEBHOOK_LEASE_SECONDS', 120))
+WEBHOOK_MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', 2))
+# 已處理的事件保留多久 (期間內仍可擋下 LINE 的重送)
+WEBHOOK_RETENTION_HOURS = float(os.environ.get('WEBHOOK_RETENTION_HOURS', 48))
+WEBHOOK_PRUNE_SECONDS = 600
+# 每個行程最多認領、排隊中的事件數 (佇列滿了就留在 inbox，由其他行程或下一輪認領)；
+# 認領後在佇列中等待的時間要遠小於租約，否則租約過期的事件可能被其他行程重複處理
+WEBHOOK_QUEUE_LIMIT = int(os.environ.get('WEBHOOK_QUEUE_LIMIT', WEBHOOK_WORKERS * 4))
+# inbox 關閉時，同步處理一個 webhook 請求最多等待多久
+WEBHOOK_INLINE_TIMEOUT_SECONDS = float(os.environ.get('WEBHOOK_INLINE_TIMEOUT_SECONDS', 25))
+
+def is_inbox_enabled():
+    return WEBHOOK_INBOX
+
+def _now():
+    return datetime.now(pytz.UTC)
+
+def _event_key(event):
+    # 舊版 webhook 沒有 webhookEventId，以事件內容的雜湊代替
+    return event.get('webhookEventId') or hashlib.sha256(
+        json.dumps(event, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    ).hexdigest()
+
+def _source_key(event):
+    """保序用的 key：對話狀態以 userId 為 key，沒有 userId 時以群組 / 聊天室為 key"""
+    source = event.get('source') or {}
+    return source.get('userId') or source.get('groupId') or source.get('roomId')
+
+def _split(data):
+    """webhook body -> [(webhook_event_id, source_key, 只含單一事件的 body)]"""
+    destination = data.get('destination')
+    return [
+        (_event_key(event), _source_key(event),
+         json.dumps({"destination": destination, "events": [event]}, ensure_ascii=False))
+        for event in data.get('events', [])
+    ]
+
+class WebhookInbox:
+    """
+    持久化的 webhook inbox 與背景 worker pool。
+    ingest() 在請求執行緒中呼叫；start() 在每個行程啟動一條 feeder 執行緒，
+    依收到的順序認領事件，以來源使用者為 key 交給 KeyedExecutor 處理。
+    """
+
+    def __init__(self, handler, channel_secret, workers=WEBHOOK_WORKERS, queue_limit=WEBHOOK_QUEUE_LIMIT):
+        self.handler = handler
+        self.secret = channel_secret.encode('utf-8')
+        self.workers = workers
+        self.executor = KeyedExecutor(workers, max_pending=queue_limit, name="webhook-worker")
+        self.wake = threading.Event()
+        self.lock = threading.Lock()
+        self.started = False
+        self.received = 0
+        self.duplicates = 0
+        self.processed = 0
+        self.failed = 0
+        self.lags = deque(maxlen=1000)
+
+    def _sign(self, body):
+        return base64.b64encode(hmac.new(self.secret, body.encode('utf-8'), hashlib.sha256).digest()).decode('utf-8')
+
+    def _validate(self, body, signature):
+        if not self.handler.parser.signature_validator.validate(body, signature):
+            raise InvalidSignatureError(f"Invalid signature. signature={signature}")
+        return json.loads(body)
+
+    def ingest(self, body, signature):
+        """驗證簽章並把事件寫入 inbox，回傳新寫入的事件數 (重送的事件不計)；簽章錯誤時拋出 InvalidSignatureError"""
+        events = _split(self._validate(body, signature))
+        if not events:
+            return 0  # LINE 後台的「驗證」請求沒有事件
+        added = append_inbox(events, _now())
+        with self.lock:
+            self.received += added
+            self.duplicates += len(events) - added
+        if added:
+            self.wake.set()
+        return added
+
+    def handle_inline(self, body, signature):
+        """
+        不經過 inbox 直接處理 (inbox 關閉或寫入失敗時)：一樣依使用者分派到 KeyedExecutor，
+        不同使用者平行、同一位使用者依序，等全部處理完 (或逾時) 才回傳。
+        """
+        events = _split(self._validate(body, signature))
+        futures = [
+            self.executor.submit(source_key, self._handle_event, payload)
+            for _, source_key, payload in events
+        ]
+        deadline = time.monotonic() + WEBHOOK_INLINE_TIMEOUT_SECONDS
+        for future in futures:
+            if future is None:
+                continue
+            try:
+                future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except Exception as e:
+                logger.error(f"📥 Webhook 事件處理失敗或逾時: {e!r}")
+
+    def start(self):
+        if self.started:
+            return
+        self.started = True
+        threading.Thread(target=self._run, name="webhook-feeder", daemon=True).start()
+        logger.info(f"📥 Webhook inbox worker 已啟動 ({self.workers} 條執行緒)。")
+
+    def _run(self):
+        last_prune = 0.0
+        while True:
+            self.wake.wait(WEBHOOK_POLL_SECONDS)
+            self.wake.clear()
+            try:
+                self.drain()
+                if time.monotonic() - last_prune > WEBHOOK_PRUNE_SECONDS:
+                    last_prune = time.monotonic()
+                    prune_inbox(_now() - timedelta(hours=WEBHOOK_RETENTION_HOURS))
+            except Exception as e:
+                logger.error(f"📥 Webhook inbox 處理失敗: {e}", exc_info=True)
+
+    def drain(self):
+        """認領可處理的事件 (不超過佇列剩餘空間，其餘留在 inbox 等下一輪)"""
+        while True:
+            capacity = self.executor.capacity()
+            if capacity <= 0:
+                return  # 背壓：佇列已滿，處理完的事件會再喚醒 feeder
+            now = _now()
+            fail_exhausted_inbox(WEBHOOK_MAX_ATTEMPTS, now)
+            rows = claim_inbox_batch(now, now + timedelta(seconds=WEBHOOK_LEASE_SECONDS), limit=capacity)
+            for row in rows:
+                # claim 依 id 排序，同一個 key 的事件依序排進同一條佇列
+                self.executor.submit(row.source_key, self._process, row)
+            if len(rows) < capacity:
+                return
+
+    def _handle_event(self, payload):
+        timestamp = json.loads(payload)['events'][0].get('timestamp')
+        if timestamp:
+            self.lags.append(time.time() * 1000 - timestamp)
+        self.handler.handle(payload, self._sign(payload))
+
+    def _process(self, row):
+        ok, error = False, None
+        try:
+            self._handle_event(row.payload)
+            ok = True
+        except Exception as e:
+            logger.error(f"📥 Webhook 事件 {row.webhook_event_id} 處理失敗: {e}", exc_info=True)
+            error = str(e)
+        finally:
+            try:
+                if ok:
+                    mark_inbox_done([row.id], _now())
+                else:
+                    mark_inbox_failed([row.id], error, _now())
+            except Exception as e:
+                logger.error(f"📥 無法更新 webhook 事件 {row.webhook_event_id} 的狀態: {e}")
+            with self.lock:
+                if ok:
+                    self.processed += 1
+                else:
+                    self.failed += 1
+            # 佇列空出位置，而且同一個使用者的下一個事件現在可以認領了
+            self.wake.set()
+
+    def stats(self):
+        lags = sorted(self.lags)
+        return {
+            "received": self.received,
+            "duplicates": self.duplicates,
+            "processed": self.processed,
+            "failed": self.failed,
+            "lag_ms_avg": round(sum(lags) / len(lags), 1) if lags else 0.0,
+            "lag_ms_p95": round(lags[min(len(lags) - 1, int(len(lags) * 0.95))], 1) if lags else 0.0,
+            "executor": self.executor.stats(),
+        }
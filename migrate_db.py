@@ -128,5 +128,17 @@ def run_smart_migration():
         os.rename(OLD_DB_FILE, DB_FILE)
         print("   - 資料庫已還原至遷移前的狀態。")
 
+def run_index_migration():
+    """只補建索引 (可重複執行，SQLite 與 Postgres 皆適用)"""
+    print(f"=== 索引遷移 ===")
+    from db import init_db, DATABASE_URL
+    print(f"資料庫: {DATABASE_URL.split('@')[-1]}")
+    init_db()  # create_all 之後會呼叫 ensure_indexes() 補齊組合索引與唯一索引
+    print("✅ 索引檢查完成！可執行 python check_indexes.py 確認查詢計畫。")
+
 if __name__ == "__main__":
-    run_smart_migration()
\ No newline at end of file
+    import sys
+    if "--indexes" in sys.argv:
+        run_index_migration()
+    else:
+        run_smart_migration()
\ No newline at end of file
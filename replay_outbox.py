@@ -0,0 +1,61 @@
+# replay_outbox.py (批次重送卡住的提醒推播)
+#
+# 執行：
+#   python replay_outbox.py                     # 重新排入所有已放棄 (dead) 的推播
+#   python replay_outbox.py --stuck-minutes 30  # 另外包含 30 分鐘以上沒有進展的 pending 推播
+#   python replay_outbox.py --event-id 42 --dry-run
+#   python replay_outbox.py --send              # 排入後立刻在本行程送出 (需設定 LINE_CHANNEL_ACCESS_TOKEN)
+#
+# 重送會沿用原本的 X-Line-Retry-Key，LINE 已接受過的推播不會重複發送
+# (LINE 只保留 retry key 24 小時，超過後重送可能造成重複)。
+
+import os
+import sys
+import argparse
+from datetime import datetime, timedelta
+
+import pytz
+
+from db import init_db, replay_outbox, outbox_counts
+
+def main():
+    parser = argparse.ArgumentParser(description="重新排入卡住的 outbox 推播")
+    parser.add_argument('--stuck-minutes', type=int, default=None, help="一併重送超過 N 分鐘仍未送出的 pending 推播")
+    parser.add_argument('--no-dead', action='store_true', help="不包含已放棄 (dead) 的推播")
+    parser.add_argument('--ids', type=int, nargs='+', help="只處理指定的 outbox id")
+    parser.add_argument('--event-id', type=int, default=None, help="只處理指定提醒的推播")
+    parser.add_argument('--dry-run', action='store_true', help="只顯示筆數，不修改資料")
+    parser.add_argument('--send', action='store_true', help="排入後立刻送出 (否則等執行中的服務重送)")
+    args = parser.parse_args()
+    if args.send and not os.environ.get('LINE_CHANNEL_ACCESS_TOKEN'):
+        sys.exit("--send 需要設定 LINE_CHANNEL_ACCESS_TOKEN")
+
+    init_db()
+    now = datetime.now(pytz.UTC)
+    stuck_before = now - timedelta(minutes=args.stuck_minutes) if args.stuck_minutes is not None else None
+
+    print(f"目前 outbox 狀態: {outbox_counts()}")
+    count = replay_outbox(
+        now,
+        include_dead=not args.no_dead,
+        stuck_before=stuck_before,
+        ids=args.ids,
+        event_id=args.event_id,
+        dry_run=args.dry_run
+    )
+    print(f"{'符合條件' if args.dry_run else '已重新排入'}: {count} 筆")
+
+    if args.send and count and not args.dry_run:
+        # 不能 import app：那會在這個維護指令裡啟動排程器、inbox worker 等，可能與線上服務重複發送提醒
+        from features.line_client import LineClient
+        from features.outbox import drain_outbox
+        line_bot_api = LineClient(os.environ['LINE_CHANNEL_ACCESS_TOKEN'])
+        try:
+            total, sent = drain_outbox(line_bot_api)
+        finally:
+            line_bot_api.close()
+        print(f"已送出 {sent}/{total} 筆")
+        print(f"目前 outbox 狀態: {outbox_counts()}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# tests/conftest.py (測試一律使用暫存的 SQLite 檔案，必須在 import db 之前設定 DATABASE_URL)
+
+import os
+import sys
+import tempfile
+
+_TMP_DIR = tempfile.mkdtemp(prefix="reminder-tests-")
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_TMP_DIR, 'test.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datetime import datetime
+
+import pytest
+import pytz
+
+import db
+
+TAIPEI_TZ = pytz.timezone('Asia/Taipei')
+
+@pytest.fixture(scope='session')
+def _schema():
+    db.init_db()
+
+@pytest.fixture
+def clean_db(_schema):
+    """每個測試前清空所有資料表與讀取快取"""
+    with db.engine.begin() as conn:
+        for table in reversed(db.Base.metadata.sorted_tables):
+            conn.execute(table.delete())
+        if db._memory_search_backend == 'fts5':
+            conn.exec_driver_sql("DELETE FROM memories_fts")
+    db._event_cache.clear()
+    db._collection_cache.clear()
+    yield
+
+@pytest.fixture
+def now():
+    return TAIPEI_TZ.localize(datetime(2026, 10, 17, 10, 0))
+
+class FakeLineApi:
+    """只記錄推播內容的 LINE 用戶端"""
+
+    def __init__(self):
+        self.pushes = []
+
+    def push_message(self, to, messages, notification_disabled=False, timeout=None, retry_key=None):
+        self.pushes.append((to, messages))
+
+    def multicast(self, to, messages, notification_disabled=False, timeout=None, retry_key=None):
+        for user_id in to:
+            self.pushes.append((user_id, messages))
+
+@pytest.fixture
+def line_api():
+    return FakeLineApi()
@@ -0,0 +1,69 @@
+# tests/test_catch_up.py (停機補發)
+
+from datetime import timedelta
+
+import db
+from features.catch_up import catch_up_missed, HEARTBEAT_NAME
+from features.dispatcher import as_aware
+from conftest import TAIPEI_TZ
+
+def _add(run_time, content='開會', target_id='U1', **kwargs):
+    return db.add_event('U1', target_id, 'user', '小明', content, run_time, next_run_time=run_time, **kwargs)
+
+def _texts(line_api):
+    return [(to, messages[0]['text']) for to, messages in line_api.pushes]
+
+def test_missed_reminders_are_merged_per_target(clean_db, now, line_api):
+    first = _add(now - timedelta(minutes=30), '開會')
+    second = _add(now - timedelta(minutes=10), '吃藥')
+    other = _add(now - timedelta(minutes=5), '繳費', target_id='U2')
+
+    counts = catch_up_missed(line_api, TAIPEI_TZ, now=now)
+
+    assert counts == {"late": 3, "targets": 2, "skipped": 0}
+    texts = dict(_texts(line_api))
+    assert texts['U1'].index('開會') < texts['U1'].index('吃藥')
+    assert '繳費' in texts['U2']
+    for event_id in (first, second, other):
+        event = db.get_event(event_id, use_cache=False)
+        assert (event.reminder_sent, event.next_run_time) == (1, None)
+
+def test_recent_reminders_are_left_to_the_scheduler(clean_db, now, line_api):
+    event_id = _add(now - timedelta(seconds=10))
+
+    assert catch_up_missed(line_api, TAIPEI_TZ, now=now)["late"] == 0
+    assert db.get_event(event_id, use_cache=False).next_run_time is not None
+
+    assert catch_up_missed(line_api, TAIPEI_TZ, now=now, grace_seconds=0)["late"] == 1
+
+def test_reminders_before_last_heartbeat_are_skipped(clean_db, now, line_api):
+    db.record_heartbeat(HEARTBEAT_NAME, now - timedelta(minutes=10))
+    stale = _add(now - timedelta(hours=2))
+    missed = _add(now - timedelta(minutes=5))
+
+    counts = catch_up_missed(line_api, TAIPEI_TZ, now=now)
+
+    assert counts == {"late": 1, "targets": 1, "skipped": 1}
+    stale_event = db.get_event(stale, use_cache=False)
+    # 略過的一次性提醒保留在清單中，只是不再自動觸發
+    assert (stale_event.reminder_sent, stale_event.next_run_time) == (0, None)
+    assert db.get_event(missed, use_cache=False).reminder_sent == 1
+
+def test_recurring_reminder_is_advanced(clean_db, now, line_api):
+    event_id = _add(now - timedelta(minutes=5), is_recurring=1, recurrence_rule='DAILY|09:55')
+
+    catch_up_missed(line_api, TAIPEI_TZ, now=now)
+
+    event = db.get_event(event_id, use_cache=False)
+    assert event.reminder_sent == 0
+    assert as_aware(event.next_run_time, TAIPEI_TZ) == now + timedelta(days=1) - timedelta(minutes=5)
+
+def test_abandoned_dispatcher_claim_is_caught_up(clean_db, now, line_api):
+    """派送器認領後、寫入 outbox 前行程中斷：重新啟動時由補發送出"""
+    event_id = _add(now - timedelta(minutes=5))
+    before_crash = now - timedelta(minutes=5)
+    assert db.claim_due_events(before_crash, before_crash, now + timedelta(minutes=5))
+
+    assert catch_up_missed(line_api, TAIPEI_TZ, now=now)["late"] == 1
+    assert db.get_event(event_id, use_cache=False).reminder_sent == 1
+    assert len(line_api.pushes) == 1
@@ -0,0 +1,72 @@
+# tests/test_claim_due_events.py (派送器認領與租約)
+
+from datetime import timedelta
+
+import db
+from features.dispatcher import as_aware
+from conftest import TAIPEI_TZ
+
+LEASE = timedelta(minutes=5)
+
+def _add(run_time, **kwargs):
+    return db.add_event('U1', 'U1', 'user', '小明', '開會', run_time, next_run_time=run_time, **kwargs)
+
+def _claim(now, **kwargs):
+    return db.claim_due_events(now, now, now + LEASE, **kwargs)
+
+def test_claims_only_due_events_in_trigger_order(clean_db, now):
+    later = _add(now - timedelta(minutes=1))
+    earlier = _add(now - timedelta(minutes=2))
+    _add(now + timedelta(minutes=1))
+
+    assert [item.id for item in _claim(now)] == [earlier, later]
+
+def test_respects_limit(clean_db, now):
+    ids = [_add(now - timedelta(minutes=minutes)) for minutes in (3, 2, 1)]
+
+    assert [item.id for item in _claim(now, limit=2)] == ids[:2]
+    assert [item.id for item in _claim(now, limit=2)] == ids[2:]
+
+def test_one_shot_claim_keeps_trigger_time_and_takes_lease(clean_db, now):
+    event_id = _add(now - timedelta(minutes=1))
+
+    assert [item.id for item in _claim(now)] == [event_id]
+    event = db.get_event(event_id, use_cache=False)
+    assert as_aware(event.next_run_time, TAIPEI_TZ) == now - timedelta(minutes=1)
+    assert event.reminder_sent == 0
+    # 租約有效期間不會被重複認領
+    assert _claim(now + timedelta(minutes=1)) == []
+
+def test_abandoned_claim_is_reclaimed_after_lease_expires(clean_db, now):
+    """認領後行程中斷 (沒有寫入 outbox)：租約過期後可以再被認領，提醒不會遺失"""
+    event_id = _add(now - timedelta(minutes=1))
+    _claim(now)
+
+    assert [item.id for item in _claim(now + LEASE)] == [event_id]
+
+def test_released_and_sent_event_is_not_claimed_again(clean_db, now):
+    event_id = _add(now - timedelta(minutes=1))
+    _claim(now)
+    assert db.release_event_claim(event_id)
+    assert db.mark_reminder_sent(event_id)
+
+    assert _claim(now + LEASE) == []
+    assert db.get_missed_events(now + LEASE) == []
+
+def test_rescheduling_clears_the_lease(clean_db, now):
+    event_id = _add(now - timedelta(minutes=1))
+    _claim(now)
+    db.set_next_run_time(event_id, now + timedelta(minutes=1))
+
+    assert [item.id for item in _claim(now + timedelta(minutes=1))] == [event_id]
+
+def test_recurring_claim_advances_trigger_time(clean_db, now):
+    event_id = _add(now - timedelta(minutes=1), is_recurring=1, recurrence_rule='DAILY|09:59')
+    next_day = now + timedelta(days=1) - timedelta(minutes=1)
+
+    claimed = _claim(now, advance=lambda event: next_day)
+    assert [(item.id, item.is_recurring) for item in claimed] == [(event_id, 1)]
+    event = db.get_event(event_id, use_cache=False)
+    assert as_aware(event.next_run_time, TAIPEI_TZ) == next_day
+    # 推進後不需要租約，下一次到期時直接認領
+    assert [item.id for item in _claim(next_day)] == [event_id]
@@ -0,0 +1,66 @@
+# tests/test_dispatcher.py (派送器認領後被延後、改期或刪除的提醒不能照原時間送出)
+
+from datetime import timedelta
+
+import db
+from features import dispatcher
+from features.dispatcher import is_claim_current
+from conftest import TAIPEI_TZ
+
+class CollectingSender:
+    """只記錄 submit 內容的發送佇列"""
+
+    def __init__(self):
+        self.submitted = []
+
+    def capacity(self):
+        return 100
+
+    def submit(self, event_ids, fire_time):
+        self.submitted.append((event_ids, fire_time))
+
+def _dispatch(monkeypatch, now):
+    monkeypatch.setattr(dispatcher, 'datetime', type('FrozenDatetime', (), {'now': staticmethod(lambda tz: now)}))
+    sender = CollectingSender()
+    dispatcher.dispatch_due_reminders(sender, TAIPEI_TZ, lambda rule, after: None)
+    return sender.submitted
+
+def _snooze(event_id, until):
+    # 與「延後5分鐘」按鈕相同的資料庫操作
+    db.reset_reminder_sent_status(event_id)
+    db.set_next_run_time(event_id, until)
+    db.update_event_snooze(event_id, until, '開會 (延後)')
+
+def test_claim_then_snooze_skips_the_old_fire_time(clean_db, monkeypatch, now):
+    fire_time = now + timedelta(seconds=5)
+    event_id = db.add_event('U1', 'U1', 'user', '小明', '開會', fire_time, next_run_time=fire_time)
+
+    assert _dispatch(monkeypatch, now) == [(event_id, fire_time)]
+    snoozed = fire_time + timedelta(minutes=5)
+    _snooze(event_id, snoozed)
+
+    # 到了原本的觸發時間：重新讀取事件，認領的時間已經不是目前的時間
+    assert not is_claim_current(db.get_event(event_id, use_cache=False), fire_time, TAIPEI_TZ)
+    # 延後後的時間照常被認領、送出
+    assert _dispatch(monkeypatch, snoozed) == [(event_id, snoozed)]
+    assert is_claim_current(db.get_event(event_id, use_cache=False), snoozed, TAIPEI_TZ)
+
+def test_claim_is_current_until_the_event_changes(clean_db, monkeypatch, now):
+    fire_time = now + timedelta(seconds=5)
+    event_id = db.add_event('U1', 'U1', 'user', '小明', '開會', fire_time, next_run_time=fire_time)
+    _dispatch(monkeypatch, now)
+
+    assert is_claim_current(db.get_event(event_id, use_cache=False), fire_time, TAIPEI_TZ)
+    db.clear_next_run_time(event_id)
+    assert not is_claim_current(db.get_event(event_id, use_cache=False), fire_time, TAIPEI_TZ)
+
+def test_recurring_claim_follows_the_current_rule(clean_db, now):
+    # 2026-10-17 是週六
+    fire_time = now.replace(hour=10, minute=0)
+    event_id = db.add_event('U1', 'U1', 'user', '小明', '運動', fire_time, is_recurring=1,
+                            recurrence_rule='SAT|10:00', next_run_time=fire_time + timedelta(weeks=1))
+    event = db.get_event(event_id, use_cache=False)
+
+    assert is_claim_current(event, fire_time, TAIPEI_TZ)
+    assert not is_claim_current(event._replace(recurrence_rule='SUN|10:00'), fire_time, TAIPEI_TZ)
+    assert not is_claim_current(event._replace(recurrence_rule='SAT|11:00'), fire_time, TAIPEI_TZ)
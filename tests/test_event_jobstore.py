@@ -0,0 +1,61 @@
+# tests/test_event_jobstore.py (jobs 模式：EventJobStore 與啟動時的補發順序)
+
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.schedulers.background import BackgroundScheduler
+
+import db
+from features.catch_up import catch_up_missed
+from features.event_jobstore import EventJobStore
+from conftest import TAIPEI_TZ
+
+JOB_DEFAULTS = {'coalesce': True, 'max_instances': 1, 'misfire_grace_time': 30}
+
+@pytest.fixture
+def scheduler():
+    jobstore = EventJobStore(TAIPEI_TZ, JOB_DEFAULTS, poll_seconds=1)
+    fired = []
+    jobstore.bind(fired.append, lambda slot: None)
+    scheduler = BackgroundScheduler(
+        jobstores={'default': jobstore, 'memory': MemoryJobStore()}, job_defaults=JOB_DEFAULTS, timezone=TAIPEI_TZ
+    )
+    scheduler.fired = fired
+    yield scheduler
+    if scheduler.running:
+        scheduler.shutdown(wait=False)
+
+def _wait_for(condition, timeout=3):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+def _add(run_time):
+    return db.add_event('U1', 'U1', 'user', '小明', '開會', run_time, next_run_time=run_time)
+
+def test_due_reminder_is_fired(clean_db, scheduler):
+    event_id = _add(datetime.now(TAIPEI_TZ) + timedelta(milliseconds=300))
+    scheduler.start()
+
+    assert _wait_for(lambda: scheduler.fired == [event_id])
+
+def test_reminder_missed_during_downtime_survives_startup(clean_db, scheduler, line_api):
+    """
+    停機期間錯過、超過 misfire_grace_time 的提醒：排程器啟動時會把它當成 misfire 略過並清掉 next_run_time，
+    所以必須在 scheduler.start() 之前先補發 (app.prepare_jobs)。
+    """
+    event_id = _add(datetime.now(TAIPEI_TZ) - timedelta(minutes=10))
+
+    assert catch_up_missed(line_api, TAIPEI_TZ, grace_seconds=0)["late"] == 1
+    scheduler.start()
+    time.sleep(0.3)
+
+    event = db.get_event(event_id, use_cache=False)
+    assert (event.reminder_sent, event.next_run_time) == (1, None)
+    assert len(line_api.pushes) == 1
+    assert scheduler.fired == []
@@ -0,0 +1,60 @@
+# tests/test_event_mutators.py (事件的條件式更新與唯讀資料列)
+
+from datetime import timedelta
+
+import pytest
+
+import db
+from features.dispatcher import as_aware
+from conftest import TAIPEI_TZ
+
+def _add(now, **kwargs):
+    return db.add_event('U1', 'U1', 'user', '小明', '開會', now, **kwargs)
+
+def test_decrease_remaining_repeats_stops_at_zero(clean_db, now):
+    event_id = _add(now, priority_level=2, remaining_repeats=2)
+
+    assert [db.decrease_remaining_repeats(event_id) for _ in range(3)] == [1, 0, 0]
+    assert db.get_event(event_id).remaining_repeats == 0
+
+def test_mutators_report_missing_events(clean_db, now):
+    assert not db.mark_reminder_sent(999)
+    assert not db.update_event_content(999, '新內容')
+    assert not db.reschedule_event_time(999, now)
+    assert db.decrease_remaining_repeats(999) == 0
+
+def test_reschedule_resets_sent_status(clean_db, now):
+    event_id = _add(now)
+    db.mark_reminder_sent(event_id)
+    later = now + timedelta(days=1)
+
+    assert db.reschedule_event_time(event_id, later)
+    event = db.get_event(event_id)
+    assert event.reminder_sent == 0
+    assert as_aware(event.event_datetime, TAIPEI_TZ) == later
+    assert as_aware(event.reminder_time, TAIPEI_TZ) == later
+
+def test_updates_invalidate_the_event_cache(clean_db, now):
+    event_id = _add(now)
+    assert db.get_event(event_id).event_content == '開會'
+
+    db.update_event_snooze(event_id, now + timedelta(minutes=5), '開會 (延)')
+    assert db.get_event(event_id).event_content == '開會 (延)'
+
+def test_delete_checks_the_owner(clean_db, now):
+    event_id = _add(now)
+
+    assert db.delete_event_by_id(event_id, 'U2') == {"status": "not_found"}
+    assert db.delete_event_by_id(event_id, 'U1')["status"] == "success"
+    assert db.get_event(event_id) is None
+
+def test_unit_of_work_rolls_back_every_write(clean_db, now):
+    event_id = _add(now)
+    with pytest.raises(RuntimeError):
+        with db.unit_of_work():
+            db.update_event_content(event_id, '改了')
+            db.mark_reminder_sent(event_id)
+            raise RuntimeError
+
+    event = db.get_event(event_id, use_cache=False)
+    assert (event.event_content, event.reminder_sent) == ('開會', 0)
@@ -0,0 +1,47 @@
+# tests/test_intent_classifier.py (提醒意圖分類器)
+
+import os
+import json
+
+import pytest
+
+from features.intent_classifier import classify_intent, record_parse, intent_stats
+from features.time_parser import parse_time_expression
+
+SAMPLES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            'benchmarks', 'intent_samples.jsonl')
+
+def _classify(text, now, source='user'):
+    return classify_intent(text, source, parse_time_expression(text, now))
+
+@pytest.mark.parametrize('text', ['明天早上九點提醒我開會', '10分鐘後關火', '記得25號繳房租', '下週三下午3點半交報告'])
+def test_reminders(now, text):
+    assert _classify(text, now).is_reminder
+
+@pytest.mark.parametrize('text', ['我買了3個蘋果', '昨天下午3點開完會了', '現在幾點了？', '哈哈笑死', 'https://example.com/2026/10/17'])
+def test_chatter(now, text):
+    assert not _classify(text, now).is_reminder
+
+def test_group_threshold_is_stricter():
+    # 分數介於兩個門檻之間 (約 0.57) 的訊息：私訊算提醒，群組不算
+    assert classify_intent('明天開會', 'user').is_reminder
+    assert not classify_intent('明天開會', 'group').is_reminder
+    assert not classify_intent('明天開會', 'room').is_reminder
+
+def test_stats_count_avoided_ai_calls(now):
+    before = intent_stats()
+    _classify('哈哈笑死', now)
+    record_parse(used_ai=False)
+    record_parse(used_ai=True)
+    after = intent_stats()
+    assert after['rejected'] - before['rejected'] == 1
+    assert after['ai_calls'] - before['ai_calls'] == 1
+    assert after['ai_calls_avoided'] - before['ai_calls_avoided'] == 2
+
+def test_labeled_samples_accuracy(now):
+    """benchmarks/intent_samples.jsonl 的準確率不得低於 95% (調整權重後的回歸檢查)"""
+    with open(SAMPLES_PATH, encoding='utf-8') as f:
+        samples = [json.loads(line) for line in f if line.strip()]
+    wrong = [sample['text'] for sample in samples
+             if _classify(sample['text'], now, sample['source']).is_reminder != bool(sample['label'])]
+    assert len(wrong) <= len(samples) * 0.05, wrong
@@ -0,0 +1,101 @@
+# tests/test_outbox.py (multicast 失敗時的重送：明確拒絕才改逐筆，結果不明則以同一個 key 重送同一批)
+
+from datetime import timedelta
+
+from linebot.exceptions import LineBotApiError
+from linebot.models import TextSendMessage
+from linebot.models.error import Error
+
+import db
+from features import outbox
+from conftest import FakeLineApi
+
+class FlakyLineApi(FakeLineApi):
+    """前幾次 multicast 丟出指定的錯誤，並記錄每次 multicast 使用的 retry key"""
+
+    def __init__(self, *errors):
+        super().__init__()
+        self.errors = list(errors)
+        self.multicast_keys = []
+
+    def multicast(self, to, messages, notification_disabled=False, timeout=None, retry_key=None):
+        self.multicast_keys.append((tuple(to), retry_key))
+        if self.errors:
+            raise self.errors.pop(0)
+        super().multicast(to, messages, retry_key=retry_key)
+
+def _error(status_code):
+    return LineBotApiError(status_code=status_code, headers={}, error=Error(message=f"HTTP {status_code}"))
+
+def _enqueue_same_reminder(*user_ids):
+    for user_id in user_ids:
+        outbox.enqueue_push(user_id, TextSendMessage(text="⏰ 提醒！記得要「喝水」喔！"))
+
+def _claim_all():
+    later = outbox._now() + timedelta(days=1)
+    return db.claim_outbox_batch(later, later + timedelta(minutes=1), limit=500)
+
+def _statuses():
+    session = db.SessionLocal()
+    try:
+        return {row.target_id: (row.status, row.multicast_key) for row in session.query(db.OutboxMessage)}
+    finally:
+        session.close()
+
+def test_ambiguous_multicast_failure_is_retried_as_the_same_group(clean_db):
+    _enqueue_same_reminder('U1', 'U2', 'U3')
+    line_api = FlakyLineApi(_error(500))
+
+    assert outbox.deliver_all(line_api, _claim_all()) == (0, 1)
+    assert line_api.pushes == []  # 不能改成逐筆 push：LINE 可能已經送出
+    statuses = _statuses()
+    assert {status for status, _ in statuses.values()} == {'pending'}
+    assert len({key for _, key in statuses.values()}) == 1
+
+    # 新加入相同內容的提醒，不會混進上次結果不明的那一批
+    _enqueue_same_reminder('U4')
+    rows = _claim_all()
+    assert sorted(kind for kind, _ in outbox.plan(rows)) == ['multicast', 'push']
+    assert outbox.deliver_all(line_api, rows)[0] == 4
+
+    (first_to, first_key), (second_to, second_key) = line_api.multicast_keys
+    assert sorted(first_to) == sorted(second_to) == ['U1', 'U2', 'U3']
+    assert first_key == second_key
+    assert {status for status, _ in _statuses().values()} == {'sent'}
+
+def test_timeouts_are_treated_as_ambiguous(clean_db):
+    _enqueue_same_reminder('U1', 'U2')
+    line_api = FlakyLineApi(_error(408))
+
+    outbox.deliver_all(line_api, _claim_all())
+
+    assert line_api.pushes == []
+    assert all(key for _, key in _statuses().values())
+
+def test_retry_accepted_earlier_is_marked_sent(clean_db):
+    _enqueue_same_reminder('U1', 'U2')
+    line_api = FlakyLineApi(ConnectionResetError(), _error(409))
+
+    outbox.deliver_all(line_api, _claim_all())
+    assert outbox.deliver_all(line_api, _claim_all()) == (2, 1)
+
+    assert line_api.pushes == []
+    assert {status for status, _ in _statuses().values()} == {'sent'}
+
+def test_rejected_multicast_falls_back_to_single_pushes(clean_db):
+    _enqueue_same_reminder('U1', 'U2')
+    line_api = FlakyLineApi(_error(400))
+
+    assert outbox.deliver_all(line_api, _claim_all()) == (2, 1)
+
+    assert sorted(to for to, _ in line_api.pushes) == ['U1', 'U2']
+    assert _statuses() == {'U1': ('sent', None), 'U2': ('sent', None)}
+
+def test_claim_keeps_an_in_doubt_group_together(clean_db):
+    _enqueue_same_reminder('U1', 'U2', 'U3')
+    outbox.deliver_all(FlakyLineApi(_error(503)), _claim_all())
+
+    later = outbox._now() + timedelta(days=1)
+    rows = db.claim_outbox_batch(later, later + timedelta(minutes=1), limit=1)
+
+    assert sorted(row.target_id for row in rows) == ['U1', 'U2', 'U3']
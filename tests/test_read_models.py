@@ -0,0 +1,35 @@
+# tests/test_read_models.py (查詢函式回傳的唯讀資料列)
+
+import pytest
+
+import db
+
+def test_get_event_returns_an_immutable_row(clean_db, now):
+    event_id = db.add_event('U1', 'U1', 'user', '小明', '開會', now)
+    event = db.get_event(event_id)
+
+    assert isinstance(event, db.EventRow)
+    assert (event.id, event.event_content, event.target_display_name) == (event_id, '開會', '小明')
+    with pytest.raises(AttributeError):
+        event.event_content = '改了'
+
+def test_location_rows_project_only_needed_columns(clean_db):
+    db.add_location('U1', '公司', '台北市信義區', 25.03, 121.56)
+    db.add_location('U1', '家', None, 25.01, 121.46)
+
+    names = db.get_all_locations_by_user('U1')
+    assert [type(row) for row in names] == [db.LocationNameRow] * 2
+    assert sorted(row.name for row in names) == ['公司', '家']
+
+    location = db.get_location_by_name('U1', '公司')
+    assert isinstance(location, db.LocationRow)
+    assert (location.address, location.latitude, location.longitude) == ('台北市信義區', 25.03, 121.56)
+    assert db.get_location_by_name('U1', '學校') is None
+
+def test_memory_rows(clean_db):
+    db.save_memory('U1', 'wifi', '密碼是 12345678')
+
+    memory = db.get_memory('U1', 'wifi')
+    assert isinstance(memory, db.MemoryRow)
+    assert memory.content == '密碼是 12345678'
+    assert [(type(row), row.keyword) for row in db.get_all_memories('U1')] == [(db.MemoryKeywordRow, 'wifi')]
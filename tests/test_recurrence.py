@@ -0,0 +1,70 @@
+# tests/test_recurrence.py (週期規則的編譯與觸發時間)
+
+from datetime import date, datetime
+
+import pytest
+
+from features.recurrence import compile_rule, normalize_rule
+from conftest import TAIPEI_TZ
+
+def _at(*args):
+    return TAIPEI_TZ.localize(datetime(*args))
+
+def _times(rule_str, after, k):
+    return [f"{dt:%Y-%m-%d %a %H:%M}" for dt in compile_rule(rule_str).next_occurrences(after, TAIPEI_TZ, k)]
+
+# 2026-10-17 是星期六
+SATURDAY = _at(2026, 10, 17, 10, 0)
+
+def test_legacy_weekly_rule():
+    assert _times('MON,WED|23:00', SATURDAY, 3) == [
+        '2026-10-19 Mon 23:00', '2026-10-21 Wed 23:00', '2026-10-26 Mon 23:00',
+    ]
+
+def test_occurrence_at_after_is_excluded():
+    assert _times('DAILY|10:00', SATURDAY, 2) == ['2026-10-18 Sun 10:00', '2026-10-19 Mon 10:00']
+    assert _times('DAILY|10:01', SATURDAY, 1) == ['2026-10-17 Sat 10:01']
+
+def test_monthly_day_falls_back_to_month_end():
+    assert _times('MONTHLY:31|09:00', SATURDAY, 3) == [
+        '2026-10-31 Sat 09:00', '2026-11-30 Mon 09:00', '2026-12-31 Thu 09:00',
+    ]
+
+def test_nth_and_last_weekday_of_month():
+    assert _times('MONTHLY:2TUE|09:00', SATURDAY, 2) == ['2026-11-10 Tue 09:00', '2026-12-08 Tue 09:00']
+    assert _times('MONTHLY:-1FRI|18:00', SATURDAY, 2) == ['2026-10-30 Fri 18:00', '2026-11-27 Fri 18:00']
+
+def test_interval_is_anchored_to_start():
+    assert _times('DAILY|08:00;INTERVAL=3;START=2026-10-16', SATURDAY, 3) == [
+        '2026-10-19 Mon 08:00', '2026-10-22 Thu 08:00', '2026-10-25 Sun 08:00',
+    ]
+    assert _times('MON|08:00;INTERVAL=2;START=2026-10-12', SATURDAY, 2) == [
+        '2026-10-26 Mon 08:00', '2026-11-09 Mon 08:00',
+    ]
+
+def test_count_and_until_end_the_rule():
+    rule = compile_rule('DAILY|08:00;START=2026-10-17;COUNT=3')
+    assert rule.last_date == date(2026, 10, 19)
+    assert _times('DAILY|08:00;START=2026-10-17;COUNT=3', SATURDAY, 5) == [
+        '2026-10-18 Sun 08:00', '2026-10-19 Mon 08:00',
+    ]
+    assert compile_rule('DAILY|08:00;UNTIL=2026-10-17').next_after(SATURDAY, TAIPEI_TZ) is None
+
+def test_normalized_spec_and_shared_compilation():
+    assert normalize_rule('wed,mon|9:05') == 'MON,WED|09:05'
+    assert normalize_rule('MON,TUE,WED,THU,FRI,SAT,SUN|07:00') == 'DAILY|07:00'
+    assert compile_rule('MON,WED|23:00') is compile_rule('MON,WED|23:00')
+
+def test_slot_based_rules():
+    assert compile_rule('MON,WED|23:00').is_slot_based
+    assert not compile_rule('MONTHLY:15|09:00').is_slot_based
+    assert not compile_rule('DAILY|08:00;UNTIL=2026-12-31').is_slot_based
+    assert compile_rule('MON,WED|23:00').weekly_minutes() == [(0, 1380), (2, 1380)]
+
+@pytest.mark.parametrize('rule_str', [
+    '', 'MON', 'XYZ|10:00', 'MON|25:00', 'MONTHLY:32|09:00', 'MONTHLY:6TUE|09:00',
+    'DAILY|08:00;INTERVAL=2', 'DAILY|08:00;COUNT=0;START=2026-10-17', 'DAILY|08:00;FOO=1',
+])
+def test_invalid_rules_raise_value_error(rule_str):
+    with pytest.raises(ValueError):
+        compile_rule(rule_str)
@@ -0,0 +1,74 @@
+# tests/test_send_queue.py (發送佇列：重新排入的提醒取代舊的觸發時間)
+
+import time
+import threading
+from datetime import datetime, timedelta
+
+from features.send_queue import ReminderSender
+from conftest import TAIPEI_TZ
+
+class Recorder:
+    def __init__(self, expected):
+        self.calls = []
+        self.expected = expected
+        self.done = threading.Event()
+
+    def __call__(self, event_ids, fire_time):
+        self.calls.append((event_ids, fire_time))
+        if len(self.calls) >= self.expected:
+            self.done.set()
+
+def _sender(recorder):
+    return ReminderSender(lambda event_id, fire_time: recorder((event_id,), fire_time), TAIPEI_TZ,
+                          send_batch_func=lambda event_ids, fire_time: recorder(tuple(event_ids), fire_time),
+                          concurrency=2)
+
+def _soon(seconds):
+    return datetime.now(TAIPEI_TZ) + timedelta(seconds=seconds)
+
+def test_resubmitting_with_a_new_fire_time_replaces_the_old_entry():
+    recorder = Recorder(expected=1)
+    sender = _sender(recorder)
+    old, new = _soon(0.1), _soon(0.3)
+
+    assert sender.submit(1, old)
+    assert sender.submit(1, new)
+    assert sender.capacity() == sender.queue_limit - 1
+
+    assert recorder.done.wait(2)
+    assert recorder.calls == [((1,), new)]
+
+def test_same_fire_time_is_queued_once():
+    recorder = Recorder(expected=1)
+    sender = _sender(recorder)
+    fire_time = _soon(0.05)
+
+    assert sender.submit(1, fire_time)
+    assert not sender.submit(1, fire_time)
+
+    assert recorder.done.wait(2)
+    assert recorder.calls == [((1,), fire_time)]
+
+def test_replaced_members_are_removed_from_a_group():
+    recorder = Recorder(expected=2)
+    sender = _sender(recorder)
+    group_time, moved_time = _soon(0.1), _soon(0.3)
+
+    sender.submit((1, 2, 3), group_time)
+    sender.submit(2, moved_time)
+
+    assert recorder.done.wait(2)
+    assert recorder.calls == [((1, 3), group_time), ((2,), moved_time)]
+
+def test_clear_drops_pending_entries():
+    recorder = Recorder(expected=1)
+    sender = _sender(recorder)
+    sender.submit((1, 2), _soon(0.2))
+
+    assert sender.clear() == 2
+    sender.submit(3, _soon(0.05))
+
+    assert recorder.done.wait(2)
+    time.sleep(0.3)  # 被清掉的那組原本的觸發時間已過
+    assert recorder.calls[0][0] == (3,)
+    assert len(recorder.calls) == 1
@@ -0,0 +1,83 @@
+# tests/test_state_store.py (對話狀態：每位使用者各自的鎖與狀態的讀寫)
+
+import threading
+
+import pytest
+
+from features.state_store import (
+    create_state_store, AwaitingLocation, AwaitingRecurringContent, encode_state, decode_state
+)
+
+@pytest.fixture(params=['memory', 'db'])
+def store(request, clean_db):
+    return create_state_store(request.param)
+
+def test_set_get_pop(store):
+    state = AwaitingRecurringContent(days=('MON', 'WED'), time='08:00')
+    store.set('U1', state)
+
+    assert store.get('U1') == state
+    assert store.action('U1') == 'awaiting_recurring_content'
+    assert store.pop('U1') == state
+    assert store.get('U1') is None
+
+def test_states_round_trip_through_json():
+    state = AwaitingLocation(name='公司')
+    assert decode_state(encode_state(state)) == state
+    assert decode_state('{"action": "unknown"}') is None
+
+def test_other_users_are_not_blocked(store):
+    held, release = threading.Event(), threading.Event()
+
+    def _hold():
+        with store.lock('U1'):
+            held.set()
+            release.wait(2)
+
+    worker = threading.Thread(target=_hold)
+    worker.start()
+    held.wait(2)
+    try:
+        acquired = threading.Event()
+
+        def _other():
+            with store.lock('U2'):
+                acquired.set()
+
+        other = threading.Thread(target=_other)
+        other.start()
+        other.join(1)
+        assert acquired.is_set()
+    finally:
+        release.set()
+        worker.join()
+
+def test_same_user_waits_for_the_holder(store):
+    order = []
+    held = threading.Event()
+
+    def _first():
+        with store.lock('U1'):
+            held.set()
+            threading.Event().wait(0.1)
+            order.append('first')
+
+    def _second():
+        held.wait(2)
+        with store.lock('U1'):
+            order.append('second')
+
+    threads = [threading.Thread(target=_first), threading.Thread(target=_second)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert order == ['first', 'second']
+
+def test_lock_is_reentrant_and_released(store):
+    with store.lock('U1'):
+        with store.lock('U1'):
+            store.set('U1', AwaitingLocation(name='家'))
+            assert store.pop('U1') == AwaitingLocation(name='家')
+        assert store.active_locks() == 1
+    assert store.active_locks() == 0
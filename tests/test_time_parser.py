@@ -0,0 +1,72 @@
+# tests/test_time_parser.py (本地中文時間解析)
+
+import os
+import json
+
+import pytest
+
+from features.time_parser import parse_time_expression, is_confident
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           'benchmarks', 'time_parser_corpus.jsonl')
+
+# now 為 2026-10-17 (週六) 10:00
+@pytest.mark.parametrize('text, expected', [
+    ('下午12點開會', '2026-10-17 12:00'),
+    ('下午12點半開會', '2026-10-17 12:30'),
+    ('中午12點吃飯', '2026-10-17 12:00'),
+    ('中午1點午休', '2026-10-17 13:00'),
+    ('下午1點開會', '2026-10-17 13:00'),
+    ('晚上11點59分睡覺', '2026-10-17 23:59'),
+    ('晚上12點收信', '2026-10-18 00:00'),
+    ('晚上12:00收信', '2026-10-18 00:00'),
+    ('明天晚上12點交作業', '2026-10-19 00:00'),
+    ('半夜12點搶票', '2026-10-18 00:00'),
+    ('凌晨12點備份', '2026-10-18 00:00'),
+    ('24點關機', '2026-10-18 00:00'),
+    ('明天凌晨3點看球', '2026-10-18 03:00'),
+])
+def test_edge_hours(now, text, expected):
+    result = parse_time_expression(text, now)
+    assert result['event_datetime'] == expected
+    assert is_confident(result)
+
+def test_past_hour_without_period_means_this_evening(now):
+    result = parse_time_expression('8點吃藥', now)
+    assert (result['event_datetime'], result['event_content']) == ('2026-10-17 20:00', '吃藥')
+    assert is_confident(result)
+
+@pytest.mark.parametrize('text, hour, expected', [
+    ('0點提醒我備份', 10, '2026-10-18 00:00'),
+    ('0點30分提醒我備份', 10, '2026-10-18 00:30'),
+    ('12點提醒我吃飯', 10, '2026-10-17 12:00'),
+    ('12點提醒我吃飯', 13, '2026-10-18 12:00'),
+    ('0點提醒我備份', 23, '2026-10-18 00:00'),
+])
+def test_hour_zero_and_twelve_roll_to_the_next_day(now, text, hour, expected):
+    result = parse_time_expression(text, now.replace(hour=hour))
+    assert result['event_datetime'] == expected
+    assert is_confident(result)
+
+def test_ambiguous_small_hour_is_left_to_gemini(now):
+    assert not is_confident(parse_time_expression('3點開會', now))
+
+@pytest.mark.parametrize('text', ['25點開會', '明天下午3點和後天下午4點都要開會'])
+def test_invalid_or_multiple_times_are_rejected(now, text):
+    assert parse_time_expression(text, now) is None
+
+def test_relative_time(now):
+    assert parse_time_expression('10分鐘後提醒我關火', now) == {
+        'event_content': '關火', 'event_datetime': '2026-10-17 10:10', 'confidence': 0.95
+    }
+    assert parse_time_expression('3天後交報告', now)['event_datetime'] == '2026-10-20 10:00'
+
+def test_corpus_has_no_confident_mistakes(now):
+    """語料中信心足夠、會直接採用的結果必須與標註完全相同 (benchmarks/bench_time_parser.py 的回歸檢查)"""
+    with open(CORPUS_PATH, encoding='utf-8') as f:
+        corpus = [json.loads(line) for line in f if line.strip()]
+    for item in corpus:
+        result = parse_time_expression(item['text'], now)
+        if is_confident(result):
+            assert (result['event_datetime'], result['event_content']) == \
+                (item['event_datetime'], item['event_content']), item['text']
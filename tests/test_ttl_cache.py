@@ -0,0 +1,124 @@
+# tests/test_ttl_cache.py (讀取快取的淘汰、過期與寫入後失效)
+
+from datetime import timedelta
+
+from sqlalchemy import event as sa_event
+
+import db
+
+def test_lru_evicts_least_recently_used():
+    cache = db.TTLCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert cache.stats()['evictions'] == 1
+
+def test_entries_expire_after_ttl(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(db.time, 'monotonic', lambda: clock[0])
+    cache = db.TTLCache(maxsize=8, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2, ttl=5)
+
+    clock[0] += 10
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+
+    clock[0] += 60
+    assert cache.get('a') is None
+    assert cache.stats()['size'] == 0
+
+def test_set_drops_values_read_before_an_invalidation():
+    cache = db.TTLCache(maxsize=8, ttl=60)
+    generation = cache.generation()
+    cache.pop('a')
+
+    assert cache.set('a', 'old', generation=generation) is False
+    assert cache.get('a') is None
+    assert cache.set('a', 'new', generation=cache.generation())
+    assert cache.get('a') == 'new'
+    assert cache.stats()['stale_sets'] == 1
+
+def test_invalidating_other_keys_does_not_drop_the_fill():
+    cache = db.TTLCache(maxsize=8, ttl=60)
+    generation = cache.generation()
+    cache.pop('b')
+
+    assert cache.set('a', 1, generation=generation)
+
+def test_evicted_invalidations_still_drop_older_fills():
+    cache = db.TTLCache(maxsize=2, ttl=60)
+    generation = cache.generation()
+    for key in ('a', 'b', 'c'):
+        cache.pop(key)
+
+    # 'a' 的失效紀錄已被擠出，仍要以保守的世代下限判斷
+    assert cache.set('a', 1, generation=generation) is False
+    assert cache.set('d', 1, generation=generation) is False
+    assert cache.set('a', 1, generation=cache.generation())
+
+def test_clear_drops_in_flight_fills():
+    cache = db.TTLCache(maxsize=8, ttl=60)
+    generation = cache.generation()
+    cache.clear()
+
+    assert cache.set('a', 1, generation=generation) is False
+
+def test_event_update_invalidates_again_after_commit(clean_db, now):
+    event_id = db.add_event('U1', 'U1', 'user', '小明', '開會', now)
+    stale = db.get_event(event_id)
+
+    def _recache_before_commit(session):
+        # 模擬其他執行緒在 UPDATE 之後、commit 之前把舊資料讀回快取
+        db._event_cache.set(event_id, stale)
+    sa_event.listen(db.SessionLocal, 'before_commit', _recache_before_commit)
+    try:
+        assert db.update_event_content(event_id, '改期開會')
+    finally:
+        sa_event.remove(db.SessionLocal, 'before_commit', _recache_before_commit)
+
+    assert db.get_event(event_id).event_content == '改期開會'
+
+def test_unit_of_work_invalidates_after_commit(clean_db, now):
+    event_id = db.add_event('U1', 'U1', 'user', '小明', '開會', now)
+    stale = db.get_event(event_id)
+
+    with db.unit_of_work():
+        db.update_event_snooze(event_id, now + timedelta(minutes=5), '開會 (延)')
+        db._event_cache.set(event_id, stale)
+
+    assert db.get_event(event_id).event_content == '開會 (延)'
+
+def test_collection_writes_invalidate_their_lists(clean_db):
+    assert db.get_user_cards('U1') == []
+    db.add_user_card('U1', '國泰CUBE')
+    assert db.get_user_cards('U1') == ['國泰CUBE']
+    db.delete_user_card('U1', '國泰CUBE')
+    assert db.get_user_cards('U1') == []
+
+    assert db.get_all_memories('U1') == []
+    db.save_memory('U1', '車位', 'B2-15')
+    assert [row.keyword for row in db.get_all_memories('U1')] == ['車位']
+    db.delete_memory('U1', '車位')
+    assert db.get_all_memories('U1') == []
+
+    assert db.get_all_locations_by_user('U1') == []
+    db.add_location('U1', '公司', '台北市', 25.0, 121.5)
+    assert [row.name for row in db.get_all_locations_by_user('U1')] == ['公司']
+    db.delete_location_by_name('U1', '公司')
+    assert db.get_all_locations_by_user('U1') == []
+
+def test_cached_reads_are_counted(clean_db, now):
+    event_id = db.add_event('U1', 'U1', 'user', '小明', '開會', now)
+    before = db._event_cache.stats()
+
+    db.get_event(event_id)
+    db.get_event(event_id)
+
+    after = db._event_cache.stats()
+    assert after['misses'] == before['misses'] + 1
+    assert after['hits'] == before['hits'] + 1
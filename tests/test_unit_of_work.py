@@ -0,0 +1,82 @@
+# tests/test_unit_of_work.py (一個操作的寫入一次 commit，回覆在 commit 之後才送出)
+
+from datetime import timedelta
+
+import pytest
+
+import db
+from features.line_client import AfterCommitReplies
+
+class RecordingClient:
+    def __init__(self):
+        self.calls = []
+
+    def reply_message(self, reply_token, messages):
+        # 回覆送出時資料必須已經 commit (其他連線讀得到)
+        self.calls.append(('reply', reply_token, _committed_contents()))
+
+    def push_message(self, to, messages):
+        self.calls.append(('push', to, _committed_contents()))
+
+    def get_profile(self, user_id):
+        return f"profile:{user_id}"
+
+def _committed_contents():
+    session = db.SessionLocal()
+    try:
+        return sorted(content for (content,) in session.query(db.Event.event_content))
+    finally:
+        session.close()
+
+def _snooze(event_id, until):
+    # 與「延後5分鐘」按鈕相同的三個寫入
+    db.reset_reminder_sent_status(event_id)
+    db.set_next_run_time(event_id, until)
+    db.update_event_snooze(event_id, until, '開會 (延後)')
+
+def test_replies_are_sent_after_commit(clean_db, now):
+    event_id = db.add_event('U1', 'U1', 'user', '小明', '開會', now)
+    client = RecordingClient()
+    replies = AfterCommitReplies(client)
+
+    with db.unit_of_work():
+        _snooze(event_id, now + timedelta(minutes=5))
+        replies.reply_message('token', 'ok')
+        replies.push_message('U1', 'ok')
+        assert client.calls == []
+
+    assert client.calls == [('reply', 'token', ['開會 (延後)']), ('push', 'U1', ['開會 (延後)'])]
+
+def test_failure_rolls_back_every_write_and_drops_replies(clean_db, now):
+    event_id = db.add_event('U1', 'U1', 'user', '小明', '開會', now)
+    db.mark_reminder_sent(event_id)
+    client = RecordingClient()
+    replies = AfterCommitReplies(client)
+
+    with pytest.raises(RuntimeError):
+        with db.unit_of_work():
+            db.reset_reminder_sent_status(event_id)
+            db.set_next_run_time(event_id, now + timedelta(minutes=5))
+            replies.reply_message('token', 'ok')
+            raise RuntimeError("寫到一半失敗")
+
+    event = db.get_event(event_id, use_cache=False)
+    assert (event.reminder_sent, event.next_run_time) == (1, None)
+    assert client.calls == []
+
+def test_outside_a_unit_of_work_replies_are_immediate(clean_db):
+    client = RecordingClient()
+    AfterCommitReplies(client).reply_message('token', 'ok')
+
+    assert client.calls == [('reply', 'token', [])]
+
+def test_other_calls_pass_through():
+    assert AfterCommitReplies(RecordingClient()).get_profile('U1') == 'profile:U1'
+
+def test_nested_callbacks_wait_for_the_outer_commit(clean_db):
+    calls = []
+    with db.unit_of_work():
+        with db.unit_of_work():
+            db.after_commit(calls.append, 'inner')
+        assert calls == []
+    assert calls == ['inner']
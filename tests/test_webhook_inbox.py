@@ -0,0 +1,123 @@
+# tests/test_webhook_inbox.py (webhook inbox：去重、租約與同一位使用者的處理順序)
+
+import threading
+from datetime import timedelta
+
+from sqlalchemy import event as sa_event
+
+import db
+
+LEASE = timedelta(minutes=2)
+
+def _append(now, *items):
+    """items: (webhook_event_id, source_key)"""
+    return db.append_inbox([(event_id, key, '{}') for event_id, key in items], now)
+
+def _claim(now, limit=50):
+    return [row.webhook_event_id for row in db.claim_inbox_batch(now, now + LEASE, limit=limit)]
+
+def test_redelivered_events_are_ignored(clean_db, now):
+    assert _append(now, ('e1', 'U1'), ('e2', 'U2')) == 2
+    assert _append(now, ('e2', 'U2'), ('e3', 'U3')) == 1
+    assert _claim(now) == ['e1', 'e2', 'e3']
+
+def test_claimed_event_is_leased(clean_db, now):
+    _append(now, ('e1', 'U1'))
+    assert _claim(now) == ['e1']
+    assert _claim(now + timedelta(seconds=1)) == []
+
+    rows = db.claim_inbox_batch(now + LEASE, now + 2 * LEASE)
+    assert [(row.webhook_event_id, row.attempts) for row in rows] == [('e1', 2)]
+
+def test_done_events_are_not_claimed(clean_db, now):
+    _append(now, ('e1', 'U1'))
+    rows = db.claim_inbox_batch(now, now + LEASE)
+    db.mark_inbox_done([row.id for row in rows], now)
+
+    assert _claim(now + LEASE) == []
+    assert db.inbox_counts() == {'done': 1}
+
+def test_exhausted_events_are_failed(clean_db, now):
+    _append(now, ('e1', 'U1'))
+    _claim(now)
+    _claim(now + LEASE)
+
+    assert db.fail_exhausted_inbox(2, now + 2 * LEASE) == 1
+    assert db.inbox_counts() == {'failed': 1}
+
+def test_later_events_of_a_user_wait_for_the_earlier_one(clean_db, now):
+    _append(now, ('a1', 'UA'), ('b1', 'UB'), ('a2', 'UA'))
+    first = db.claim_inbox_batch(now, now + LEASE, limit=1)
+    assert [row.webhook_event_id for row in first] == ['a1']
+
+    # a1 還在處理中 (可能在另一個行程)：a2 不能先被認領，其他使用者不受影響
+    assert _claim(now) == ['b1']
+    assert _claim(now) == []
+
+    db.mark_inbox_done([row.id for row in first], now)
+    assert _claim(now) == ['a2']
+
+def test_consecutive_events_of_a_user_are_claimed_together_in_order(clean_db, now):
+    _append(now, ('a1', 'UA'), ('a2', 'UA'), ('b1', 'UB'), ('a3', 'UA'))
+    assert _claim(now) == ['a1', 'a2', 'b1', 'a3']
+
+def test_split_keys_events_by_source(now):
+    from features.webhook_inbox import _split
+    body = {"destination": "D", "events": [
+        {"webhookEventId": "e1", "source": {"type": "user", "userId": "U1"}},
+        {"webhookEventId": "e2", "source": {"type": "group", "groupId": "G1", "userId": "U2"}},
+        {"source": {"type": "room", "roomId": "R1"}},
+    ]}
+    parts = _split(body)
+    assert [(event_id, key) for event_id, key, _ in parts[:2]] == [('e1', 'U1'), ('e2', 'U2')]
+    assert parts[2][1] == 'R1' and len(parts[2][0]) == 64  # 沒有 webhookEventId 時以內容雜湊代替
+
+def test_keyed_executor_keeps_per_key_order():
+    import threading
+    import time
+    from features.keyed_executor import KeyedExecutor
+
+    executor = KeyedExecutor(workers=4, name="test-keyed")
+    seen = {key: [] for key in 'ABC'}
+    running = set()
+    overlap = threading.Event()
+    lock = threading.Lock()
+
+    def work(key, index):
+        with lock:
+            if key in running:
+                overlap.set()
+            running.add(key)
+        time.sleep(0.001)
+        with lock:
+            running.discard(key)
+            seen[key].append(index)
+
+    futures = [executor.submit(key, work, key, index) for index in range(20) for key in 'ABC']
+    for future in futures:
+        future.result(timeout=5)
+    executor.shutdown()
+
+    assert not overlap.is_set()
+    assert all(indexes == list(range(20)) for indexes in seen.values())
+
+def test_concurrent_claims_do_not_share_events(clean_db, now):
+    """SQLite 沒有 SKIP LOCKED：另一個 worker 在本次查詢之後、更新之前搶先認領，這次就不能再拿到同一筆"""
+    _append(now, ('e1', 'U1'), ('e2', 'U1'), ('e3', 'U2'))
+    other = []
+
+    def _race(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('UPDATE webhook_inbox') and not other:
+            other.append(None)
+            worker = threading.Thread(target=lambda: other.extend(_claim(now)))
+            worker.start()
+            worker.join()
+
+    sa_event.listen(db.engine, 'before_cursor_execute', _race)
+    try:
+        mine = _claim(now)
+    finally:
+        sa_event.remove(db.engine, 'before_cursor_execute', _race)
+
+    assert other[1:] == ['e1', 'e2', 'e3']
+    assert mine == []